@@ -23,6 +23,8 @@ cli_url=""
 cli_org_id=""
 cli_api=""
 cli_namespace=""
+cli_verbose=""
+cli_timings=""
 args=()
 while [[ $# -gt 0 ]]; do
   case "$1" in
@@ -32,6 +34,9 @@ while [[ $# -gt 0 ]]; do
     --org-id)      cli_org_id="$2"; shift 2 ;;
     --api)         cli_api="$2"; shift 2 ;;
     --namespace)   cli_namespace="$2"; shift 2 ;;
+    --verbose)     cli_verbose=1; shift ;;
+    --timings)     cli_timings=1; shift ;;
+    --timings-json) cli_timings=json; shift ;;
     *)             args+=("$1"); shift ;;
   esac
 done
@@ -47,5 +52,7 @@ done
 [[ -n "$cli_org_id" ]]    && export GRAFANA_ORG_ID="$cli_org_id"
 [[ -n "$cli_api" ]]       && export GRAFANA_API_MODE="$cli_api"
 [[ -n "$cli_namespace" ]] && export GRAFANA_NAMESPACE="$cli_namespace"
+[[ -n "$cli_verbose" ]]   && export GRAFANA_VERBOSE=1
+[[ -n "$cli_timings" ]]   && export GRAFANA_TIMINGS="$cli_timings"
 
 exec gtimeout "$timeout" "${SCRIPT_DIR}/grafana.py" "${args[@]}"
@@ -0,0 +1,8772 @@
+"""Grafana API CLI — manage dashboards, folders, datasources, annotations, and alerting.
+
+The implementation behind ``grafana.py``. It lives in an importable module so
+Python caches its bytecode: compiling this file on every call would cost more
+than the rest of the startup together.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import sys
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+# httpx is imported where the client is built and used, so offline commands
+# (validate, convert, cache) and --help start without loading it.
+
+# ---------------------------------------------------------------------------
+# Exceptions (Phase 1)
+# ---------------------------------------------------------------------------
+
+
+class GrafanaAPIError(Exception):
+    """Base exception for Grafana API errors."""
+
+    def __init__(self, message: str, status_code: int, response: Any):
+        self.message = message
+        self.status_code = status_code
+        self.response = response
+        super().__init__(f"[{status_code}] {message}")
+
+
+class ConflictError(GrafanaAPIError):
+    """HTTP 409 — K8s-style API resource version conflict."""
+
+    pass
+
+
+class PreconditionFailedError(GrafanaAPIError):
+    """HTTP 412 — Legacy API version mismatch."""
+
+    pass
+
+
+# ---------------------------------------------------------------------------
+# Merge conflict types (Phase 6)
+# ---------------------------------------------------------------------------
+
+
+@dataclass
+class BothModified:
+    path: str
+    base_val: Any
+    our_val: Any
+    their_val: Any
+
+
+@dataclass
+class DeleteModify:
+    path: str
+    surviving_val: Any
+
+
+@dataclass
+class BothAdded:
+    path: str
+    our_val: Any
+    their_val: Any
+
+
+Conflict = BothModified | DeleteModify | BothAdded
+
+# ---------------------------------------------------------------------------
+# Client
+# ---------------------------------------------------------------------------
+
+# Throttling and gateway errors worth retrying on idempotent calls.
+_RETRY_STATUSES = (429, 502, 503, 504)
+
+# Methods that are safe to repeat. POSTs opt in per call (e.g. ds queries).
+_IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+# httpcore trace events (``<scope>.<event>.started|complete``) by timing phase.
+# DNS resolution happens inside connect_tcp, so it is part of ``connect``.
+_TRACE_PHASES = {
+    "connect_tcp": "connect",
+    "connect_unix_socket": "connect",
+    "start_tls": "tls",
+    "send_request_headers": "send",
+    "send_request_body": "send",
+    "receive_response_headers": "wait",
+    "receive_response_body": "download",
+}
+
+
+@dataclass
+class RequestTiming:
+    """Wall-clock cost of one logical API call, including retries.
+
+    With ``GRAFANA_TIMINGS`` set, ``phases`` splits the last attempt into
+    connect (DNS + TCP), tls, send, wait (time to first byte after the
+    request was sent) and download, ``bytes`` is the body size on the
+    wire and ``decode_ms`` the JSON decode time.
+    """
+
+    method: str
+    endpoint: str
+    status: int | None
+    attempts: int
+    elapsed_ms: float
+    http_version: str = ""
+    phases: dict[str, float] = field(default_factory=dict)
+    bytes: int = 0
+    decode_ms: float = 0.0
+
+    def tracer(self) -> Any:
+        """httpx ``trace`` extension that accumulates phase times into ``phases``."""
+        import time as _time
+
+        started: dict[str, float] = {}
+
+        def trace(event: str, _info: dict) -> None:
+            scope, _, edge = event.rpartition(".")
+            phase = _TRACE_PHASES.get(scope.rpartition(".")[2])
+            if phase is None:
+                return
+            if edge == "started":
+                started[scope] = _time.perf_counter()
+            elif scope in started:
+                elapsed = (_time.perf_counter() - started.pop(scope)) * 1000
+                self.phases[phase] = self.phases.get(phase, 0.0) + elapsed
+
+        return trace
+
+
+class GrafanaClient:
+    """Thin HTTP wrapper around the Grafana REST API.
+
+    Connections are pooled (``GRAFANA_MAX_CONNECTIONS``) and, with
+    ``GRAFANA_HTTP2=1`` and the ``h2`` package installed, multiplexed over
+    HTTP/2. Idempotent calls are retried on 429/502/503/504 and connection
+    errors with Retry-After-aware exponential backoff (``GRAFANA_MAX_RETRIES``).
+    Every call is recorded in ``timings``; ``GRAFANA_VERBOSE=1`` logs them.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        token: str,
+        org_id: int | None = None,
+        timeout: float = 30.0,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.org_id = org_id
+        self.token = token
+        headers: dict[str, str] = {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+        }
+        if org_id:
+            headers["X-Grafana-Org-Id"] = str(org_id)
+        import httpx
+
+        max_connections = int(os.environ.get("GRAFANA_MAX_CONNECTIONS", "20"))
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=30.0,
+        )
+        self.timings: list[RequestTiming] = []
+        self.metadata = MetadataCache(self.base_url, org_id, token)
+        self.reload_settings()
+        self._client = httpx.Client(
+            headers=headers,
+            timeout=httpx.Timeout(timeout, connect=min(timeout, 10.0)),
+            limits=limits,
+            http2=self._http2_enabled(),
+        )
+
+    def reload_settings(self) -> None:
+        """Re-read the per-call ``GRAFANA_*`` tuning variables (retries, logging, metadata TTL)."""
+        self.max_retries = int(os.environ.get("GRAFANA_MAX_RETRIES", "4"))
+        self.verbose = os.environ.get("GRAFANA_VERBOSE", "0") not in ("", "0")
+        self.trace = os.environ.get("GRAFANA_TIMINGS", "0") not in ("", "0")
+        self.metadata.reload_settings()
+
+    @staticmethod
+    def _http2_enabled() -> bool:
+        if os.environ.get("GRAFANA_HTTP2", "0") in ("", "0"):
+            return False
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            print(
+                "WARNING: GRAFANA_HTTP2 is set but the 'h2' package is missing; "
+                "using HTTP/1.1. Add it with: uv add --script grafana.py 'httpx[http2]'",
+                file=sys.stderr,
+            )
+            return False
+        return True
+
+    # -- low-level --------------------------------------------------------
+
+    @staticmethod
+    def _retry_after(resp: httpx.Response | None, attempt: int) -> float:
+        """Seconds to wait before the next attempt.
+
+        Honours ``Retry-After`` (seconds or HTTP date, capped at 60 s);
+        otherwise exponential backoff with jitter, capped at 10 s.
+        """
+        import random
+        import time as _time
+        from email.utils import parsedate_to_datetime
+
+        header = resp.headers.get("Retry-After", "") if resp is not None else ""
+        if header:
+            try:
+                return min(max(float(header), 0.0), 60.0)
+            except ValueError:
+                pass
+            try:
+                when = parsedate_to_datetime(header).timestamp()
+                return min(max(when - _time.time(), 0.0), 60.0)
+            except (TypeError, ValueError):
+                pass
+        return min(2**attempt, 10) * random.uniform(0.5, 1.0)
+
+    def _send(
+        self,
+        method: str,
+        endpoint: str,
+        *,
+        params: dict | None = None,
+        json_body: Any = None,
+        idempotent: bool | None = None,
+        headers: dict[str, str] | None = None,
+        stream: bool = False,
+    ) -> httpx.Response:
+        """Send one request, retrying transient failures of idempotent calls.
+
+        With ``stream``, the body is left unread; the caller must close the
+        response. The call's RequestTiming is in ``resp.extensions["timing"]``.
+        """
+        import time as _time
+
+        import httpx
+
+        if idempotent is None:
+            idempotent = method in _IDEMPOTENT_METHODS
+        url = f"{self.base_url}{endpoint}"
+        start = _time.perf_counter()
+        timing = RequestTiming(method, endpoint, None, 0, 0.0)
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                request = self._client.build_request(
+                    method, url, params=params, json=json_body, headers=headers
+                )
+                if self.trace:
+                    # Phases of the last attempt only; elapsed covers all of them.
+                    timing.phases.clear()
+                    request.extensions["trace"] = timing.tracer()
+                resp = self._client.send(request, stream=stream)
+            except (httpx.ConnectError, httpx.RemoteProtocolError) as exc:
+                # Nothing reached the server (or the connection was reset):
+                # safe to resend for idempotent calls only.
+                if not idempotent or attempts > self.max_retries:
+                    raise
+                wait = self._retry_after(None, attempts)
+                print(
+                    f"{type(exc).__name__} on {method} {endpoint}; retrying in {wait:.1f}s",
+                    file=sys.stderr,
+                )
+                _time.sleep(wait)
+                continue
+            if (
+                idempotent
+                and resp.status_code in _RETRY_STATUSES
+                and attempts <= self.max_retries
+            ):
+                wait = self._retry_after(resp, attempts)
+                resp.close()
+                print(
+                    f"HTTP {resp.status_code} on {method} {endpoint}; retrying in {wait:.1f}s",
+                    file=sys.stderr,
+                )
+                _time.sleep(wait)
+                continue
+            break
+        timing.status = resp.status_code
+        timing.attempts = attempts
+        timing.elapsed_ms = (_time.perf_counter() - start) * 1000
+        timing.http_version = resp.http_version
+        if not stream:
+            timing.bytes = resp.num_bytes_downloaded
+        resp.extensions["timing"] = timing
+        self.timings.append(timing)
+        if self.verbose:
+            retries = f" ({attempts} attempts)" if attempts > 1 else ""
+            print(
+                f"{method} {endpoint} {resp.status_code} {timing.elapsed_ms:.0f}ms "
+                f"{timing.http_version}{retries}",
+                file=sys.stderr,
+            )
+        return resp
+
+    def _request(
+        self,
+        method: str,
+        endpoint: str,
+        *,
+        params: dict | None = None,
+        json_body: Any = None,
+        idempotent: bool | None = None,
+        headers: dict[str, str] | None = None,
+    ) -> Any:
+        resp = self._send(
+            method,
+            endpoint,
+            params=params,
+            json_body=json_body,
+            idempotent=idempotent,
+            headers=headers,
+        )
+        import time as _time
+
+        start = _time.perf_counter()
+        try:
+            data = resp.json()
+        except Exception:
+            data = {"message": resp.text}
+        resp.extensions["timing"].decode_ms = (_time.perf_counter() - start) * 1000
+        if not resp.is_success:
+            self._raise_for(resp, data)
+        return data
+
+    @staticmethod
+    def _raise_for(resp: httpx.Response, data: Any) -> None:
+        """Raise the GrafanaAPIError subclass matching a failed response."""
+        msg = data.get("message", resp.text) if isinstance(data, dict) else resp.text
+        if resp.status_code == 409:
+            raise ConflictError(msg, resp.status_code, data)
+        elif resp.status_code == 412:
+            raise PreconditionFailedError(msg, resp.status_code, data)
+        else:
+            raise GrafanaAPIError(msg, resp.status_code, data)
+
+    def _request_safe(
+        self,
+        method: str,
+        endpoint: str,
+        *,
+        params: dict | None = None,
+        json_body: Any = None,
+    ) -> tuple[int, Any]:
+        """Non-raising request — returns (status_code, data) for probing."""
+        resp = self._send(method, endpoint, params=params, json_body=json_body)
+        try:
+            data = resp.json()
+        except Exception:
+            data = {"message": resp.text}
+        return resp.status_code, data
+
+    def get(self, endpoint: str, **kwargs: Any) -> Any:
+        return self._request("GET", endpoint, **kwargs)
+
+    def post(self, endpoint: str, **kwargs: Any) -> Any:
+        return self._request("POST", endpoint, **kwargs)
+
+    def put(self, endpoint: str, **kwargs: Any) -> Any:
+        return self._request("PUT", endpoint, **kwargs)
+
+    def delete(self, endpoint: str, **kwargs: Any) -> Any:
+        return self._request("DELETE", endpoint, **kwargs)
+
+    def patch(self, endpoint: str, **kwargs: Any) -> Any:
+        return self._request("PATCH", endpoint, **kwargs)
+
+    # -- health -----------------------------------------------------------
+
+    def health(self) -> dict:
+        return self.get("/api/health")
+
+    # -- dashboards (legacy) ----------------------------------------------
+
+    def search_dashboards(
+        self,
+        query: str | None = None,
+        tag: str | None = None,
+        folder_uid: str | None = None,
+        limit: int = 100,
+        page: int | None = None,
+        search_type: str = "dash-db",
+    ) -> list[dict]:
+        params: dict[str, Any] = {"type": search_type, "limit": limit}
+        if page:
+            params["page"] = page
+        if query:
+            params["query"] = query
+        if tag:
+            params["tag"] = tag
+        if folder_uid:
+            params["folderUIDs"] = folder_uid
+        return self.get("/api/search", params=params)
+
+    def get_dashboard(self, uid: str) -> dict:
+        return self.get(f"/api/dashboards/uid/{uid}")
+
+    def save_dashboard(
+        self,
+        dashboard: dict,
+        folder_uid: str | None = None,
+        message: str = "",
+        overwrite: bool = False,
+    ) -> dict:
+        body: dict[str, Any] = {"dashboard": dashboard, "overwrite": overwrite}
+        if folder_uid:
+            body["folderUid"] = folder_uid
+        if message:
+            body["message"] = message
+        return self.post("/api/dashboards/db", json_body=body)
+
+    def delete_dashboard(self, uid: str) -> dict:
+        return self.delete(f"/api/dashboards/uid/{uid}")
+
+    def get_dashboard_versions(self, uid: str, limit: int = 20) -> list[dict]:
+        return self.get(f"/api/dashboards/uid/{uid}/versions", params={"limit": limit})
+
+    def restore_dashboard_version(self, uid: str, version: int) -> dict:
+        return self.post(
+            f"/api/dashboards/uid/{uid}/restore", json_body={"version": version}
+        )
+
+    # -- dashboards (K8s-style API, Phase 2) ------------------------------
+
+    K8S_API_BASE = "/apis/dashboard.grafana.app/v1beta1"
+
+    # Asks the API server for metadata only (no spec), falling back to full
+    # objects on servers that cannot project.
+    K8S_METADATA_ACCEPT = (
+        "application/json;as=PartialObjectMetadataList;v=v1;g=meta.k8s.io,"
+        "application/json"
+    )
+
+    def k8s_list_dashboards(
+        self,
+        namespace: str,
+        label_selector: str | None = None,
+        limit: int | None = None,
+        continue_token: str | None = None,
+        field_selector: str | None = None,
+        metadata_only: bool = False,
+    ) -> dict:
+        """One page of dashboards; follow ``metadata.continue`` for the next."""
+        params: dict[str, Any] = {}
+        if label_selector:
+            params["labelSelector"] = label_selector
+        if field_selector:
+            params["fieldSelector"] = field_selector
+        if limit:
+            params["limit"] = limit
+        if continue_token:
+            params["continue"] = continue_token
+        headers = {"Accept": self.K8S_METADATA_ACCEPT} if metadata_only else None
+        return self.get(
+            f"{self.K8S_API_BASE}/namespaces/{namespace}/dashboards",
+            params=params,
+            headers=headers,
+        )
+
+    def k8s_get_dashboard(self, namespace: str, name: str) -> dict:
+        return self.get(f"{self.K8S_API_BASE}/namespaces/{namespace}/dashboards/{name}")
+
+    def k8s_create_dashboard(self, namespace: str, body: dict) -> dict:
+        return self.post(
+            f"{self.K8S_API_BASE}/namespaces/{namespace}/dashboards", json_body=body
+        )
+
+    def k8s_update_dashboard(self, namespace: str, name: str, body: dict) -> dict:
+        """PUT — body must include metadata.resourceVersion for OCC."""
+        return self.put(
+            f"{self.K8S_API_BASE}/namespaces/{namespace}/dashboards/{name}",
+            json_body=body,
+        )
+
+    def k8s_delete_dashboard(self, namespace: str, name: str) -> dict:
+        return self.delete(
+            f"{self.K8S_API_BASE}/namespaces/{namespace}/dashboards/{name}"
+        )
+
+    def detect_api_mode(self) -> str:
+        """Probe K8s endpoint; return 'k8s' if available, else 'legacy'."""
+        return self.probe_api_mode()[0]
+
+    def probe_api_mode(self) -> tuple[str, bool]:
+        """``(mode, conclusive)``; only a 2xx or a 404 tells which API exists."""
+        status, _ = self._request_safe("GET", f"{self.K8S_API_BASE}/")
+        if status == 404:
+            return "legacy", True
+        return "k8s", status < 400
+
+    # -- folders ----------------------------------------------------------
+
+    def list_folders(self, limit: int = 1000) -> list[dict]:
+        return self.get("/api/folders", params={"limit": limit})
+
+    def get_folder(self, uid: str) -> dict:
+        return self.get(f"/api/folders/{uid}")
+
+    def create_folder(
+        self, title: str, uid: str | None = None, parent_uid: str | None = None
+    ) -> dict:
+        body: dict[str, Any] = {"title": title}
+        if uid:
+            body["uid"] = uid
+        if parent_uid:
+            body["parentUid"] = parent_uid
+        return self.post("/api/folders", json_body=body)
+
+    def delete_folder(self, uid: str, force_delete_rules: bool = False) -> dict:
+        return self.delete(
+            f"/api/folders/{uid}", params={"forceDeleteRules": force_delete_rules}
+        )
+
+    # -- datasources ------------------------------------------------------
+
+    def list_datasources(self) -> list[dict]:
+        return self.get("/api/datasources")
+
+    def datasource_map(self) -> dict[str, dict]:
+        """Datasource uid -> ``{"type", "name"}``, served from the metadata cache."""
+        return self.metadata.get(
+            "datasources",
+            lambda: {
+                ds["uid"]: {"type": ds.get("type"), "name": ds.get("name")}
+                for ds in self.list_datasources()
+                if ds.get("uid")
+            },
+        )
+
+    def get_datasource(self, uid: str) -> dict:
+        return self.get(f"/api/datasources/uid/{uid}")
+
+    def health_check_datasource(self, uid: str) -> dict:
+        return self.get(f"/api/datasources/uid/{uid}/health")
+
+    def query_datasource(
+        self, queries: list[dict], time_from: str = "now-1h", time_to: str = "now"
+    ) -> dict:
+        """Execute queries via POST /api/ds/query."""
+        # Read-only despite the POST, so it may be retried when throttled.
+        return self.post(
+            "/api/ds/query",
+            json_body={"from": time_from, "to": time_to, "queries": queries},
+            idempotent=True,
+        )
+
+    def query_datasource_stream(
+        self,
+        queries: list[dict],
+        time_from: str = "now-1h",
+        time_to: str = "now",
+        chunk_size: int = 1 << 20,
+    ) -> Any:
+        """Like ``query_datasource`` but yield the raw body in byte chunks.
+
+        Errors (non-2xx) are raised before the first chunk. Feed the chunks to
+        ``DsResponseParser`` to get frames without buffering the body.
+        """
+        resp = self._send(
+            "POST",
+            "/api/ds/query",
+            json_body={"from": time_from, "to": time_to, "queries": queries},
+            idempotent=True,
+            stream=True,
+        )
+        try:
+            if not resp.is_success:
+                resp.read()
+                try:
+                    data = resp.json()
+                except Exception:
+                    data = {"message": resp.text}
+                self._raise_for(resp, data)
+            yield from resp.iter_bytes(chunk_size)
+        finally:
+            resp.extensions["timing"].bytes = resp.num_bytes_downloaded
+            resp.close()
+
+    # -- annotations ------------------------------------------------------
+
+    def query_annotations(
+        self,
+        dashboard_uid: str | None = None,
+        tags: list[str] | None = None,
+        limit: int = 100,
+    ) -> list[dict]:
+        params: dict[str, Any] = {"limit": limit}
+        if dashboard_uid:
+            params["dashboardUID"] = dashboard_uid
+        if tags:
+            params["tags"] = tags
+        return self.get("/api/annotations", params=params)
+
+    def create_annotation(
+        self,
+        text: str,
+        tags: list[str] | None = None,
+        dashboard_uid: str | None = None,
+        time_ms: int | None = None,
+        time_end_ms: int | None = None,
+    ) -> dict:
+        import time as _time
+
+        body: dict[str, Any] = {
+            "text": text,
+            "time": time_ms or int(_time.time() * 1000),
+        }
+        if tags:
+            body["tags"] = tags
+        if dashboard_uid:
+            body["dashboardUID"] = dashboard_uid
+        if time_end_ms:
+            body["timeEnd"] = time_end_ms
+        return self.post("/api/annotations", json_body=body)
+
+    def delete_annotation(self, annotation_id: int) -> dict:
+        return self.delete(f"/api/annotations/{annotation_id}")
+
+    # -- alerting ---------------------------------------------------------
+
+    def list_alert_rules(self) -> list[dict]:
+        return self.get("/api/v1/provisioning/alert-rules")
+
+    def get_alert_rule(self, uid: str) -> dict:
+        return self.get(f"/api/v1/provisioning/alert-rules/{uid}")
+
+    def list_contact_points(self) -> list[dict]:
+        return self.get("/api/v1/provisioning/contact-points")
+
+    def get_notification_policies(self) -> dict:
+        return self.get("/api/v1/provisioning/policies")
+
+    def get_active_alerts(self) -> list[dict]:
+        return self.get("/api/alertmanager/grafana/api/v2/alerts")
+
+    # -- users / org ------------------------------------------------------
+
+    def get_current_user(self) -> dict:
+        return self.get("/api/user")
+
+    def get_current_org(self) -> dict:
+        return self.get("/api/org")
+
+
+# ---------------------------------------------------------------------------
+# Timings
+# ---------------------------------------------------------------------------
+
+
+class _PhaseSpan:
+    """One measured block of a PhaseTimings phase; set ``rows``/``bytes`` inside."""
+
+    __slots__ = ("timings", "phase", "ref_id", "start", "rows", "bytes")
+
+    def __init__(self, timings: PhaseTimings, phase: str, ref_id: str) -> None:
+        self.timings = timings
+        self.phase = phase
+        self.ref_id = ref_id
+        self.rows = self.bytes = 0
+
+    def __enter__(self) -> _PhaseSpan:
+        import time as _time
+
+        self.start = _time.perf_counter()
+        return self
+
+    def __exit__(self, *_exc: Any) -> None:
+        import time as _time
+
+        elapsed = (_time.perf_counter() - self.start) * 1000
+        self.timings.add(self.phase, self.ref_id, elapsed, self.rows, self.bytes)
+
+
+class PhaseTimings:
+    """Client-side processing time per (phase, refId), for ``GRAFANA_TIMINGS``.
+
+    Complements the per-request ``RequestTiming``: frame decoding, export
+    and stream parsing are measured where they happen. When disabled,
+    ``measure`` still returns a span, but nothing is recorded.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.entries: dict[tuple[str, str], list] = {}
+        self._lock: Any = None
+
+    def reset(self, enabled: bool) -> None:
+        import threading
+
+        self.enabled = enabled
+        self.entries = {}
+        self._lock = threading.Lock()
+
+    def measure(self, phase: str, ref_id: str = "") -> _PhaseSpan:
+        return _PhaseSpan(self, phase, ref_id)
+
+    def add(
+        self, phase: str, ref_id: str, ms: float, rows: int = 0, nbytes: int = 0
+    ) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            entry = self.entries.setdefault((phase, ref_id), [0.0, 0, 0, 0])
+            entry[0] += ms
+            entry[1] += 1
+            entry[2] += rows
+            entry[3] += nbytes
+
+
+_PHASES = PhaseTimings()
+
+
+def _size(nbytes: float) -> str:
+    for unit in ("B", "KiB", "MiB"):
+        if nbytes < 1024:
+            return f"{nbytes:.0f} {unit}" if unit == "B" else f"{nbytes:.1f} {unit}"
+        nbytes /= 1024
+    return f"{nbytes:.1f} GiB"
+
+
+def _timings_report(client: GrafanaClient | None, wall_ms: float) -> dict:
+    """Collected request and phase timings as a JSON-ready dict."""
+    requests = [
+        {
+            "method": t.method,
+            "endpoint": t.endpoint,
+            "status": t.status,
+            "attempts": t.attempts,
+            "http_version": t.http_version,
+            "elapsed_ms": round(t.elapsed_ms, 1),
+            **{f"{k}_ms": round(v, 1) for k, v in t.phases.items()},
+            "decode_ms": round(t.decode_ms, 1),
+            "bytes": t.bytes,
+        }
+        for t in (client.timings if client is not None else [])
+    ]
+    phases = [
+        {
+            "phase": phase,
+            "ref_id": ref_id,
+            "ms": round(ms, 1),
+            "calls": calls,
+            "rows": rows,
+            "bytes": nbytes,
+        }
+        for (phase, ref_id), (ms, calls, rows, nbytes) in _PHASES.entries.items()
+    ]
+    http_ms = sum(r["elapsed_ms"] for r in requests)
+    return {
+        "wall_ms": round(wall_ms, 1),
+        "http_ms": round(http_ms, 1),
+        "wait_ms": round(sum(r.get("wait_ms", 0) for r in requests), 1),
+        "decode_ms": round(sum(r["decode_ms"] for r in requests), 1),
+        "client_ms": round(sum(p["ms"] for p in phases), 1),
+        "requests": requests,
+        "phases": phases,
+    }
+
+
+def _print_timings(report: dict) -> None:
+    """Human-readable timing summary on stderr.
+
+    Requests run in parallel (chunks, batches) overlap, so the sums can
+    exceed the wall time.
+    """
+    out = sys.stderr
+    print(f"Timings ({len(report['requests'])} request(s)):", file=out)
+    for r in report["requests"]:
+        phases = "  ".join(
+            f"{k[:-3]} {r[k]:.0f}"
+            for k in ("connect_ms", "tls_ms", "send_ms", "wait_ms", "download_ms")
+            if k in r
+        )
+        retries = f" x{r['attempts']}" if r["attempts"] > 1 else ""
+        print(
+            f"  {r['method']} {r['endpoint']} {r['status']}{retries}  "
+            f"{r['elapsed_ms']:.0f} ms"
+            + (f" ({phases})" if phases else "")
+            + f"  json {r['decode_ms']:.0f} ms  {_size(r['bytes'])}",
+            file=out,
+        )
+    for p in report["phases"]:
+        ref = f" {p['ref_id']}" if p["ref_id"] else ""
+        extra = f"  {p['rows']} rows" if p["rows"] else ""
+        extra += f"  {_size(p['bytes'])}" if p["bytes"] else ""
+        print(f"  {p['phase']}{ref}  {p['ms']:.0f} ms{extra}", file=out)
+    print(
+        f"  wall {report['wall_ms']:.0f} ms = HTTP {report['http_ms']:.0f} ms "
+        f"(server wait {report['wait_ms']:.0f} ms) + JSON decode "
+        f"{report['decode_ms']:.0f} ms + client {report['client_ms']:.0f} ms + other",
+        file=out,
+    )
+
+
+# ---------------------------------------------------------------------------
+# Metadata Cache
+# ---------------------------------------------------------------------------
+
+
+def _instance_key(
+    base_url: str, org_id: int | None = None, token: str | None = None
+) -> str:
+    """Short stable key of a Grafana instance and org for per-instance files.
+
+    With ``token``, the key also carries a fingerprint of the credential, so
+    tokens with different permissions never share cached listings.
+    """
+    import hashlib
+
+    material = f"{base_url}|{org_id or ''}"
+    if token:
+        material += "|" + hashlib.sha256(token.encode()).hexdigest()
+    return hashlib.sha256(material.encode()).hexdigest()[:16]
+
+
+class MetadataCache:
+    """Per-instance on-disk cache for slow-changing API metadata.
+
+    Holds the detected API mode, the datasource map and the folder tree in
+    one small JSON file per Grafana URL, org and token, so short CLI calls
+    skip the discovery round trips. Entries expire after
+    ``GRAFANA_METADATA_TTL`` seconds; ``GRAFANA_METADATA_CACHE=0`` disables
+    the cache.
+    """
+
+    def __init__(
+        self, base_url: str, org_id: int | None = None, token: str | None = None
+    ):
+        key = _instance_key(base_url, org_id, token)
+        self.path = _cache_dir() / "metadata" / f"{key}.json"
+        self._entries: dict[str, dict] | None = None
+        self.reload_settings()
+
+    def reload_settings(self) -> None:
+        self.ttl = int(os.environ.get("GRAFANA_METADATA_TTL", "3600"))
+        self.enabled = os.environ.get("GRAFANA_METADATA_CACHE", "1") != "0"
+
+    def _load(self) -> dict[str, dict]:
+        if self._entries is None:
+            try:
+                self._entries = json.loads(self.path.read_text())
+            except (OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def _save(self) -> None:
+        import tempfile
+
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.path.parent, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass  # a read-only cache dir only costs the round trips
+
+    def forget(self) -> None:
+        """Drop the in-memory copy so the next read sees other processes' writes."""
+        self._entries = None
+
+    def peek(self, name: str) -> Any:
+        """Cached value of ``name``, or None when missing, expired or disabled."""
+        import time as _time
+
+        if not self.enabled:
+            return None
+        entry = self._load().get(name)
+        if entry is not None and _time.time() - entry.get("at", 0) <= self.ttl:
+            return entry["value"]
+        return None
+
+    def put(self, name: str, value: Any) -> None:
+        """Store ``value`` under ``name``."""
+        import time as _time
+
+        if not self.enabled:
+            return
+        self._load()[name] = {"at": _time.time(), "value": value}
+        self._save()
+
+    def get(self, name: str, loader: Any) -> Any:
+        """Cached value of ``name``, calling ``loader()`` when missing or expired.
+
+        A loader that raises stores nothing, so failed requests are retried.
+        """
+        value = self.peek(name)
+        if value is None:
+            value = loader()
+            self.put(name, value)
+        return value
+
+    def invalidate(self, *names: str) -> None:
+        """Drop the given entries, or all of them when no name is given."""
+        entries = self._load()
+        if not entries:
+            return
+        for name in names or list(entries):
+            entries.pop(name, None)
+        self._save()
+
+
+# ---------------------------------------------------------------------------
+# Format Detection & Conversion (Phase 3)
+# ---------------------------------------------------------------------------
+
+
+def detect_format(data: dict) -> str:
+    """Detect whether data is K8s-style or legacy format."""
+    if "apiVersion" in data and "kind" in data:
+        return "k8s"
+    return "legacy"
+
+
+def legacy_to_k8s(dashboard: dict, folder_uid: str | None = None) -> dict:
+    """Convert legacy dashboard body to K8s-style resource."""
+    spec = {
+        k: v
+        for k, v in dashboard.items()
+        if k not in ("uid", "id", "version", "schemaVersion")
+    }
+    metadata: dict[str, Any] = {}
+    if dashboard.get("uid"):
+        metadata["name"] = dashboard["uid"]
+    annotations: dict[str, str] = {}
+    if folder_uid:
+        annotations["grafana.app/folder"] = folder_uid
+    if dashboard.get("schemaVersion"):
+        annotations["grafana.app/schemaVersion"] = str(dashboard["schemaVersion"])
+    if annotations:
+        metadata["annotations"] = annotations
+    return {
+        "apiVersion": "dashboard.grafana.app/v1beta1",
+        "kind": "Dashboard",
+        "metadata": metadata,
+        "spec": spec,
+    }
+
+
+def k8s_to_legacy(resource: dict) -> dict:
+    """Convert K8s-style resource to legacy dashboard body."""
+    spec = resource.get("spec", {})
+    metadata = resource.get("metadata", {})
+    dashboard = dict(spec)
+    if metadata.get("name"):
+        dashboard["uid"] = metadata["name"]
+    annotations = metadata.get("annotations", {})
+    schema_ver = annotations.get("grafana.app/schemaVersion")
+    if schema_ver:
+        dashboard["schemaVersion"] = int(schema_ver)
+    return dashboard
+
+
+# ---------------------------------------------------------------------------
+# DashboardOps Facade (Phase 4)
+# ---------------------------------------------------------------------------
+
+
+@dataclass
+class OccMeta:
+    """Optimistic concurrency control metadata."""
+
+    version: int | None = None  # legacy
+    resource_version: str | None = None  # K8s
+    api_mode: str = "legacy"
+
+    def to_dict(self) -> dict:
+        if self.api_mode == "k8s":
+            return {"resourceVersion": self.resource_version, "api_mode": "k8s"}
+        return {"version": self.version, "api_mode": "legacy"}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> OccMeta:
+        mode = d.get("api_mode", "legacy")
+        if mode == "k8s":
+            return cls(resource_version=d.get("resourceVersion"), api_mode="k8s")
+        return cls(version=d.get("version"), api_mode="legacy")
+
+
+class DashboardOps:
+    """Normalizes API differences so CLI commands don't branch on mode."""
+
+    def __init__(
+        self, client: GrafanaClient, api_mode: str = "auto", namespace: str = "default"
+    ):
+        self.client = client
+        self.namespace = namespace
+        if api_mode == "auto":
+            self.api_mode = client.metadata.peek("api_mode")
+            if self.api_mode is None:
+                # A 401/403/5xx probe guesses k8s but must not stick for the TTL
+                self.api_mode, conclusive = client.probe_api_mode()
+                if conclusive:
+                    client.metadata.put("api_mode", self.api_mode)
+        else:
+            self.api_mode = api_mode
+
+    def get(self, uid: str) -> tuple[dict, OccMeta]:
+        if self.api_mode == "k8s":
+            res = self.client.k8s_get_dashboard(self.namespace, uid)
+            dashboard = k8s_to_legacy(res)
+            occ = OccMeta(
+                resource_version=res["metadata"].get("resourceVersion"), api_mode="k8s"
+            )
+            return dashboard, occ
+        else:
+            res = self.client.get_dashboard(uid)
+            dashboard = res["dashboard"]
+            occ = OccMeta(version=res["meta"].get("version"), api_mode="legacy")
+            return dashboard, occ
+
+    def get_raw(self, uid: str) -> tuple[dict, OccMeta, dict]:
+        """Like get() but also returns the full raw API response."""
+        if self.api_mode == "k8s":
+            res = self.client.k8s_get_dashboard(self.namespace, uid)
+            dashboard = k8s_to_legacy(res)
+            occ = OccMeta(
+                resource_version=res["metadata"].get("resourceVersion"), api_mode="k8s"
+            )
+            return dashboard, occ, res
+        else:
+            res = self.client.get_dashboard(uid)
+            dashboard = res["dashboard"]
+            occ = OccMeta(version=res["meta"].get("version"), api_mode="legacy")
+            return dashboard, occ, res
+
+    def save(
+        self,
+        dashboard: dict,
+        occ: OccMeta,
+        folder_uid: str | None = None,
+        message: str = "",
+    ) -> dict:
+        if self.api_mode == "k8s":
+            body = legacy_to_k8s(dashboard, folder_uid=folder_uid)
+            name = dashboard.get("uid", body["metadata"].get("name", ""))
+            if occ.resource_version:
+                body["metadata"]["resourceVersion"] = occ.resource_version
+            return self.client.k8s_update_dashboard(self.namespace, name, body)
+        else:
+            dash = dict(dashboard)
+            if occ.version is not None:
+                dash["version"] = occ.version
+            return self.client.save_dashboard(
+                dash, folder_uid=folder_uid, message=message, overwrite=False
+            )
+
+    def save_force(
+        self, dashboard: dict, folder_uid: str | None = None, message: str = ""
+    ) -> dict:
+        """Save with overwrite/force — bypasses OCC."""
+        if self.api_mode == "k8s":
+            # For K8s, fetch current resourceVersion first then PUT
+            _, current_occ = self.get(dashboard.get("uid", ""))
+            return self.save(
+                dashboard, current_occ, folder_uid=folder_uid, message=message
+            )
+        else:
+            return self.client.save_dashboard(
+                dashboard, folder_uid=folder_uid, message=message, overwrite=True
+            )
+
+    def create(
+        self, dashboard: dict, folder_uid: str | None = None, message: str = ""
+    ) -> dict:
+        if self.api_mode == "k8s":
+            body = legacy_to_k8s(dashboard, folder_uid=folder_uid)
+            body["metadata"].pop("name", None)  # let server assign
+            return self.client.k8s_create_dashboard(self.namespace, body)
+        else:
+            dash = dict(dashboard)
+            dash["id"] = None
+            dash["uid"] = None
+            return self.client.save_dashboard(
+                dash, folder_uid=folder_uid, message=message, overwrite=False
+            )
+
+    def delete(self, uid: str) -> dict:
+        if self.api_mode == "k8s":
+            return self.client.k8s_delete_dashboard(self.namespace, uid)
+        else:
+            return self.client.delete_dashboard(uid)
+
+    def search(
+        self,
+        query: str | None = None,
+        tag: str | None = None,
+        folder_uid: str | None = None,
+        limit: int = 100,
+        label_selector: str | None = None,
+        field_selector: str | None = None,
+    ) -> list[dict]:
+        if self.api_mode == "k8s":
+            # Label and field selectors are evaluated server-side. Title, tags
+            # and folder live in the spec/annotations and are matched here,
+            # page by page, stopping as soon as ``limit`` entries are found.
+            client_filter = bool(query or tag or folder_uid)
+            items = _iter_k8s_dashboards(
+                self.client,
+                self.namespace,
+                page_size=500 if client_filter else min(500, limit),
+                label_selector=label_selector,
+                field_selector=field_selector,
+            )
+            needle = query.lower() if query else None
+            results = []
+            for item in items:
+                spec = item.get("spec", {})
+                title = spec.get("title", "")
+                tags = spec.get("tags", [])
+                if needle and needle not in title.lower():
+                    continue
+                if tag and tag not in tags:
+                    continue
+                metadata = item.get("metadata", {})
+                folder = metadata.get("annotations", {}).get("grafana.app/folder")
+                if folder_uid and folder != folder_uid:
+                    continue
+                results.append(
+                    {
+                        "uid": metadata.get("name", ""),
+                        "title": title,
+                        "tags": tags,
+                        "folderUid": folder,
+                    }
+                )
+                if len(results) >= limit:
+                    break
+            return results
+        else:
+            return self.client.search_dashboards(
+                query=query, tag=tag, folder_uid=folder_uid, limit=limit
+            )
+
+
+# ---------------------------------------------------------------------------
+# Sidecar Base File Handling (Phase 5)
+# ---------------------------------------------------------------------------
+
+
+def _base_path(working_path: str) -> Path:
+    p = Path(working_path)
+    return p.parent / f"{p.stem}.base.json"
+
+
+def write_sidecar(working_path: str, dashboard: dict, occ: OccMeta) -> Path:
+    """Write the base sidecar file alongside the working copy."""
+    base = dict(dashboard)
+    base["_occ_meta"] = occ.to_dict()
+    bp = _base_path(working_path)
+    bp.write_text(json.dumps(base, indent=2, ensure_ascii=False) + "\n")
+    return bp
+
+
+def read_base(path: str) -> tuple[dict, OccMeta] | None:
+    """Read a base sidecar file, returning (dashboard, occ_meta) or None."""
+    bp = _base_path(path)
+    if not bp.exists():
+        return None
+    data = json.loads(bp.read_text())
+    occ_dict = data.pop("_occ_meta", {})
+    occ = OccMeta.from_dict(occ_dict)
+    return data, occ
+
+
+def read_working(path: str) -> dict:
+    """Read a working copy file, auto-detect format and normalize to legacy body."""
+    data = json.loads(Path(path).read_text())
+    # Strip _occ_meta if accidentally present
+    data.pop("_occ_meta", None)
+    fmt = detect_format(data)
+    if fmt == "k8s":
+        return k8s_to_legacy(data)
+    # Handle wrapped legacy format
+    if "dashboard" in data and "meta" in data:
+        return data["dashboard"]
+    return data
+
+
+# ---------------------------------------------------------------------------
+# Bulk Export
+# ---------------------------------------------------------------------------
+
+# SQLite manifest kept at the root of an export tree.
+_EXPORT_MANIFEST = ".grafana-sync.db"
+
+
+def _safe_name(text: str, max_len: int = 60) -> str:
+    """File-system safe slug of a title (``""`` if nothing usable is left)."""
+    import re
+
+    return re.sub(r"[^A-Za-z0-9._-]+", "-", text).strip("-.")[:max_len]
+
+
+def _iter_search(
+    client: GrafanaClient, search_type: str = "dash-db", page_size: int = 1000
+) -> Any:
+    """Yield every legacy search hit of one type, page by page."""
+    page = 1
+    while True:
+        hits = client.search_dashboards(
+            limit=page_size, page=page, search_type=search_type
+        )
+        yield from hits
+        if len(hits) < page_size:
+            return
+        page += 1
+
+
+def _iter_k8s_dashboards(
+    client: GrafanaClient,
+    namespace: str,
+    page_size: int = 500,
+    *,
+    label_selector: str | None = None,
+    field_selector: str | None = None,
+    metadata_only: bool = False,
+) -> Any:
+    """Yield dashboard resources of a namespace, one page in memory at a time.
+
+    Selectors are evaluated by the API server. With ``metadata_only`` items
+    carry no ``spec`` unless the server ignores the projection.
+    """
+    token: str | None = None
+    while True:
+        res = client.k8s_list_dashboards(
+            namespace,
+            label_selector=label_selector,
+            field_selector=field_selector,
+            limit=page_size,
+            continue_token=token,
+            metadata_only=metadata_only,
+        )
+        yield from res.get("items", [])
+        token = res.get("metadata", {}).get("continue")
+        if not token:
+            return
+
+
+def _folder_paths(client: GrafanaClient) -> dict[str, str]:
+    """Folder uid -> relative directory path, following nested folder parents."""
+    folders = client.metadata.get(
+        "folders",
+        lambda: {
+            f["uid"]: (f.get("title") or f["uid"], f.get("folderUid"))
+            for f in _iter_search(client, search_type="dash-folder")
+        },
+    )
+    paths: dict[str, str] = {}
+
+    def path_of(uid: str, depth: int = 0) -> str:
+        if uid in paths:
+            return paths[uid]
+        title, parent = folders[uid]
+        name = _safe_name(title) or uid
+        if parent in folders and depth < 16:
+            name = f"{path_of(parent, depth + 1)}/{name}"
+        paths[uid] = name
+        return name
+
+    for uid in folders:
+        path_of(uid)
+    return paths
+
+
+def _latest_version(client: GrafanaClient, uid: str) -> int | None:
+    """Current legacy version number from the version history (one small call)."""
+    try:
+        res = client.get_dashboard_versions(uid, limit=1)
+    except GrafanaAPIError:
+        return None
+    # Grafana 11+ wraps the list: {"versions": [...], "continueToken": ...}
+    versions = res.get("versions", []) if isinstance(res, dict) else res
+    return versions[0].get("version") if versions else None
+
+
+def _content_hash(data: Any) -> str:
+    """Stable hash of a JSON document, independent of key order and indentation."""
+    import hashlib
+
+    canonical = json.dumps(data, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ExportManifest:
+    """SQLite index of an export tree: uid -> path, version, updated, hash.
+
+    ``version`` is the legacy dashboard version, ``resourceVersion`` the K8s
+    one; ``hash`` is the content hash of the file as last written or pushed,
+    which is how local edits are detected.
+    """
+
+    _COLUMNS = {
+        "title": "title",
+        "folder": "folder",
+        "path": "path",
+        "version": "version",
+        "resourceVersion": "resource_version",
+        "updated": "updated",
+        "hash": "hash",
+    }
+
+    def __init__(self, out_dir: Path):
+        import sqlite3
+
+        self.db = sqlite3.connect(out_dir / _EXPORT_MANIFEST)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS dashboards (
+                uid TEXT PRIMARY KEY,
+                title TEXT,
+                folder TEXT,
+                path TEXT NOT NULL,
+                version INTEGER,
+                resource_version TEXT,
+                updated TEXT,
+                hash TEXT
+            );
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            """)
+
+    def entries(self) -> dict[str, dict]:
+        rows = self.db.execute("SELECT * FROM dashboards").fetchall()
+        return {
+            row["uid"]: {key: row[col] for key, col in self._COLUMNS.items()}
+            for row in rows
+        }
+
+    def upsert(self, uid: str, entry: dict) -> None:
+        cols = ", ".join(["uid", *self._COLUMNS.values()])
+        marks = ", ".join("?" * (len(self._COLUMNS) + 1))
+        self.db.execute(
+            f"INSERT OR REPLACE INTO dashboards ({cols}) VALUES ({marks})",
+            [uid, *(entry.get(key) for key in self._COLUMNS)],
+        )
+
+    def delete(self, uid: str) -> None:
+        self.db.execute("DELETE FROM dashboards WHERE uid = ?", (uid,))
+
+    def set_meta(self, key: str, value: str) -> None:
+        self.db.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value)
+        )
+
+    def meta(self, key: str) -> str | None:
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    def close(self) -> None:
+        self.db.commit()
+        self.db.close()
+
+
+def _export_format(
+    out_dir: Path, manifest: ExportManifest, requested: str | None
+) -> str:
+    """Format of an export tree: the one recorded on its first pull.
+
+    Trees pulled before the format was recorded are recognised by one of
+    their files. Asking for the other format exits with an error, since
+    unchanged and locally edited dashboards would stay in the old one.
+    """
+    if requested not in (None, "legacy", "k8s"):
+        print(
+            f"ERROR: Unknown format {requested!r}; use legacy or k8s", file=sys.stderr
+        )
+        sys.exit(1)
+    stored = manifest.meta("format")
+    if stored is None:
+        for entry in manifest.entries().values():
+            try:
+                data = json.loads((out_dir / entry["path"]).read_text())
+            except (OSError, ValueError):
+                continue
+            stored = "k8s" if "apiVersion" in data and "spec" in data else "legacy"
+            break
+    if requested and stored and requested != stored:
+        print(
+            f"ERROR: {out_dir} holds {stored} exports; --format {requested} would "
+            f"mix formats. Use --format {stored} or export to a new directory.",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+    return requested or stored or "legacy"
+
+
+def _write_export(
+    path: Path,
+    dashboard: dict,
+    occ: OccMeta,
+    folder_uid: str | None,
+    out_format: str,
+    sidecar: bool,
+) -> str:
+    """Write one exported dashboard (and its base sidecar) like ``export`` does.
+
+    Returns the content hash of the written file.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if out_format == "k8s":
+        out_data = legacy_to_k8s(dashboard, folder_uid=folder_uid)
+    else:
+        out_data = dashboard
+    path.write_text(json.dumps(out_data, indent=2, ensure_ascii=False) + "\n")
+    if sidecar:
+        write_sidecar(str(path), dashboard, occ)
+    return _content_hash(out_data)
+
+
+def _remove_export(out_dir: Path, rel_path: str) -> None:
+    path = out_dir / rel_path
+    path.unlink(missing_ok=True)
+    _base_path(str(path)).unlink(missing_ok=True)
+
+
+def _local_edit(out_dir: Path, entry: dict | None) -> bool:
+    """True if the exported file was edited since it was last written or pushed."""
+    if not entry or not entry.get("hash"):
+        return False
+    path = out_dir / entry["path"]
+    if not path.exists():
+        return False
+    try:
+        return _content_hash(json.loads(path.read_text())) != entry["hash"]
+    except ValueError:
+        return True
+
+
+def _pull_dashboards(
+    client: GrafanaClient,
+    ops: DashboardOps,
+    out_dir: Path,
+    manifest: ExportManifest,
+    *,
+    out_format: str = "legacy",
+    parallel: int = 8,
+    sidecar: bool = True,
+    force: bool = False,
+    prune: bool = False,
+) -> dict[str, Any]:
+    """Bring an export tree up to date with the server.
+
+    Only dashboards whose version (legacy) or resourceVersion (K8s) differs
+    from the manifest are fetched and written. Files with local edits are
+    never overwritten. Returns a summary of what happened.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    known = manifest.entries()
+    folders = _folder_paths(client)
+
+    def rel_path(uid: str, folder_uid: str | None) -> str:
+        folder = folders.get(folder_uid, folder_uid) if folder_uid else "General"
+        return f"{folder}/{uid}.json"
+
+    def reusable(uid: str, rel: str) -> dict | None:
+        """The manifest entry if its file is still in place, else None."""
+        prev = known.get(uid)
+        if force or prev is None or prev.get("path") != rel:
+            return None
+        return prev if (out_dir / rel).exists() else None
+
+    def write(
+        uid: str, rel: str, dashboard: dict, occ: OccMeta, entry: dict
+    ) -> tuple[str, dict | None, str]:
+        if _local_edit(out_dir, known.get(uid)):
+            return uid, known[uid], "local changes"
+        entry["hash"] = _write_export(
+            out_dir / rel, dashboard, occ, entry["folder"], out_format, sidecar
+        )
+        return uid, entry, "written"
+
+    def pull_legacy(hit: dict) -> tuple[str, dict | None, str]:
+        uid, folder_uid = hit["uid"], hit.get("folderUid")
+        rel = rel_path(uid, folder_uid)
+        prev = reusable(uid, rel)
+        try:
+            # Search hits carry no version, so an incremental run costs one
+            # small version-history request per dashboard.
+            if (
+                prev is not None
+                and prev.get("version") is not None
+                and _latest_version(client, uid) == prev["version"]
+            ):
+                return uid, prev, "unchanged"
+            res = client.get_dashboard(uid)
+        except GrafanaAPIError as exc:
+            return uid, known.get(uid), f"failed: {exc}"
+        meta = res["meta"]
+        entry = {
+            "title": hit.get("title", ""),
+            "folder": folder_uid,
+            "path": rel,
+            "version": meta.get("version"),
+            "updated": meta.get("updated"),
+        }
+        occ = OccMeta(version=meta.get("version"), api_mode="legacy")
+        return write(uid, rel, res["dashboard"], occ, entry)
+
+    def pull_k8s(item: dict) -> tuple[str, dict | None, str]:
+        # Listed as metadata only; the body is fetched for changed ones.
+        metadata = item.get("metadata", {})
+        annotations = metadata.get("annotations", {})
+        uid = metadata.get("name", "")
+        rv = metadata.get("resourceVersion")
+        folder_uid = annotations.get("grafana.app/folder")
+        rel = rel_path(uid, folder_uid)
+        prev = reusable(uid, rel)
+        if prev is not None and rv and prev.get("resourceVersion") == rv:
+            return uid, prev, "unchanged"
+        if "spec" not in item:
+            try:
+                item = client.k8s_get_dashboard(ops.namespace, uid)
+            except GrafanaAPIError as exc:
+                return uid, known.get(uid), f"failed: {exc}"
+            rv = item.get("metadata", {}).get("resourceVersion", rv)
+        dashboard = k8s_to_legacy(item)
+        entry = {
+            "title": dashboard.get("title", ""),
+            "folder": folder_uid,
+            "path": rel,
+            "resourceVersion": rv,
+            "updated": annotations.get("grafana.app/updatedTimestamp")
+            or metadata.get("creationTimestamp"),
+        }
+        occ = OccMeta(resource_version=rv, api_mode="k8s")
+        return write(uid, rel, dashboard, occ, entry)
+
+    if ops.api_mode == "k8s":
+        source = _iter_k8s_dashboards(client, ops.namespace, metadata_only=True)
+        worker = pull_k8s
+    else:
+        source, worker = _iter_search(client), pull_legacy
+    out_dir.mkdir(parents=True, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=max(1, parallel)) as pool:
+        results = list(pool.map(worker, source))
+
+    summary: dict[str, Any] = {
+        "written": [],
+        "unchanged": 0,
+        "local_changes": [],
+        "failed": [],
+        "removed": [],
+    }
+    seen: set[str] = set()
+    for uid, entry, status in results:
+        seen.add(uid)
+        if status == "unchanged":
+            summary["unchanged"] += 1
+        elif status == "written":
+            summary["written"].append(uid)
+        elif status == "local changes":
+            summary["local_changes"].append(uid)
+        else:
+            summary["failed"].append(uid)
+            print(f"  {uid}: {status}", file=sys.stderr)
+        if entry is None:
+            continue
+        old = known.get(uid)
+        if status == "written" and old and old.get("path") != entry["path"]:
+            _remove_export(out_dir, old["path"])
+        manifest.upsert(uid, entry)
+    for uid, old in known.items():
+        if uid in seen:
+            continue
+        summary["removed"].append(uid)
+        if prune:
+            _remove_export(out_dir, old["path"])
+            manifest.delete(uid)
+    manifest.set_meta("api_mode", ops.api_mode)
+    manifest.set_meta("format", out_format)
+    return summary
+
+
+def _push_dashboards(
+    ops: DashboardOps,
+    out_dir: Path,
+    manifest: ExportManifest,
+    *,
+    message: str = "Synced via CLI",
+    sidecar: bool = True,
+) -> dict[str, list[str]]:
+    """Save locally edited dashboards of an export tree through the OCC path.
+
+    A stale version triggers the same three-way merge as ``update``; a clean
+    merge is saved and written back locally, conflicts are left for
+    ``update`` to resolve.
+    """
+    summary: dict[str, list[str]] = {"pushed": [], "conflicts": [], "push_failed": []}
+    for uid, entry in manifest.entries().items():
+        if not _local_edit(out_dir, entry):
+            continue
+        path = out_dir / entry["path"]
+        dashboard = read_working(str(path))
+        dashboard["uid"] = uid
+        base_info = read_base(str(path))
+        if base_info:
+            base_dashboard, occ = base_info
+        else:
+            base_dashboard = None
+            occ = OccMeta(
+                version=entry.get("version"),
+                resource_version=entry.get("resourceVersion"),
+                api_mode=ops.api_mode,
+            )
+        merged = False
+        try:
+            try:
+                res = ops.save(
+                    dashboard, occ, folder_uid=entry["folder"], message=message
+                )
+            except (PreconditionFailedError, ConflictError):
+                if base_dashboard is None:
+                    raise
+                theirs, new_occ = ops.get(uid)
+                dashboard, conflicts = three_way_merge(
+                    base_dashboard, dashboard, theirs
+                )
+                dashboard["uid"] = uid
+                if conflicts:
+                    summary["conflicts"].append(uid)
+                    print(
+                        f"  {uid}: {len(conflicts)} conflict(s); resolve with "
+                        f"'update {uid} --file {path}'",
+                        file=sys.stderr,
+                    )
+                    continue
+                res = ops.save(
+                    dashboard, new_occ, folder_uid=entry["folder"], message=message
+                )
+                merged = True
+        except (PreconditionFailedError, ConflictError):
+            summary["conflicts"].append(uid)
+            print(
+                f"  {uid}: changed on the server and no base sidecar to merge with",
+                file=sys.stderr,
+            )
+            continue
+        except GrafanaAPIError as exc:
+            summary["push_failed"].append(uid)
+            print(f"  {uid}: {exc}", file=sys.stderr)
+            continue
+
+        if ops.api_mode == "k8s":
+            rv = res.get("metadata", {}).get("resourceVersion")
+            new_occ = OccMeta(resource_version=rv, api_mode="k8s")
+            entry["resourceVersion"] = rv
+        else:
+            new_occ = OccMeta(version=res.get("version"), api_mode="legacy")
+            entry["version"] = res.get("version")
+        if merged:
+            out_format = (
+                "k8s"
+                if detect_format(json.loads(path.read_text())) == "k8s"
+                else "legacy"
+            )
+            entry["hash"] = _write_export(
+                path, dashboard, new_occ, entry["folder"], out_format, sidecar
+            )
+        else:
+            entry["hash"] = _content_hash(json.loads(path.read_text()))
+            if sidecar:
+                write_sidecar(str(path), dashboard, new_occ)
+        manifest.upsert(uid, entry)
+        summary["pushed"].append(uid)
+    return summary
+
+
+# ---------------------------------------------------------------------------
+# Dashboard Index
+# ---------------------------------------------------------------------------
+
+# Target fields that carry the query text, by datasource family.
+_QUERY_TEXT_FIELDS = ("expr", "rawSql", "query", "rawQuery", "target", "queryText")
+
+
+def _index_path(
+    base_url: str, org_id: int | None = None, token: str | None = None
+) -> Path:
+    """SQLite index of one Grafana instance, org and token, next to the other caches.
+
+    Keyed by token like the metadata cache, so a token never finds dashboards
+    only another token may read.
+    """
+    return _cache_dir() / "index" / f"{_instance_key(base_url, org_id, token)}.sqlite"
+
+
+def _ds_ref(ds: Any) -> tuple[str | None, str | None]:
+    """(uid, type) of a datasource reference: dict, uid/name string or None."""
+    if isinstance(ds, dict):
+        return ds.get("uid") or ds.get("name"), ds.get("type")
+    return (ds, None) if isinstance(ds, str) else (None, None)
+
+
+def _query_text(query: dict) -> str:
+    """The searchable text of a target: its query fields, else the whole JSON."""
+    parts = [query[f] for f in _QUERY_TEXT_FIELDS if isinstance(query.get(f), str)]
+    if parts:
+        return "\n".join(parts)
+    rest = {k: v for k, v in query.items() if k not in ("refId", "datasource")}
+    return json.dumps(rest, sort_keys=True, ensure_ascii=False)
+
+
+def _index_entries(
+    dashboard: dict, ds_types: dict[str, str] | None = None
+) -> list[dict]:
+    """Searchable rows of a dashboard: itself, panels, targets and variables.
+
+    Legacy dashboards are walked through ``_flatten_panels``; v2beta1
+    dashboards through their ``elements`` and typed variables. Targets
+    without their own datasource inherit the panel's. References that carry
+    only a uid or name get their type from ``ds_types`` (uid or name -> type).
+    """
+    rows: list[dict] = []
+    ds_types = ds_types or {}
+
+    def add(kind: str, text: str, panel: dict | None = None, **extra: Any) -> None:
+        ds = extra.get("datasource")
+        rows.append(
+            {
+                "kind": kind,
+                "panel_id": panel.get("id") if panel else None,
+                "panel_title": panel.get("title") if panel else None,
+                "name": extra.get("name"),
+                "datasource": ds,
+                "datasource_type": extra.get("datasource_type") or ds_types.get(ds),
+                "text": text,
+            }
+        )
+
+    tags = " ".join(str(t) for t in dashboard.get("tags") or [])
+    add(
+        "dashboard",
+        "\n".join(
+            filter(None, [dashboard.get("title"), tags, dashboard.get("description")])
+        ),
+    )
+
+    if "elements" in dashboard:
+        for element in (dashboard.get("elements") or {}).values():
+            panel = element.get("spec", {})
+            add(
+                "panel",
+                f"{panel.get('title', '')}\n{panel.get('description', '')}",
+                panel,
+            )
+            for pq in panel.get("data", {}).get("spec", {}).get("queries", []):
+                spec = pq.get("spec", {})
+                query = spec.get("query", {})
+                uid, _type = _ds_ref(query.get("datasource"))
+                add(
+                    "target",
+                    _query_text(query.get("spec", {})),
+                    panel,
+                    name=spec.get("refId"),
+                    datasource=uid,
+                    datasource_type=query.get("group"),
+                )
+        for var in dashboard.get("variables", []):
+            spec = var.get("spec", {})
+            query = spec.get("query")
+            uid, _type = (
+                _ds_ref(query.get("datasource"))
+                if isinstance(query, dict)
+                else (None, None)
+            )
+            text = (
+                _query_text(query.get("spec", {}))
+                if isinstance(query, dict)
+                else str(query or "")
+            )
+            add(
+                "variable",
+                text,
+                name=spec.get("name"),
+                datasource=uid,
+                datasource_type=query.get("group") if isinstance(query, dict) else None,
+            )
+        return rows
+
+    for panel in _flatten_panels(dashboard):
+        add("panel", f"{panel.get('title', '')}\n{panel.get('description', '')}", panel)
+        panel_uid, panel_type = _ds_ref(panel.get("datasource"))
+        for target in panel.get("targets", []):
+            uid, ds_type = _ds_ref(target.get("datasource"))
+            add(
+                "target",
+                _query_text(target),
+                panel,
+                name=target.get("refId"),
+                datasource=uid or panel_uid,
+                # A uid-only ref unknown to the datasource list most likely
+                # shares the panel's type, unless the panel is mixed.
+                datasource_type=ds_type
+                or ds_types.get(uid)
+                or (panel_type if panel_uid != "-- Mixed --" else None),
+            )
+    for var in dashboard.get("templating", {}).get("list", []):
+        uid, ds_type = _ds_ref(var.get("datasource"))
+        query = var.get("query")
+        text = _query_text(query) if isinstance(query, dict) else str(query or "")
+        definition = var.get("definition")
+        if definition and definition not in text:
+            text = f"{text}\n{definition}"
+        add(
+            "variable",
+            text,
+            name=var.get("name"),
+            datasource=uid,
+            datasource_type=ds_type,
+        )
+    return rows
+
+
+class DashboardIndex:
+    """Local SQLite index of every dashboard's panels, targets and variables.
+
+    ``dashboards`` holds one row per dashboard with the version it was
+    indexed at (legacy ``version`` or K8s ``resourceVersion``), ``entries``
+    one row per searchable item. Text search uses an FTS5 trigram table, so
+    any substring of three or more characters is an index lookup; without
+    trigram support (SQLite < 3.34) and for shorter terms it falls back to
+    ``LIKE``.
+    """
+
+    _COLUMNS = ("title", "folder", "version", "resource_version", "updated")
+
+    def __init__(self, path: Path):
+        import sqlite3
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS dashboards (
+                uid TEXT PRIMARY KEY,
+                title TEXT,
+                folder TEXT,
+                version INTEGER,
+                resource_version TEXT,
+                updated TEXT
+            );
+            CREATE TABLE IF NOT EXISTS entries (
+                uid TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                panel_id INTEGER,
+                panel_title TEXT,
+                name TEXT,
+                datasource TEXT,
+                datasource_type TEXT,
+                text TEXT
+            );
+            CREATE INDEX IF NOT EXISTS entries_uid ON entries (uid);
+            CREATE INDEX IF NOT EXISTS entries_datasource ON entries (datasource);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            """)
+        try:
+            self.db.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts "
+                "USING fts5(text, tokenize='trigram')"
+            )
+            self.fts = True
+        except sqlite3.OperationalError:
+            self.fts = False
+
+    def versions(self) -> dict[str, dict]:
+        rows = self.db.execute("SELECT * FROM dashboards").fetchall()
+        return {row["uid"]: dict(row) for row in rows}
+
+    def put(
+        self,
+        uid: str,
+        meta: dict,
+        dashboard: dict,
+        ds_types: dict[str, str] | None = None,
+    ) -> None:
+        """(Re)index one dashboard; ``ds_types`` as for ``_index_entries``."""
+        self.delete(uid)
+        self.db.execute(
+            f"INSERT INTO dashboards (uid, {', '.join(self._COLUMNS)}) "
+            f"VALUES (?{', ?' * len(self._COLUMNS)})",
+            [uid, *(meta.get(c) for c in self._COLUMNS)],
+        )
+        for row in _index_entries(dashboard, ds_types):
+            cur = self.db.execute(
+                "INSERT INTO entries (uid, kind, panel_id, panel_title, name, "
+                "datasource, datasource_type, text) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    uid,
+                    row["kind"],
+                    row["panel_id"],
+                    row["panel_title"],
+                    row["name"],
+                    row["datasource"],
+                    row["datasource_type"],
+                    row["text"],
+                ],
+            )
+            if self.fts:
+                self.db.execute(
+                    "INSERT INTO entries_fts (rowid, text) VALUES (?, ?)",
+                    (cur.lastrowid, row["text"]),
+                )
+
+    def delete(self, uid: str) -> None:
+        if self.fts:
+            self.db.execute(
+                "DELETE FROM entries_fts WHERE rowid IN "
+                "(SELECT rowid FROM entries WHERE uid = ?)",
+                (uid,),
+            )
+        self.db.execute("DELETE FROM entries WHERE uid = ?", (uid,))
+        self.db.execute("DELETE FROM dashboards WHERE uid = ?", (uid,))
+
+    def set_meta(self, key: str, value: str) -> None:
+        self.db.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value)
+        )
+
+    def meta(self, key: str) -> str | None:
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    def find(
+        self,
+        text: str | None = None,
+        *,
+        kind: str | None = None,
+        name: str | None = None,
+        datasource: str | None = None,
+        limit: int = 100,
+    ) -> list[dict]:
+        """Entries matching all given filters, with their dashboard's title."""
+        where: list[str] = []
+        params: list[Any] = []
+        if text:
+            if self.fts and len(text) >= 3:
+                where.append(
+                    "e.rowid IN (SELECT rowid FROM entries_fts WHERE entries_fts MATCH ?)"
+                )
+                params.append('"' + text.replace('"', '""') + '"')
+            else:
+                where.append("e.text LIKE ? ESCAPE '\\'")
+                escaped = text.replace("\\", "\\\\").replace("%", "\\%")
+                params.append("%" + escaped.replace("_", "\\_") + "%")
+        if kind:
+            where.append("e.kind = ?")
+            params.append(kind)
+        if name:
+            where.append("e.name = ?")
+            params.append(name)
+        if datasource:
+            where.append(
+                "(e.datasource = ? COLLATE NOCASE OR e.datasource_type = ? COLLATE NOCASE)"
+            )
+            params.extend([datasource, datasource])
+        sql = (
+            "SELECT e.*, d.title AS dashboard_title, d.folder FROM entries e "
+            "JOIN dashboards d ON d.uid = e.uid"
+        )
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY d.title, e.uid, e.panel_id, e.kind, e.name"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        return [dict(row) for row in self.db.execute(sql, params)]
+
+    def close(self) -> None:
+        self.db.commit()
+        self.db.close()
+
+
+def _refresh_index(
+    client: GrafanaClient,
+    ops: DashboardOps,
+    index: DashboardIndex,
+    *,
+    parallel: int = 8,
+    full: bool = False,
+) -> dict[str, Any]:
+    """Bring the index up to date with the server, like ``sync`` does for files.
+
+    Unchanged dashboards are detected by version (one small version-history
+    call each, legacy) or by resourceVersion from a metadata-only listing
+    (K8s); only changed ones are fetched and re-indexed.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    known = {} if full else index.versions()
+    try:
+        ds_types = {
+            key: ds["type"]
+            for uid, ds in client.datasource_map().items()
+            for key in (uid, ds.get("name"))
+            if key and ds.get("type")
+        }
+    except GrafanaAPIError:
+        ds_types = {}  # uid-only references then fall back to the panel's type
+
+    def legacy(hit: dict) -> tuple[str, dict | None, Any]:
+        uid = hit["uid"]
+        prev = known.get(uid)
+        try:
+            if (
+                prev
+                and prev.get("version") is not None
+                and _latest_version(client, uid) == prev["version"]
+            ):
+                return uid, None, "unchanged"
+            res = client.get_dashboard(uid)
+        except GrafanaAPIError as exc:
+            return uid, None, f"failed: {exc}"
+        meta = res.get("meta", {})
+        entry = {
+            "title": hit.get("title", ""),
+            "folder": meta.get("folderTitle") or hit.get("folderTitle"),
+            "version": meta.get("version"),
+            "updated": meta.get("updated"),
+        }
+        return uid, entry, res.get("dashboard", {})
+
+    def k8s(item: dict) -> tuple[str, dict | None, Any]:
+        metadata = item.get("metadata", {})
+        uid = metadata.get("name", "")
+        rv = metadata.get("resourceVersion")
+        prev = known.get(uid)
+        if prev and prev.get("resource_version") == rv:
+            return uid, None, "unchanged"
+        if "spec" not in item:
+            try:
+                item = client.k8s_get_dashboard(ops.namespace, uid)
+            except GrafanaAPIError as exc:
+                return uid, None, f"failed: {exc}"
+            metadata = item.get("metadata", {})
+        dashboard = k8s_to_legacy(item)
+        annotations = metadata.get("annotations", {})
+        entry = {
+            "title": dashboard.get("title", ""),
+            "folder": annotations.get("grafana.app/folder"),
+            "resource_version": metadata.get("resourceVersion", rv),
+            "updated": annotations.get("grafana.app/updatedTimestamp")
+            or metadata.get("creationTimestamp"),
+        }
+        return uid, entry, dashboard
+
+    if ops.api_mode == "k8s":
+        source = _iter_k8s_dashboards(client, ops.namespace, metadata_only=True)
+        worker = k8s
+    else:
+        source, worker = _iter_search(client), legacy
+
+    summary: dict[str, Any] = {"indexed": 0, "unchanged": 0, "removed": 0, "failed": []}
+    seen: set[str] = set()
+    with ThreadPoolExecutor(max_workers=max(1, parallel)) as pool:
+        # Written from this thread as results come in; SQLite stays single-threaded.
+        for uid, entry, result in pool.map(worker, source):
+            seen.add(uid)
+            if entry is not None:
+                index.put(uid, entry, result, ds_types)
+                summary["indexed"] += 1
+            elif result == "unchanged":
+                summary["unchanged"] += 1
+            else:
+                summary["failed"].append(uid)
+                print(f"  {uid}: {result}", file=sys.stderr)
+    for uid in set(index.versions()) - seen:
+        index.delete(uid)
+        summary["removed"] += 1
+    index.set_meta("url", client.base_url)
+    index.set_meta("api_mode", ops.api_mode)
+    return summary
+
+
+# ---------------------------------------------------------------------------
+# Three-Way Merge Engine (Phase 6)
+# ---------------------------------------------------------------------------
+
+# Fields to ignore when comparing dashboard equality
+_VOLATILE_FIELDS = frozenset({"id", "version", "schemaVersion", "iteration"})
+
+
+def _deep_equal(a: Any, b: Any) -> bool:
+    """Deep structural equality, ignoring volatile fields at the top level of dicts."""
+    if type(a) != type(b):
+        return False
+    if isinstance(a, dict):
+        keys_a = set(a.keys()) - _VOLATILE_FIELDS
+        keys_b = set(b.keys()) - _VOLATILE_FIELDS
+        if keys_a != keys_b:
+            return False
+        return all(_deep_equal(a[k], b[k]) for k in keys_a)
+    if isinstance(a, list):
+        if len(a) != len(b):
+            return False
+        return all(_deep_equal(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+_MISSING = object()
+
+
+class _Merger:
+    """Recursive three-way merge over JSON values, driven by subtree hashes.
+
+    Each subtree is hashed once (``SubtreeHasher``), so deciding whether a
+    side changed is a digest comparison rather than a deep walk. Unchanged
+    and one-sided subtrees are returned by reference, not copied. When both
+    sides changed a dict, its keys are merged individually; keyed lists
+    (panels, variables, targets, ... see ``_list_key_fn``) are merged item by
+    item, which covers the nested panels of collapsed rows as well as the
+    v2beta1 ``elements`` map and layout items, rows and tabs. Same-length
+    layout lists whose items lack usable keys (``_POSITIONAL_FIELDS``, e.g.
+    untitled rows) are merged by position while the items at each index keep
+    the same identity. Only genuinely overlapping edits become conflicts,
+    resolved to theirs.
+    """
+
+    def __init__(self) -> None:
+        self.digest = SubtreeHasher()
+        self.conflicts: list[Conflict] = []
+
+    def same(self, a: Any, b: Any) -> bool:
+        if a is b:
+            return True
+        if a is _MISSING or b is _MISSING:
+            return False
+        return self.digest(a) == self.digest(b)
+
+    def merge(self, b: Any, o: Any, t: Any, path: str, field: str) -> Any:
+        """Merged value, or ``_MISSING`` when the result is a deletion."""
+        if self.same(o, t):
+            return o  # unchanged, or the same change on both sides
+        if self.same(b, o):
+            return t  # only theirs changed
+        if self.same(b, t):
+            return o  # only ours changed
+        if b is _MISSING:
+            self.conflicts.append(BothAdded(path, o, t))
+            return t
+        if o is _MISSING:
+            # We deleted it, they modified it: keep theirs.
+            self.conflicts.append(DeleteModify(path, t))
+            return t
+        if t is _MISSING:
+            # They deleted it, we modified it: accept the deletion.
+            self.conflicts.append(DeleteModify(path, o))
+            return _MISSING
+        if isinstance(b, dict) and isinstance(o, dict) and isinstance(t, dict):
+            return self.merge_dict(b, o, t, path)
+        if isinstance(b, list) and isinstance(o, list) and isinstance(t, list):
+            key_fn = _list_key_fn(field, b, o, t)
+            if key_fn is not None:
+                return self.merge_keyed(b, o, t, key_fn, path, field)
+            if _positional_ok(field, b, o, t):
+                # Same layout, no usable keys (e.g. untitled rows):
+                # merge the objects position by position.
+                return self.merge_positional(b, o, t, path)
+        self.conflicts.append(BothModified(path or "/", b, o, t))
+        return t
+
+    def merge_dict(self, b: dict, o: dict, t: dict, path: str) -> dict:
+        merged: dict = {}
+        # Theirs' key order first, then keys only we added.
+        for k in [*t, *(k for k in o if k not in t)]:
+            sub = f"{path}.{k}" if path else k
+            value = self.merge(
+                b.get(k, _MISSING), o.get(k, _MISSING), t.get(k, _MISSING), sub, k
+            )
+            if value is not _MISSING:
+                merged[k] = value
+        return merged
+
+    def merge_keyed(
+        self, b: list, o: list, t: list, key_fn: Any, path: str, field: str
+    ) -> list:
+        base_map = {key_fn(item): item for item in b}
+        ours_map = {key_fn(item): item for item in o}
+        theirs_map = {key_fn(item): item for item in t}
+        # Preserve order: theirs first (server), then ours additions
+        keys = [key_fn(item) for item in t]
+        keys += [k for k in ours_map if k not in theirs_map]
+        merged: list = []
+        for k in keys:
+            value = self.merge(
+                base_map.get(k, _MISSING),
+                ours_map.get(k, _MISSING),
+                theirs_map.get(k, _MISSING),
+                f"{path}[{_key_label(k)}]",
+                "",
+            )
+            if value is not _MISSING:
+                merged.append(value)
+        return merged
+
+    def merge_positional(self, b: list, o: list, t: list, path: str) -> list:
+        merged: list = []
+        for i, (bi, oi, ti) in enumerate(zip(b, o, t)):
+            value = self.merge(bi, oi, ti, f"{path}[{i}]", "")
+            if value is not _MISSING:
+                merged.append(value)
+        return merged
+
+
+def three_way_merge(
+    base: dict, ours: dict, theirs: dict
+) -> tuple[dict, list[Conflict]]:
+    """Three-way merge of dashboard bodies. Returns (merged, conflicts).
+
+    The merged dashboard shares unchanged subtrees with the inputs; copy it
+    before mutating nested values. Volatile top-level fields (id, version,
+    ...) always come from theirs.
+    """
+    merger = _Merger()
+    merged = merger.merge(base, ours, theirs, "", "")
+    merged = dict(merged) if isinstance(merged, dict) else {}
+    for field in _VOLATILE_FIELDS:
+        if field in theirs:
+            merged[field] = theirs[field]
+        else:
+            merged.pop(field, None)
+    return merged, merger.conflicts
+
+
+def _format_conflicts(conflicts: list[Conflict]) -> str:
+    """Format conflicts for human-readable output."""
+    lines = [f"CONFLICTS ({len(conflicts)}):"]
+    for c in conflicts:
+        if isinstance(c, BothModified):
+            lines.append(f"  BOTH MODIFIED: {c.path}")
+            lines.append(
+                f"    base:   {json.dumps(c.base_val, ensure_ascii=False)[:120]}"
+            )
+            lines.append(
+                f"    ours:   {json.dumps(c.our_val, ensure_ascii=False)[:120]}"
+            )
+            lines.append(
+                f"    theirs: {json.dumps(c.their_val, ensure_ascii=False)[:120]}"
+            )
+        elif isinstance(c, DeleteModify):
+            lines.append(f"  DELETE/MODIFY: {c.path}")
+            lines.append(
+                f"    surviving: {json.dumps(c.surviving_val, ensure_ascii=False)[:120]}"
+            )
+        elif isinstance(c, BothAdded):
+            lines.append(f"  BOTH ADDED: {c.path}")
+            lines.append(
+                f"    ours:   {json.dumps(c.our_val, ensure_ascii=False)[:120]}"
+            )
+            lines.append(
+                f"    theirs: {json.dumps(c.their_val, ensure_ascii=False)[:120]}"
+            )
+    return "\n".join(lines)
+
+
+# ---------------------------------------------------------------------------
+# Structural Diff (JSON Patch)
+# ---------------------------------------------------------------------------
+
+# Identity fields of list items, by the name of the list's parent key.
+# Dotted fields reach into nested objects (v2beta1 wraps everything in a
+# kind/spec envelope). Lists not named here, or whose keys turn out not to be
+# unique, fall back to matching by position.
+_LIST_KEY_FIELDS: dict[str, tuple[str, ...]] = {
+    "panels": ("id",),  # also the nested panels of collapsed rows
+    "list": ("name",),  # templating.list, annotations.list
+    "targets": ("refId",),
+    "links": ("title", "url"),
+    # v2beta1
+    "items": ("spec.element.name",),  # GridLayout / AutoGridLayout items
+    "rows": ("spec.title",),  # RowsLayout
+    "tabs": ("spec.title",),  # TabsLayout
+    "variables": ("spec.name",),
+    "annotations": ("spec.name",),
+    "queries": ("spec.refId",),  # elements.*.spec.data.spec.queries
+}
+
+
+class SubtreeHasher:
+    """Canonical-JSON digests of subtrees, each computed once per object.
+
+    Digests are built bottom-up from the children's digests, so hashing a
+    whole dashboard is linear in its size and every nested dict or list can
+    then be compared in O(1). The memo is keyed by object identity and holds
+    a reference to each object, so ids cannot be reused while it lives.
+    """
+
+    def __init__(self) -> None:
+        self._memo: dict[int, tuple[Any, bytes]] = {}
+
+    def __call__(self, obj: Any) -> bytes:
+        import hashlib
+
+        if not isinstance(obj, (dict, list)):
+            return hashlib.blake2b(
+                json.dumps(obj).encode("utf-8"), digest_size=16
+            ).digest()
+        hit = self._memo.get(id(obj))
+        if hit is not None:
+            return hit[1]
+        h = hashlib.blake2b(digest_size=16)
+        if isinstance(obj, dict):
+            h.update(b"{")
+            for key in sorted(obj):
+                h.update(json.dumps(key).encode("utf-8"))
+                h.update(self(obj[key]))
+        else:
+            h.update(b"[")
+            for item in obj:
+                h.update(self(item))
+        digest = h.digest()
+        self._memo[id(obj)] = (obj, digest)
+        return digest
+
+
+@dataclass
+class PatchOp:
+    """One JSON Patch operation plus a readable label and the replaced value."""
+
+    op: dict
+    label: str
+    old: Any = None
+
+
+def _list_key_fn(field: str, *lists: list) -> Any:
+    """Identity function for the items of keyed lists, or None for positional.
+
+    A list is keyed when its field has known identity fields and, in every
+    given version, all items are dicts with unique, non-empty keys.
+    """
+    fields = _LIST_KEY_FIELDS.get(field)
+    if not fields:
+        return None
+
+    def key_fn(item: dict) -> Any:
+        values = tuple(_dig(item, f) for f in fields)
+        return values[0] if len(values) == 1 else values
+
+    for items in lists:
+        if not all(isinstance(item, dict) for item in items):
+            return None
+        keys = [key_fn(item) for item in items]
+        if any(k in (None, "") or k == (None,) * len(fields) for k in keys):
+            return None
+        try:
+            if len(set(keys)) != len(keys):
+                return None
+        except TypeError:
+            return None
+    return key_fn
+
+
+# Layout lists that may merge by position when their items have no usable
+# keys. Other unkeyed lists (fieldConfig overrides, threshold steps,
+# transformations) are ordered data whose items must not be paired by index.
+_POSITIONAL_FIELDS = frozenset({"panels", "items", "rows", "tabs"})
+
+
+def _positional_ok(field: str, b: list, o: list, t: list) -> bool:
+    """Whether three versions of an unkeyed layout list line up by index.
+
+    Requires equal lengths, dict items, and the same identity fields (as far
+    as present) at every index, so a removed-and-added item is not merged
+    into its neighbour.
+    """
+    if field not in _POSITIONAL_FIELDS or not len(b) == len(o) == len(t):
+        return False
+    fields = _LIST_KEY_FIELDS[field]
+    for items in zip(b, o, t):
+        if not all(isinstance(item, dict) for item in items):
+            return False
+        if len({repr(tuple(_dig(item, f) for f in fields)) for item in items}) > 1:
+            return False
+    return True
+
+
+def _dig(obj: Any, dotted: str) -> Any:
+    """Value at a dotted path inside nested dicts, or None."""
+    for part in dotted.split("."):
+        if not isinstance(obj, dict):
+            return None
+        obj = obj.get(part)
+    return obj
+
+
+def _pointer(parts: list) -> str:
+    """RFC 6901 JSON Pointer for a list of path segments."""
+    return "".join("/" + str(p).replace("~", "~0").replace("/", "~1") for p in parts)
+
+
+def _key_label(key: Any) -> str:
+    if isinstance(key, tuple):
+        return "|".join("" if k is None else str(k) for k in key)
+    return str(key)
+
+
+def json_diff(
+    old: Any, new: Any, *, ignore: frozenset[str] = frozenset()
+) -> list[PatchOp]:
+    """Structural diff of two JSON documents.
+
+    Returns PatchOps whose ``op`` dicts form an RFC 6902 JSON Patch that
+    turns ``old`` into ``new`` when applied in order; each label is a
+    readable path with list items named by key (``panels[4]``).
+    Keyed lists (see ``_LIST_KEY_FIELDS``) are matched by identity, so
+    reordering shows up as moves instead of cascading replacements.
+    Subtrees with equal digests are skipped without being walked. Top-level
+    keys in ``ignore`` are left out.
+    """
+    digest = SubtreeHasher()
+    ops: list[PatchOp] = []
+
+    def diff(a: Any, b: Any, path: list, label: str, field: str) -> None:
+        if a is b or digest(a) == digest(b):
+            return
+        if isinstance(a, dict) and isinstance(b, dict):
+            skip = ignore if not path else frozenset()
+            for k in a:
+                if k not in b and k not in skip:
+                    ops.append(
+                        PatchOp(
+                            {"op": "remove", "path": _pointer(path + [k])},
+                            f"{label}.{k}",
+                            a[k],
+                        )
+                    )
+            for k, bv in b.items():
+                if k in skip:
+                    continue
+                if k not in a:
+                    ops.append(
+                        PatchOp(
+                            {"op": "add", "path": _pointer(path + [k]), "value": bv},
+                            f"{label}.{k}",
+                        )
+                    )
+                else:
+                    diff(a[k], bv, path + [k], f"{label}.{k}", k)
+        elif isinstance(a, list) and isinstance(b, list):
+            key_fn = _list_key_fn(field, a, b)
+            if key_fn is None:
+                diff_positional(a, b, path, label)
+            else:
+                diff_keyed(a, b, path, label, key_fn)
+        else:
+            ops.append(
+                PatchOp({"op": "replace", "path": _pointer(path), "value": b}, label, a)
+            )
+
+    def diff_positional(a: list, b: list, path: list, label: str) -> None:
+        for i in range(min(len(a), len(b))):
+            diff(a[i], b[i], path + [i], f"{label}[{i}]", "")
+        for i in range(len(a) - 1, len(b) - 1, -1):
+            ops.append(
+                PatchOp(
+                    {"op": "remove", "path": _pointer(path + [i])},
+                    f"{label}[{i}]",
+                    a[i],
+                )
+            )
+        for i in range(len(a), len(b)):
+            ops.append(
+                PatchOp(
+                    {"op": "add", "path": _pointer(path + [i]), "value": b[i]},
+                    f"{label}[{i}]",
+                )
+            )
+
+    def diff_keyed(a: list, b: list, path: list, label: str, key_fn: Any) -> None:
+        a_items = {key_fn(item): item for item in a}
+        b_keys = {key_fn(item) for item in b}
+        working = [key_fn(item) for item in a]
+        # Removals first, from the end, so earlier indexes stay valid.
+        for i in range(len(working) - 1, -1, -1):
+            if working[i] not in b_keys:
+                k = working.pop(i)
+                ops.append(
+                    PatchOp(
+                        {"op": "remove", "path": _pointer(path + [i])},
+                        f"{label}[{_key_label(k)}]",
+                        a_items[k],
+                    )
+                )
+        # Then walk the target order: everything before ``i`` is final.
+        for i, item in enumerate(b):
+            k = key_fn(item)
+            item_label = f"{label}[{_key_label(k)}]"
+            if k not in a_items:
+                working.insert(i, k)
+                ops.append(
+                    PatchOp(
+                        {"op": "add", "path": _pointer(path + [i]), "value": item},
+                        item_label,
+                    )
+                )
+                continue
+            j = working.index(k, i)
+            if j != i:
+                working.insert(i, working.pop(j))
+                ops.append(
+                    PatchOp(
+                        {
+                            "op": "move",
+                            "from": _pointer(path + [j]),
+                            "path": _pointer(path + [i]),
+                        },
+                        item_label,
+                    )
+                )
+            diff(a_items[k], item, path + [i], item_label, "")
+
+    diff(old, new, [], "", "")
+    return ops
+
+
+def _format_diff_report(ops: list[PatchOp], limit: int = 100) -> str:
+    """Compact one-line-per-change report of ``json_diff`` output."""
+
+    def short(value: Any) -> str:
+        return json.dumps(value, ensure_ascii=False)[:limit]
+
+    lines = []
+    for p in ops:
+        name = p.label.lstrip(".") or "/"
+        if p.op["op"] == "add":
+            lines.append(f"  + {name}: {short(p.op['value'])}")
+        elif p.op["op"] == "remove":
+            lines.append(f"  - {name}: {short(p.old)}")
+        elif p.op["op"] == "move":
+            lines.append(f"  > {name}: moved {p.op['from']} -> {p.op['path']}")
+        else:
+            lines.append(f"  ~ {name}: {short(p.old)} -> {short(p.op['value'])}")
+    return "\n".join(lines)
+
+
+# ---------------------------------------------------------------------------
+# Query Helpers
+# ---------------------------------------------------------------------------
+
+
+# Template variable values: one string, or a list for multi-value variables.
+Variables = dict[str, str | list[str]]
+
+# Compiled templates by source string, shared by all variable sets. Panel
+# sweeps and dashboard snapshots render the same target strings many times.
+_TEMPLATE_CACHE: dict[str, tuple | None] = {}
+_TEMPLATE_CACHE_MAX = 4096
+
+# Default format of multi-value variables per datasource type, as Grafana's
+# datasources apply it when the placeholder has no ``:format`` modifier.
+_MULTI_VALUE_FORMATS = {
+    "prometheus": "regex",
+    "loki": "regex",
+    "mysql": "sqlstring",
+    "postgres": "sqlstring",
+    "grafana-postgresql-datasource": "sqlstring",
+    "mssql": "sqlstring",
+}
+
+# Placeholder pattern, compiled on first use.
+_VARIABLE_RE: Any = None
+
+
+def _variable_pattern() -> Any:
+    """``$var``, ``${var}``, ``${var:format}``, ``[[var]]`` and ``[[var:format]]``."""
+    import re
+
+    global _VARIABLE_RE
+    if _VARIABLE_RE is None:
+        _VARIABLE_RE = re.compile(
+            r"\$(\w+)|\$\{(\w+)(?::([^}]*))?\}|\[\[(\w+)(?::([^\]]*))?\]\]"
+        )
+    return _VARIABLE_RE
+
+
+def _compile_template(text: str) -> tuple | None:
+    """Split ``text`` into literals and ``(name, format, source)`` placeholders.
+
+    Returns None for strings without placeholders. Results are cached per
+    string, so each distinct template is parsed once per process.
+    """
+    try:
+        return _TEMPLATE_CACHE[text]
+    except KeyError:
+        pass
+    parts: list = []
+    pos = 0
+    for m in _variable_pattern().finditer(text):
+        if m.start() > pos:
+            parts.append(text[pos : m.start()])
+        name = m.group(1) or m.group(2) or m.group(4)
+        fmt = m.group(3) if m.group(2) else m.group(5)
+        parts.append((name, fmt, m.group(0)))
+        pos = m.end()
+    if parts and pos < len(text):
+        parts.append(text[pos:])
+    compiled = tuple(parts) if parts else None
+    if len(_TEMPLATE_CACHE) >= _TEMPLATE_CACHE_MAX:
+        _TEMPLATE_CACHE.clear()
+    _TEMPLATE_CACHE[text] = compiled
+    return compiled
+
+
+def _format_variable(name: str, value: str | list[str], fmt: str | None) -> str:
+    """Render a variable value with a Grafana ``${var:format}`` modifier.
+
+    Without a format (or with one that does not apply to plain values),
+    single values are inserted as-is and multi-value variables use glob
+    syntax (``{a,b}``), like Grafana's default.
+    """
+    import re
+
+    values = [str(v) for v in value] if isinstance(value, list) else [str(value)]
+    multi = isinstance(value, list) and len(values) != 1
+    if fmt in (None, "", "glob"):
+        return "{" + ",".join(values) + "}" if multi else values[0] if values else ""
+    if fmt in ("raw", "text"):
+        return ",".join(values)
+    if fmt == "csv":
+        return ",".join(values)
+    if fmt == "pipe":
+        return "|".join(values)
+    if fmt == "regex":
+        escaped = [re.sub(r"[\\^$*+?.()|{}\[\]/]", r"\\\g<0>", v) for v in values]
+        return "(" + "|".join(escaped) + ")" if multi else "".join(escaped)
+    if fmt == "json":
+        return json.dumps(values if multi else values[0] if values else "")
+    if fmt == "singlequote":
+        return ",".join("'" + v.replace("'", "\\'") + "'" for v in values)
+    if fmt == "doublequote":
+        return ",".join('"' + v.replace('"', '\\"') + '"' for v in values)
+    if fmt == "sqlstring":
+        return ",".join("'" + v.replace("'", "''") + "'" for v in values)
+    if fmt == "lucene":
+        escaped = [
+            re.sub(r'([!*+\-=<>\s&|()\[\]{}^~?:\\/"])', r"\\\1", v) for v in values
+        ]
+        if not isinstance(value, list):
+            return escaped[0]
+        if not escaped:
+            return "__empty__"
+        return "(" + " OR ".join('"' + v + '"' for v in escaped) + ")"
+    if fmt == "percentencode":
+        from urllib.parse import quote
+
+        return quote("{" + ",".join(values) + "}" if multi else values[0], safe="")
+    if fmt == "queryparam":
+        from urllib.parse import quote
+
+        return "&".join(f"var-{name}={quote(v, safe='')}" for v in values)
+    # Formats for other value kinds (date, distributed, ...): Grafana's default.
+    return _format_variable(name, value, None)
+
+
+def _add_variable(variables: Variables, spec: str) -> None:
+    """Apply ``--var name=value``; repeating a name makes it multi-value."""
+    name, _, value = spec.partition("=")
+    previous = variables.get(name)
+    if previous is None:
+        variables[name] = value
+    elif isinstance(previous, list):
+        previous.append(value)
+    else:
+        variables[name] = [previous, value]
+
+
+def _resolve_variables(
+    obj: Any, variables: Variables, multi_format: str | None = None
+) -> Any:
+    """Recursively replace ``$var``/``${var[:format]}``/``[[var]]`` in strings.
+
+    Each string is matched against one precompiled pattern and its split is
+    cached, so the cost no longer grows with the number of variables.
+    ``multi_format`` is the format used for multi-value variables without a
+    modifier (see ``_MULTI_VALUE_FORMATS``). Unknown names, and names
+    starting with ``__`` (Grafana macros like ``$__timeFilter``,
+    ``$__rate_interval``), are left as they are. Strings without
+    placeholders are returned unchanged, not copied.
+    """
+    if isinstance(obj, str):
+        if "$" not in obj and "[[" not in obj:
+            return obj
+        parts = _compile_template(obj)
+        if parts is None:
+            return obj
+        out = []
+        for part in parts:
+            if isinstance(part, str):
+                out.append(part)
+                continue
+            name, fmt, source = part
+            value = variables.get(name)
+            if value is None or name.startswith("__"):
+                out.append(source)
+            elif fmt is None and isinstance(value, list) and multi_format:
+                out.append(_format_variable(name, value, multi_format))
+            else:
+                out.append(_format_variable(name, value, fmt))
+        return "".join(out)
+    elif isinstance(obj, dict):
+        return {
+            k: _resolve_variables(v, variables, multi_format) for k, v in obj.items()
+        }
+    elif isinstance(obj, list):
+        return [_resolve_variables(item, variables, multi_format) for item in obj]
+    return obj
+
+
+# Rows per slice when the text exporters format columns; bounds the transient
+# string copies to one slice instead of the whole result.
+_EXPORT_SLICE_ROWS = 65536
+
+
+@dataclass
+class FrameTable:
+    """Column-oriented view of all frames returned for one refId.
+
+    ``columns`` is a list of ``{"name": str, "type": str}`` dicts.
+    ``data`` holds one list per column, aligned to ``columns``.
+    """
+
+    columns: list[dict]
+    data: list[list]
+
+    @property
+    def num_rows(self) -> int:
+        return len(self.data[0]) if self.data else 0
+
+
+def _frame_labels(fields: list[dict]) -> dict[str, str]:
+    """Merge the per-field labels of a frame into one mapping."""
+    labels: dict[str, str] = {}
+    for field in fields:
+        if field.get("labels"):
+            labels.update(field["labels"])
+    return labels
+
+
+def _frames_schema(frames: list[dict]) -> tuple[list[str], list[dict]]:
+    """Union schema of a frame list: (sorted label names, data columns)."""
+    label_names: set[str] = set()
+    data_columns: list[dict] = []
+    seen_data: set[str] = set()
+    for frame in frames:
+        for field in frame.get("schema", {}).get("fields", []):
+            if field.get("labels"):
+                label_names.update(field["labels"].keys())
+            fname = field["name"]
+            if fname not in seen_data:
+                seen_data.add(fname)
+                data_columns.append(
+                    {"name": fname, "type": field.get("type", "string")}
+                )
+    return sorted(label_names), data_columns
+
+
+def _decode_frame(
+    frame: dict, label_names: list[str], data_columns: list[dict]
+) -> list[list] | None:
+    """Decode one frame into column lists (label columns, then data columns).
+
+    Field names are mapped to indexes once per frame. Value arrays that
+    already have the frame's row count are used as-is, without copying.
+    Returns None for frames without fields or values.
+    """
+    fields = frame.get("schema", {}).get("fields", [])
+    values = frame.get("data", {}).get("values", [])
+    if not fields or not values:
+        return None
+
+    labels = _frame_labels(fields)
+    index: dict[str, int] = {}
+    for fi, f in enumerate(fields):
+        index.setdefault(f["name"], fi)
+    num_rows = len(values[0])
+
+    out: list[list] = [[labels.get(n, "")] * num_rows for n in label_names]
+    for dc in data_columns:
+        idx = index.get(dc["name"])
+        vals = values[idx] if idx is not None and idx < len(values) else []
+        if len(vals) == num_rows:
+            out.append(vals)
+        elif len(vals) > num_rows:
+            out.append(vals[:num_rows])
+        else:
+            out.append(list(vals) + [None] * (num_rows - len(vals)))
+    return out
+
+
+def _ref_frames(result: dict, ref_id: str) -> list[dict]:
+    return result.get("results", {}).get(ref_id, {}).get("frames", [])
+
+
+def _frames_row_count(frames: list[dict]) -> int:
+    """Total row count of a frame list, without decoding any values."""
+    total = 0
+    for frame in frames:
+        values = frame.get("data", {}).get("values", [])
+        if frame.get("schema", {}).get("fields") and values:
+            total += len(values[0])
+    return total
+
+
+def _decode_frames(result: dict, ref_id: str = "A") -> FrameTable:
+    """Decode the frames of one refId into a column-oriented FrameTable."""
+    frames = _ref_frames(result, ref_id)
+    if not frames:
+        return FrameTable([], [])
+    with _PHASES.measure("frame decode", ref_id) as span:
+        table = _decode_frame_list(frames)
+        span.rows = table.num_rows
+    return table
+
+
+def _decode_frame_list(frames: list[dict]) -> FrameTable:
+    """Decode a non-empty frame list into one FrameTable (union schema)."""
+    label_names, data_columns = _frames_schema(frames)
+    columns = [{"name": n, "type": "string"} for n in label_names] + data_columns
+
+    chunks: list[list[list]] = [[] for _ in columns]
+    for frame in frames:
+        decoded = _decode_frame(frame, label_names, data_columns)
+        if decoded is None:
+            continue
+        for ci, col in enumerate(decoded):
+            chunks[ci].append(col)
+
+    data: list[list] = []
+    for parts in chunks:
+        if len(parts) == 1:
+            data.append(parts[0])
+        else:
+            col: list = []
+            for part in parts:
+                col.extend(part)
+            data.append(col)
+    return FrameTable(columns, data)
+
+
+def _unique_column_positions(columns: list[dict]) -> list[tuple[str, int]]:
+    """(name, column index) per distinct name; the last duplicate wins."""
+    positions: dict[str, int] = {}
+    for ci, col in enumerate(columns):
+        positions[col["name"]] = ci
+    return list(positions.items())
+
+
+def _table_rows(table: FrameTable, limit: int | None = None) -> list[dict]:
+    """Materialise (at most ``limit``) rows of a FrameTable as dicts."""
+    n = table.num_rows if limit is None else min(limit, table.num_rows)
+    positions = _unique_column_positions(table.columns)
+    return [{name: table.data[ci][i] for name, ci in positions} for i in range(n)]
+
+
+# Formats written through pyarrow, one record batch per data frame.
+_ARROW_FORMATS = ("parquet", "arrow", "feather")
+
+_EXPORT_EXTENSIONS = {
+    "parquet": "parquet",
+    "tsv": "tsv",
+    "jsonl": "jsonl",
+    "arrow": "arrow",
+    "feather": "feather",
+}
+
+
+def _require_pyarrow(fmt: str) -> Any:
+    """Import pyarrow or exit with install instructions."""
+    try:
+        import pyarrow as pa
+    except ImportError:
+        print(
+            f"ERROR: pyarrow is required for {fmt} export.\n"
+            "Install with:  uv pip install pyarrow\n"
+            "Or use --format tsv / --format jsonl instead.",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+    return pa
+
+
+def _arrow_type(pa: Any, col: dict) -> Any:
+    if col["type"] == "time":
+        return pa.timestamp("ms", tz="UTC")
+    if col["type"] == "number":
+        return pa.float64()
+    return pa.string()
+
+
+def _arrow_array(pa: Any, col: dict, values: list) -> Any:
+    """Build an Arrow array straight from a frame's value list."""
+    if col["type"] == "time":
+        return pa.array(values, type=pa.int64()).cast(pa.timestamp("ms", tz="UTC"))
+    if col["type"] == "number":
+        return pa.array(values, type=pa.float64())
+    try:
+        return pa.array(values, type=pa.string())
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.array(
+            [str(v) if v is not None else None for v in values], type=pa.string()
+        )
+
+
+def _export_arrow_table(table: FrameTable, fmt: str, path: str) -> str:
+    """Export a decoded FrameTable to Parquet/Arrow/Feather. Requires pyarrow."""
+    pa = _require_pyarrow(fmt.capitalize())
+
+    schema = pa.schema([pa.field(c["name"], _arrow_type(pa, c)) for c in table.columns])
+    arrays = [_arrow_array(pa, c, v) for c, v in zip(table.columns, table.data)]
+    writer = _open_arrow_writer(pa, fmt, path, schema)
+    try:
+        writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+    finally:
+        writer.close()
+    return path
+
+
+def _open_arrow_writer(pa: Any, fmt: str, path: str, schema: Any) -> Any:
+    """Open an incremental writer: ParquetWriter or an Arrow IPC file writer."""
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+
+        return pq.ParquetWriter(path, schema, compression="snappy")
+    # Feather v2 is the Arrow IPC file format; it is LZ4-compressed by default.
+    options = pa.ipc.IpcWriteOptions(compression="lz4" if fmt == "feather" else None)
+    return pa.ipc.new_file(path, schema, options=options)
+
+
+def _export_arrow_frames(frames: list[dict], fmt: str, path: str) -> str | None:
+    """Write frames to Parquet/Arrow/Feather, one record batch per frame.
+
+    Batches are built straight from each frame's ``values`` arrays, so peak
+    memory is bounded by the largest frame rather than the whole result.
+    Small frames (one short series each) are coalesced up to
+    ``_EXPORT_SLICE_ROWS`` rows so Parquet does not get a row group per series.
+    ``frames`` is iterated twice (schema, then data), so a re-iterable
+    source such as ``StreamedFrames`` works too.
+    """
+    pa = _require_pyarrow(fmt.capitalize())
+
+    label_names, data_columns = _frames_schema(frames)
+    columns = [{"name": n, "type": "string"} for n in label_names] + data_columns
+    if not columns:
+        return None
+    schema = pa.schema([pa.field(c["name"], _arrow_type(pa, c)) for c in columns])
+
+    writer = _open_arrow_writer(pa, fmt, path, schema)
+    pending: list[Any] = []
+    pending_rows = total_rows = 0
+    try:
+        for frame in frames:
+            decoded = _decode_frame(frame, label_names, data_columns)
+            if not decoded or not decoded[0]:
+                continue
+            arrays = [_arrow_array(pa, c, v) for c, v in zip(columns, decoded)]
+            pending.append(pa.RecordBatch.from_arrays(arrays, schema=schema))
+            pending_rows += len(decoded[0])
+            total_rows += len(decoded[0])
+            if pending_rows >= _EXPORT_SLICE_ROWS:
+                writer.write_table(pa.Table.from_batches(pending, schema=schema))
+                pending, pending_rows = [], 0
+        if pending:
+            writer.write_table(pa.Table.from_batches(pending, schema=schema))
+    finally:
+        writer.close()
+    if not total_rows:
+        os.unlink(path)
+        return None
+    return path
+
+
+def _format_time_column(values: list, cache: dict) -> list[str]:
+    """Render epoch-ms values as ISO 8601 strings (UTC, millisecond precision).
+
+    Series of one query share their timestamps, so rendered values are
+    memoised in ``cache`` across slices and frames.
+    """
+    from datetime import datetime, timedelta
+
+    epoch = datetime(1970, 1, 1)
+    out: list[str] = []
+    for val in values:
+        text = cache.get(val)
+        if text is None:
+            if isinstance(val, (int, float)):
+                text = (epoch + timedelta(milliseconds=val)).isoformat(
+                    timespec="milliseconds"
+                ) + "Z"
+            elif val is None:
+                text = ""
+            else:
+                text = str(val)
+            cache[val] = text
+        out.append(text)
+    return out
+
+
+def _json_column(values: list) -> list[str]:
+    """JSON-encode each value of a column (same output as ``json.dumps``)."""
+    import math
+    from json.encoder import encode_basestring
+
+    encode = json.JSONEncoder(ensure_ascii=False).encode
+
+    def encode_float(v: float) -> str:
+        return repr(v) if math.isfinite(v) else encode(v)
+
+    by_type: dict[type, Any] = {
+        float: encode_float,
+        int: int.__repr__,
+        str: encode_basestring,
+        type(None): lambda _v: "null",
+        bool: lambda v: "true" if v else "false",
+    }
+    get = by_type.get
+    return [get(type(v), encode)(v) for v in values]
+
+
+def _write_tsv_rows(writer: Any, table: FrameTable, time_cache: dict) -> None:
+    """Append the rows of a FrameTable to a csv writer, slice by slice."""
+    for start in range(0, table.num_rows, _EXPORT_SLICE_ROWS):
+        stop = start + _EXPORT_SLICE_ROWS
+        text_cols: list[list[str]] = []
+        for col, values in zip(table.columns, table.data):
+            part = values[start:stop]
+            if col["type"] == "time":
+                text_cols.append(_format_time_column(part, time_cache))
+            else:
+                text_cols.append(["" if v is None else str(v) for v in part])
+        writer.writerows(zip(*text_cols))
+
+
+def _export_tsv(table: FrameTable, path: str) -> str:
+    """Export to TSV. Epoch-ms timestamps are converted to ISO 8601."""
+    import csv
+
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, delimiter="\t", quoting=csv.QUOTE_MINIMAL)
+        writer.writerow([c["name"] for c in table.columns])
+        _write_tsv_rows(writer, table, {})
+    return path
+
+
+def _jsonl_template(columns: list[dict]) -> tuple[list[tuple[str, int]], str]:
+    """(unique column positions, ``%``-template of one JSON line) for columns."""
+    positions = _unique_column_positions(columns)
+    template = (
+        "{"
+        + ", ".join(
+            json.dumps(name, ensure_ascii=False).replace("%", "%%") + ": %s"
+            for name, _ in positions
+        )
+        + "}\n"
+    )
+    return positions, template
+
+
+def _write_jsonl_rows(
+    f: Any, table: FrameTable, positions: list[tuple[str, int]], template: str
+) -> None:
+    """Append the rows of a FrameTable as JSON lines, slice by slice."""
+    for start in range(0, table.num_rows, _EXPORT_SLICE_ROWS):
+        stop = start + _EXPORT_SLICE_ROWS
+        encoded = [_json_column(table.data[ci][start:stop]) for _, ci in positions]
+        f.writelines(template % parts for parts in zip(*encoded))
+
+
+def _export_jsonl(table: FrameTable, path: str) -> str:
+    """Export to JSON Lines (one JSON object per row).
+
+    Columns are JSON-encoded slice by slice and joined through a per-table
+    line template, so no per-row dict is built.
+    """
+    positions, template = _jsonl_template(table.columns)
+    with open(path, "w", encoding="utf-8") as f:
+        _write_jsonl_rows(f, table, positions, template)
+    return path
+
+
+def _export_table(table: FrameTable, fmt: str, path: str) -> str | None:
+    """Export a decoded FrameTable to the given format. Returns path or None."""
+    if not table.columns or not table.num_rows:
+        return None
+    if fmt in _ARROW_FORMATS:
+        return _export_arrow_table(table, fmt, path)
+    elif fmt == "tsv":
+        return _export_tsv(table, path)
+    elif fmt == "jsonl":
+        return _export_jsonl(table, path)
+    else:
+        print(f"Unknown format: {fmt}", file=sys.stderr)
+        sys.exit(1)
+
+
+def _export_frames(result: dict, ref_id: str, fmt: str, path: str) -> str | None:
+    """Export the frames of one refId to the given format. Returns path or None.
+
+    Arrow-backed formats are written frame by frame from the raw ``values``
+    arrays; text formats go through the columnar decoder.
+    """
+    if fmt in _ARROW_FORMATS:
+        # Frames are decoded batch by batch while writing; timed as export.
+        with _PHASES.measure("export", ref_id) as span:
+            exported = _export_arrow_frames(_ref_frames(result, ref_id), fmt, path)
+            span.bytes = os.path.getsize(exported) if exported else 0
+        return exported
+    table = _decode_frames(result, ref_id)
+    with _PHASES.measure("export", ref_id) as span:
+        exported = _export_table(table, fmt, path)
+        span.bytes = os.path.getsize(exported) if exported else 0
+    return exported
+
+
+def _auto_output_path(output_dir: str | None, prefix: str, ext: str) -> str:
+    """Generate an output file path, using tempfile if no output_dir."""
+    import tempfile
+
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        fd, path = tempfile.mkstemp(
+            suffix=f".{ext}", prefix=f"{prefix}_", dir=output_dir
+        )
+    else:
+        fd, path = tempfile.mkstemp(suffix=f".{ext}", prefix=f"{prefix}_")
+    os.close(fd)
+    return path
+
+
+def _check_query_errors(result: dict) -> None:
+    """Check per-refId errors (Grafana returns 200 even on query failure)."""
+    for ref_id, ref_result in result.get("results", {}).items():
+        if "error" in ref_result:
+            print(f"Query {ref_id} failed: {ref_result['error']}", file=sys.stderr)
+            sys.exit(1)
+        if ref_result.get("status", 200) != 200:
+            print(
+                f"Query {ref_id} returned status {ref_result['status']}",
+                file=sys.stderr,
+            )
+            sys.exit(1)
+
+
+def _format_from_path(path: str) -> str | None:
+    """Detect export format from file extension."""
+    for fmt, ext in _EXPORT_EXTENSIONS.items():
+        if path.endswith(f".{ext}"):
+            return fmt
+    return None
+
+
+def _print_preview(result: dict, ref_id: str, n: int) -> None:
+    """Print up to n rows as JSONL to stdout, plus a summary line."""
+    _print_table_preview(_decode_frames(result, ref_id), ref_id, n)
+
+
+def _print_table_preview(table: FrameTable, ref_id: str, n: int) -> None:
+    """Print up to n rows of a decoded table as JSONL, plus a summary line."""
+    for row in _table_rows(table, n):
+        print(json.dumps(row, ensure_ascii=False))
+    total = table.num_rows
+    if total > n:
+        print(f"... ({total - n} more rows)", file=sys.stderr)
+    print(f"Total: {total} rows for refId={ref_id}", file=sys.stderr)
+
+
+def _handle_query_output(
+    result: dict,
+    ref_ids: list[str],
+    *,
+    as_json: bool,
+    preview: int | None,
+    output: str | None,
+    output_dir: str | None,
+    fmt: str | None,
+) -> None:
+    """Shared output logic for query and panel-query commands."""
+    if fmt and fmt not in _EXPORT_EXTENSIONS:
+        print(
+            f"Unknown format: {fmt}. Use {', '.join(_EXPORT_EXTENSIONS)}.",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+    if as_json:
+        _pp(result)
+        return
+
+    if preview is not None:
+        for ref_id in ref_ids:
+            _print_preview(result, ref_id, preview)
+        return
+
+    if output:
+        # Single explicit path — export first refId (or all if multiple)
+        effective_fmt = fmt or _format_from_path(output) or "parquet"
+        if len(ref_ids) == 1:
+            exported = _export_frames(result, ref_ids[0], effective_fmt, output)
+            if exported:
+                print(f"Exported refId={ref_ids[0]}: {exported}", file=sys.stderr)
+            else:
+                print(f"No data for refId={ref_ids[0]}", file=sys.stderr)
+        else:
+            base, _ = os.path.splitext(output)
+            for ref_id in ref_ids:
+                rpath = f"{base}_{ref_id}.{_EXPORT_EXTENSIONS[effective_fmt]}"
+                exported = _export_frames(result, ref_id, effective_fmt, rpath)
+                if exported:
+                    print(f"Exported refId={ref_id}: {exported}", file=sys.stderr)
+        return
+
+    if output_dir:
+        effective_fmt = fmt or "parquet"
+        for ref_id in ref_ids:
+            path = _auto_output_path(
+                output_dir, f"grafana_query_{ref_id}", _EXPORT_EXTENSIONS[effective_fmt]
+            )
+            exported = _export_frames(result, ref_id, effective_fmt, path)
+            if exported:
+                print(f"Exported refId={ref_id}: {exported}", file=sys.stderr)
+        return
+
+    # Auto mode: small → preview, large → temp file
+    for ref_id in ref_ids:
+        num_rows = _frames_row_count(_ref_frames(result, ref_id))
+        if not num_rows:
+            print(f"No data for refId={ref_id}", file=sys.stderr)
+            continue
+        if num_rows <= 50:
+            _print_preview(result, ref_id, 50)
+        else:
+            effective_fmt = fmt or "parquet"
+            path = _auto_output_path(
+                None, f"grafana_query_{ref_id}", _EXPORT_EXTENSIONS[effective_fmt]
+            )
+            _export_frames(result, ref_id, effective_fmt, path)
+            print(
+                f"Exported {num_rows} rows for refId={ref_id}: {path}",
+                file=sys.stderr,
+            )
+
+
+# ---------------------------------------------------------------------------
+# Streaming Responses
+# ---------------------------------------------------------------------------
+
+
+class DsResponseParser:
+    """Incremental, event-based parser for ``/api/ds/query`` response bodies.
+
+    ``feed()`` takes text as it arrives and returns ``(refId, key, value)``
+    events: one ``key == "frames"`` event per complete data frame, and one
+    per other field of a refId result (``status``, ``error``, ...). The
+    structure around the frames is walked token by token. A frame is
+    collected with a resumable bracket scan that skips whole strings in one
+    regex step; scanned text is set aside per chunk and joined once when the
+    frame is complete, so only the current frame is held in memory and each
+    byte is scanned once.
+    """
+
+    def __init__(self) -> None:
+        import re
+
+        string = r'"[^"\\]*(?:\\.[^"\\]*)*"'
+        self._string = re.compile(string, re.DOTALL)
+        # Everything up to the next bracket, skipping whole strings.
+        self._run = re.compile(rf'(?:{string}|[^"{{}}\[\]]+)*', re.DOTALL)
+        self._skip = re.compile(r"[\s,:]*")
+        self._scalar = re.compile(r"[^\s,:\]}]+")
+        self.buf = ""
+        self.pos = 0
+        # Open containers: [kind, label under the parent, pending key, index].
+        self.stack: list[list] = []
+        self.expect_key = False
+        # Container value being collected: (path, parts, depth).
+        self._capture_state: tuple[list, list[str], int] | None = None
+        self.done = False
+
+    @staticmethod
+    def _captured(path: list) -> bool:
+        """Whether the value at ``path`` is emitted whole instead of descended."""
+        if len(path) == 1:
+            return path[0] != "results"
+        if len(path) == 3:
+            return path[2] != "frames"
+        return len(path) >= 4
+
+    def _after_value(self) -> None:
+        if self.stack:
+            top = self.stack[-1]
+            if top[0] == "obj":
+                self.expect_key = True
+            else:
+                top[3] += 1
+
+    def _emit(self, events: list, path: list, text: str) -> None:
+        if len(path) >= 3 and path[0] == "results":
+            key = "frames" if path[2] == "frames" else path[2]
+            events.append((path[1], key, json.loads(text)))
+        self._after_value()
+
+    def _scan_container(self, events: list) -> bool:
+        """Continue collecting the current container; True once it is complete."""
+        path, parts, depth = self._capture_state
+        buf = self.buf
+        scan = self.pos
+        while True:
+            scan = self._run.match(buf, scan).end()
+            if scan == len(buf) or buf[scan] == '"':
+                # Out of text, or a string that continues in the next chunk:
+                # keep the scanned part aside and resume from here.
+                parts.append(buf[self.pos : scan])
+                self.pos = scan
+                self._capture_state = (path, parts, depth)
+                return False
+            depth += 1 if buf[scan] in "{[" else -1
+            scan += 1
+            if depth == 0:
+                parts.append(buf[self.pos : scan])
+                self.pos = scan
+                self._capture_state = None
+                self._emit(events, path, "".join(parts))
+                return True
+
+    def feed(self, text: str, final: bool = False) -> list[tuple[str, str, Any]]:
+        events: list[tuple[str, str, Any]] = []
+        self.buf = self.buf[self.pos :] + text
+        self.pos = 0
+        buf = self.buf
+        while not self.done:
+            if self._capture_state is not None:
+                if not self._scan_container(events):
+                    break
+                continue
+            self.pos = self._skip.match(buf, self.pos).end()
+            if self.pos >= len(buf):
+                break
+            c = buf[self.pos]
+            if c in "}]":
+                self.stack.pop()
+                self.pos += 1
+                if not self.stack:
+                    self.done = True
+                    break
+                self._after_value()
+                continue
+            top = self.stack[-1] if self.stack else None
+            if top is not None and top[0] == "obj" and self.expect_key:
+                m = self._string.match(buf, self.pos)
+                if m is None:
+                    break
+                top[2] = json.loads(m.group())
+                self.pos = m.end()
+                self.expect_key = False
+                continue
+            if top is None:
+                path: list = []
+            else:
+                label = top[2] if top[0] == "obj" else top[3]
+                path = [entry[1] for entry in self.stack[1:]] + [label]
+            if c in "{[" and (top is None or not self._captured(path)):
+                self.stack.append(
+                    ["obj" if c == "{" else "arr", path[-1] if path else None, None, 0]
+                )
+                self.expect_key = c == "{"
+                self.pos += 1
+                continue
+            if c in "{[":
+                self._capture_state = (path, [], 0)
+                continue
+            # Scalars and strings are small: wait until they are complete.
+            m = (self._string if c == '"' else self._scalar).match(buf, self.pos)
+            if m is None or (m.end() == len(buf) and not final and c != '"'):
+                break
+            text_value, self.pos = m.group(), m.end()
+            if top is not None and self._captured(path):
+                self._emit(events, path, text_value)
+            else:
+                self._after_value()
+        return events
+
+
+def _iter_ds_events(chunks: Any) -> Any:
+    """Parse an iterable of body byte chunks into DsResponseParser events."""
+    import codecs
+
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    parser = DsResponseParser()
+    for chunk in chunks:
+        yield from parser.feed(decoder.decode(chunk))
+    yield from parser.feed(decoder.decode(b"", final=True), final=True)
+
+
+def _iter_file_chunks(path: str, size: int = 1 << 20) -> Any:
+    with open(path, "rb") as f:
+        while chunk := f.read(size):
+            yield chunk
+
+
+class StreamedFrames:
+    """Re-iterable frames of one refId in a spooled ``/api/ds/query`` body.
+
+    Each iteration re-parses the file, so the exporters can take a schema
+    pass and a write pass while holding one frame at a time. Non-frame
+    fields of the refId (``status``, ``error``) are collected in ``meta``.
+    Once they report a failure no more frames are yielded, so the write pass
+    of a failed refId finds nothing to write.
+    """
+
+    def __init__(self, path: str, ref_id: str) -> None:
+        self.path = path
+        self.ref_id = ref_id
+        self.meta: dict[str, Any] = {}
+
+    def __iter__(self) -> Any:
+        for ref_id, key, value in _iter_ds_events(_iter_file_chunks(self.path)):
+            if ref_id != self.ref_id:
+                continue
+            if key != "frames":
+                self.meta[key] = value
+            elif not _ref_failed(self.meta):
+                yield value
+
+
+def _export_streamed_text(frames: Any, fmt: str, path: str) -> str | None:
+    """Write TSV/JSONL from a re-iterable frame source, one frame at a time.
+
+    The first pass collects the union schema, the second decodes and writes
+    each frame, so the output matches ``_export_table`` on the full result.
+    """
+    import csv
+
+    label_names, data_columns = _frames_schema(frames)
+    columns = [{"name": n, "type": "string"} for n in label_names] + data_columns
+    if not columns:
+        return None
+    rows = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        if fmt == "tsv":
+            writer = csv.writer(f, delimiter="\t", quoting=csv.QUOTE_MINIMAL)
+            writer.writerow([c["name"] for c in columns])
+            time_cache: dict = {}
+        else:
+            positions, template = _jsonl_template(columns)
+        for frame in frames:
+            decoded = _decode_frame(frame, label_names, data_columns)
+            if not decoded or not decoded[0]:
+                continue
+            table = FrameTable(columns, decoded)
+            if fmt == "tsv":
+                _write_tsv_rows(writer, table, time_cache)
+            else:
+                _write_jsonl_rows(f, table, positions, template)
+            rows += table.num_rows
+    if not rows:
+        os.unlink(path)
+        return None
+    return path
+
+
+def _stream_frames_jsonl(
+    chunks: Any, path_for: Any
+) -> tuple[dict[str, dict], set[str]]:
+    """Write JSONL straight from the response stream, frame by frame.
+
+    Every frame is exported as soon as it has been received, so nothing is
+    held in memory beyond it. A refId's file is opened at ``path_for(refId)``
+    on its first frame with rows, and nothing is written for a refId after
+    it reported an error or a non-200 status. Returns the non-frame fields
+    per refId and the refIds whose frames do not share one schema: a
+    buffered export gives their rows the union columns, so they have to be
+    rewritten.
+    """
+    meta: dict[str, dict] = {}
+    files: dict[str, Any] = {}
+    schemas: dict[str, tuple] = {}
+    mixed: set[str] = set()
+    try:
+        for ref_id, key, value in _iter_ds_events(chunks):
+            ref_meta = meta.setdefault(ref_id, {})
+            if key != "frames":
+                ref_meta[key] = value
+                continue
+            if _ref_failed(ref_meta) or ref_id in mixed:
+                continue
+            label_names, data_columns = _frames_schema([value])
+            if schemas.setdefault(ref_id, (label_names, data_columns)) != (
+                label_names,
+                data_columns,
+            ):
+                mixed.add(ref_id)
+                continue
+            decoded = _decode_frame(value, label_names, data_columns)
+            if not decoded or not decoded[0]:
+                continue
+            columns = [{"name": n, "type": "string"} for n in label_names]
+            table = FrameTable(columns + data_columns, decoded)
+            if ref_id not in files:
+                files[ref_id] = open(path_for(ref_id), "w", encoding="utf-8")
+            positions, template = _jsonl_template(table.columns)
+            _write_jsonl_rows(files[ref_id], table, positions, template)
+    finally:
+        for f in files.values():
+            f.close()
+    return meta, mixed
+
+
+def _spool_chunks(chunks: Any, f: Any) -> Any:
+    """Pass body chunks through while copying them to ``f``."""
+    for chunk in chunks:
+        f.write(chunk)
+        yield chunk
+
+
+def _stream_query_output(
+    client: GrafanaClient,
+    queries: list[dict],
+    time_from: str,
+    time_to: str,
+    *,
+    output: str | None,
+    output_dir: str | None,
+    fmt: str | None,
+) -> None:
+    """Run a query with a streamed response and export it without buffering.
+
+    The files match the non-streamed export. JSONL is written while the body
+    downloads; the body is also spooled to a temporary file, from which a
+    refId whose series have different columns is rewritten with the union
+    columns. Other formats need the union schema first, so the spooled body
+    is read twice, one frame at a time. Output files are only created for
+    refIds with rows, and a failed query leaves no files behind.
+    """
+    import tempfile
+
+    if fmt and fmt not in _EXPORT_EXTENSIONS:
+        print(
+            f"Unknown format: {fmt}. Use {', '.join(_EXPORT_EXTENSIONS)}.",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+    ref_ids = [q.get("refId", "A") for q in queries]
+    effective_fmt = fmt or (output and _format_from_path(output)) or "parquet"
+    ext = _EXPORT_EXTENSIONS[effective_fmt]
+    paths: dict[str, str] = {}
+    created: set[str] = set()  # placeholder files made by _auto_output_path
+
+    def path_for(ref_id: str) -> str:
+        if ref_id not in paths:
+            if output and len(ref_ids) == 1:
+                paths[ref_id] = output
+            elif output:
+                paths[ref_id] = f"{os.path.splitext(output)[0]}_{ref_id}.{ext}"
+            else:
+                paths[ref_id] = _auto_output_path(
+                    output_dir, f"grafana_query_{ref_id}", ext
+                )
+                created.add(paths[ref_id])
+        return paths[ref_id]
+
+    chunks = client.query_datasource_stream(queries, time_from, time_to)
+    fd, spool = tempfile.mkstemp(prefix="grafana_ds_", suffix=".json")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            if effective_fmt == "jsonl":
+                # Download, parsing and export overlap; the HTTP timing shows the wait.
+                with _PHASES.measure("stream parse+export") as span:
+                    meta, rewrite = _stream_frames_jsonl(
+                        _spool_chunks(chunks, f), path_for
+                    )
+                    span.bytes = sum(os.path.getsize(p) for p in paths.values())
+            else:
+                with _PHASES.measure("stream spool") as span:
+                    for chunk in chunks:
+                        f.write(chunk)
+                        span.bytes += len(chunk)
+                meta, rewrite = {}, set(ref_ids)
+        for ref_id in [r for r in ref_ids if r in rewrite]:
+            if _has_query_errors({"results": meta}):
+                break
+            frames = StreamedFrames(spool, ref_id)
+            path = path_for(ref_id)
+            with _PHASES.measure("stream parse+export", ref_id) as span:
+                if effective_fmt in _ARROW_FORMATS:
+                    done = _export_arrow_frames(frames, effective_fmt, path)
+                else:
+                    done = _export_streamed_text(frames, effective_fmt, path)
+                span.bytes = os.path.getsize(done) if done else 0
+            meta.setdefault(ref_id, {}).update(frames.meta)
+            if not done:
+                # Nothing written: drop the placeholder, keep any file we did not make.
+                del paths[ref_id]
+                if path in created:
+                    os.unlink(path)
+    except BaseException:
+        _remove_files(paths.values())
+        raise
+    finally:
+        os.unlink(spool)
+
+    if _has_query_errors({"results": meta}):
+        _remove_files(paths.values())
+        _check_query_errors({"results": meta})
+    for ref_id in ref_ids:
+        if ref_id in paths:
+            print(f"Exported refId={ref_id}: {paths[ref_id]}", file=sys.stderr)
+        else:
+            print(f"No data for refId={ref_id}", file=sys.stderr)
+
+
+def _remove_files(paths: Any) -> None:
+    """Delete the files that exist among ``paths``."""
+    for path in paths:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+# ---------------------------------------------------------------------------
+# Time Ranges & Chunked Queries
+# ---------------------------------------------------------------------------
+
+_DURATION_UNITS_MS = {
+    "ms": 1,
+    "s": 1000,
+    "m": 60_000,
+    "h": 3_600_000,
+    "d": 86_400_000,
+    "w": 604_800_000,
+}
+
+
+def _parse_duration(text: str) -> int:
+    """Parse a Grafana-style duration (``500ms``, ``30s``, ``5m``, ``1h``, ``1d``, ``1w``) to ms."""
+    import re
+
+    m = re.fullmatch(r"\s*(\d+)\s*(ms|s|m|h|d|w)\s*", text)
+    if not m:
+        raise ValueError(f"invalid duration {text!r} (expected e.g. 30s, 5m, 1h, 1d)")
+    return int(m.group(1)) * _DURATION_UNITS_MS[m.group(2)]
+
+
+def _resolve_time(expr: str, now_ms: int) -> int:
+    """Resolve a Grafana time expression to epoch milliseconds.
+
+    Accepts ``now``, ``now-6h``, ``now+5m``, an optional rounding suffix
+    (``now-1d/d``), epoch milliseconds, and ISO 8601 timestamps.
+    """
+    import re
+    from datetime import datetime, timezone
+
+    text = expr.strip()
+    if text.isdigit():
+        return int(text)
+    m = re.fullmatch(r"now(?:([+-])(\d+)(ms|s|m|h|d|w))?(?:/(s|m|h|d|w))?", text)
+    if m:
+        ts = now_ms
+        if m.group(1):
+            delta = int(m.group(2)) * _DURATION_UNITS_MS[m.group(3)]
+            ts = ts + delta if m.group(1) == "+" else ts - delta
+        if m.group(4):
+            unit = _DURATION_UNITS_MS[m.group(4)]
+            # Weeks round to Monday 00:00 UTC (the epoch was a Thursday).
+            offset = 3 * _DURATION_UNITS_MS["d"] if m.group(4) == "w" else 0
+            ts = (ts + offset) // unit * unit - offset
+        return ts
+    try:
+        dt = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"unsupported time expression {expr!r}") from None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+
+def _split_range(from_ms: int, to_ms: int, chunk_ms: int) -> list[tuple[int, int]]:
+    """Split [from, to] into windows whose inner edges are multiples of chunk_ms.
+
+    Aligned edges make the same absolute window produce the same sub-windows
+    on every run, whatever the requested start.
+    """
+    windows: list[tuple[int, int]] = []
+    start = from_ms
+    while start < to_ms:
+        end = min((start // chunk_ms + 1) * chunk_ms, to_ms)
+        windows.append((start, end))
+        start = end
+    return windows or [(from_ms, to_ms)]
+
+
+def _frame_key(frame: dict) -> str:
+    """Identity of a series across chunk responses: frame name + field schema."""
+    schema = frame.get("schema", {})
+    fields = [
+        (f.get("name"), f.get("type"), sorted((f.get("labels") or {}).items()))
+        for f in schema.get("fields", [])
+    ]
+    return json.dumps([schema.get("name"), fields], sort_keys=True, default=str)
+
+
+def _stitch_results(results: list[dict]) -> dict:
+    """Concatenate chunk responses (in time order) into one ``/api/ds/query`` result.
+
+    Frames are matched by name and field schema. For frames with a time field,
+    a row at or before the last timestamp already stitched is dropped when an
+    identical row was stitched at that time, which removes the points
+    duplicated on shared chunk boundaries but keeps distinct rows (log lines)
+    that share a timestamp.
+    """
+    from collections import Counter
+
+    def row(columns: list, r: int) -> str:
+        return json.dumps([c[r] for c in columns], sort_keys=True, default=str)
+
+    stitched: dict[str, dict] = {}
+    for result in results:
+        for ref_id, ref_result in result.get("results", {}).items():
+            target = stitched.setdefault(ref_id, {"frames": {}, "extra": {}})
+            for k, v in ref_result.items():
+                if k != "frames":
+                    target["extra"].setdefault(k, v)
+            for frame in ref_result.get("frames", []):
+                fields = frame.get("schema", {}).get("fields", [])
+                values = frame.get("data", {}).get("values", [])
+                key = _frame_key(frame)
+                existing = target["frames"].get(key)
+                if existing is None:
+                    target["frames"][key] = {
+                        "schema": frame.get("schema", {}),
+                        "data": {"values": [list(v) for v in values]},
+                    }
+                    continue
+                if not values:
+                    continue
+                acc = existing["data"]["values"]
+                if not acc:
+                    existing["data"]["values"] = [list(v) for v in values]
+                    continue
+                start = 0
+                keep: list[int] = []
+                time_idx = next(
+                    (i for i, f in enumerate(fields) if f.get("type") == "time"), None
+                )
+                if time_idx is not None and acc[time_idx]:
+                    last = acc[time_idx][-1]
+                    times = values[time_idx]
+                    while (
+                        start < len(times)
+                        and times[start] is not None
+                        and times[start] <= last
+                    ):
+                        start += 1
+                    if start:
+                        acc_times = acc[time_idx]
+                        tail = len(acc_times)
+                        while (
+                            tail
+                            and acc_times[tail - 1] is not None
+                            and acc_times[tail - 1] >= times[0]
+                        ):
+                            tail -= 1
+                        seen = Counter(row(acc, r) for r in range(tail, len(acc_times)))
+                        for r in range(start):
+                            key = row(values, r)
+                            if seen[key]:
+                                seen[key] -= 1
+                            else:
+                                keep.append(r)
+                for ci, col in enumerate(values):
+                    if ci < len(acc):
+                        acc[ci].extend(col[r] for r in keep)
+                        acc[ci].extend(col[start:])
+    return {
+        "results": {
+            ref_id: {**target["extra"], "frames": list(target["frames"].values())}
+            for ref_id, target in stitched.items()
+        }
+    }
+
+
+def _ref_failed(ref_result: dict) -> bool:
+    """True if one refId result reports an error or a non-200 status."""
+    return "error" in ref_result or ref_result.get("status", 200) != 200
+
+
+def _has_query_errors(result: dict) -> bool:
+    """True if any refId reports an error or a non-200 status."""
+    return any(_ref_failed(r) for r in result.get("results", {}).values())
+
+
+def _run_queries(
+    client: GrafanaClient,
+    queries: list[dict],
+    time_from: str,
+    time_to: str,
+    *,
+    chunk: str | None = None,
+    parallel: int = 4,
+    cache: QueryCache | None = None,
+    check_errors: bool = True,
+) -> dict:
+    """Run ``/api/ds/query``, optionally chunked and served from the result cache.
+
+    With ``chunk``, the range is resolved to absolute epoch ms, split into
+    chunk-aligned windows, queried by a pool of ``parallel`` workers and
+    stitched back in time order. With ``cache``, relative ranges are first
+    snapped to a step-aligned absolute window so repeated runs share keys.
+    Per-refId errors exit like a single query unless ``check_errors`` is off,
+    in which case they are left in the result for the caller.
+    """
+    check = _check_query_errors if check_errors else (lambda _result: None)
+    if not chunk and cache is None:
+        result = client.query_datasource(queries, time_from=time_from, time_to=time_to)
+        check(result)
+        return result
+
+    import time as _time
+    from concurrent.futures import ThreadPoolExecutor
+
+    try:
+        chunk_ms = _parse_duration(chunk) if chunk else 0
+        now_ms = int(_time.time() * 1000)
+        from_ms = _resolve_time(time_from, now_ms)
+        to_ms = _resolve_time(time_to, now_ms)
+    except ValueError as exc:
+        if chunk:
+            print(f"ERROR: {exc}", file=sys.stderr)
+            sys.exit(1)
+        # A range we cannot resolve locally is passed through, uncached.
+        result = client.query_datasource(queries, time_from=time_from, time_to=time_to)
+        check(result)
+        return result
+    if chunk and (chunk_ms <= 0 or from_ms >= to_ms):
+        print(
+            "ERROR: --chunk needs a positive duration and --from < --to",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+    if cache is not None and ("now" in time_from or "now" in time_to):
+        from_ms, to_ms = cache.snap(queries, from_ms, to_ms)
+
+    def run(window: tuple[int, int]) -> dict:
+        if cache is not None:
+            return cache.query(client, queries, window[0], window[1])
+        return client.query_datasource(
+            queries, time_from=str(window[0]), time_to=str(window[1])
+        )
+
+    if not chunk:
+        result = run((from_ms, to_ms))
+        check(result)
+        return result
+
+    windows = _split_range(from_ms, to_ms, chunk_ms)
+    print(
+        f"Querying {len(windows)} chunk(s) of {chunk} with {parallel} worker(s)...",
+        file=sys.stderr,
+    )
+    with ThreadPoolExecutor(max_workers=max(1, parallel)) as pool:
+        results = list(pool.map(run, windows))
+    for result in results:
+        check(result)
+    return _stitch_results(results)
+
+
+# ---------------------------------------------------------------------------
+# Aggregation Pushdown
+# ---------------------------------------------------------------------------
+
+# --aggregate name -> PromQL range function (pNN maps to quantile_over_time).
+_PROM_OVER_TIME = {
+    "avg": "avg_over_time",
+    "min": "min_over_time",
+    "max": "max_over_time",
+    "sum": "sum_over_time",
+    "count": "count_over_time",
+    "last": "last_over_time",
+    "stddev": "stddev_over_time",
+}
+
+# SQL datasource type -> dialect; all three support $__timeGroupAlias.
+_SQL_DIALECTS = {
+    "postgres": "postgres",
+    "grafana-postgresql-datasource": "postgres",
+    "mysql": "mysql",
+    "mssql": "mssql",
+}
+
+# Aggregate function templates per dialect ({q} is the quantile for pNN).
+_SQL_AGGREGATES: dict[str, dict[str, str]] = {
+    "postgres": {
+        "avg": "AVG(value)",
+        "min": "MIN(value)",
+        "max": "MAX(value)",
+        "sum": "SUM(value)",
+        "count": "COUNT(value)",
+        "stddev": "STDDEV_POP(value)",
+        "quantile": "PERCENTILE_CONT({q:g}) WITHIN GROUP (ORDER BY value)",
+    },
+    "mysql": {
+        "avg": "AVG(value)",
+        "min": "MIN(value)",
+        "max": "MAX(value)",
+        "sum": "SUM(value)",
+        "count": "COUNT(value)",
+        "stddev": "STDDEV_POP(value)",
+    },
+    "mssql": {
+        "avg": "AVG(value)",
+        "min": "MIN(value)",
+        "max": "MAX(value)",
+        "sum": "SUM(value)",
+        "count": "COUNT(value)",
+        "stddev": "STDEVP(value)",
+    },
+}
+
+_AGGREGATES = ("avg", "min", "max", "sum", "count", "last", "stddev")
+
+
+def _parse_aggregate(name: str) -> tuple[str, float | None]:
+    """``avg`` -> ("avg", None); ``p95`` -> ("quantile", 0.95)."""
+    import re
+
+    if name in _AGGREGATES:
+        return name, None
+    m = re.fullmatch(r"p(\d{1,2}(?:\.\d+)?)", name)
+    if m and 0 < float(m.group(1)) < 100:
+        return "quantile", float(m.group(1)) / 100
+    raise ValueError(
+        f"unknown aggregate {name!r} (expected {', '.join(_AGGREGATES)} or pNN)"
+    )
+
+
+def _pushdown_promql(expr: str, agg: str, q: float | None, step: str) -> str:
+    """Wrap a PromQL expression in the matching ``*_over_time`` function."""
+    import re
+
+    selector = re.fullmatch(r"\s*[a-zA-Z_:][\w:]*\s*(\{[^}]*\})?\s*", expr)
+    rng = f"{expr.strip()}[{step}]" if selector else f"({expr})[{step}:]"
+    if agg == "quantile":
+        return f"quantile_over_time({q:g}, {rng})"
+    return f"{_PROM_OVER_TIME[agg]}({rng})"
+
+
+def _sql_mask(sql: str) -> str:
+    """``sql`` with string literals and parenthesised parts blanked out.
+
+    Positions are kept, so top-level keywords and commas found in the mask
+    index the original text.
+    """
+    out = []
+    depth = 0
+    quote = False
+    for ch in sql:
+        if quote:
+            quote = ch != "'"
+            out.append(" ")
+        elif ch == "'":
+            quote = True
+            out.append(" ")
+        elif ch == "(":
+            depth += 1
+            out.append(" ")
+        elif ch == ")":
+            depth = max(depth - 1, 0)
+            out.append(" ")
+        else:
+            out.append(ch if depth == 0 else " ")
+    return "".join(out)
+
+
+def _sql_select_columns(sql: str) -> list[str] | None:
+    """Output column names of a query's top-level SELECT, or None if unknown.
+
+    Names come from ``AS`` aliases, bare or qualified column references and
+    Grafana's ``$__time``, ``$__timeEpoch`` and ``$__timeGroupAlias`` macros,
+    which alias their column to ``time``. Unnamed expressions yield ``""``;
+    ``SELECT *`` makes the list unknowable.
+    """
+    import re
+
+    mask = _sql_mask(sql)
+    select = re.search(r"\bSELECT\b", mask, re.IGNORECASE)
+    if select is None:
+        return None
+    start = select.end()
+    prefix = re.match(
+        r"\s*(?:(?:DISTINCT|ALL)\s+)?(?:TOP\s+\d*\s*(?:PERCENT\s+)?)?",
+        mask[start:],
+        re.IGNORECASE,
+    )
+    start += prefix.end()
+    end = re.search(r"\bFROM\b", mask[start:], re.IGNORECASE)
+    stop = start + end.start() if end else len(sql)
+
+    names = []
+    for m in re.finditer(r"[^,]+", mask[start:stop]):
+        item = sql[start + m.start() : start + m.end()].strip()
+        masked = m.group().strip()
+        if masked.endswith("*"):
+            return None
+        if re.search(r"\bAS\b", masked, re.IGNORECASE) is None and re.match(
+            r"\$__(?:time|timeEpoch|timeGroupAlias)\s*\(", item
+        ):
+            names.append("time")
+            continue
+        name = re.search(r"""["`\[]?(\w+)["`\]]?\s*$""", item)
+        names.append(name.group(1).lower() if name else "")
+    return names
+
+
+def _sql_strip_order_by(sql: str) -> str:
+    """Drop a trailing top-level ORDER BY, which T-SQL rejects in subqueries.
+
+    It is kept when it decides which rows a LIMIT, OFFSET, FETCH or TOP
+    returns.
+    """
+    import re
+
+    mask = _sql_mask(sql)
+    order = None
+    for order in re.finditer(r"\bORDER\s+BY\b", mask, re.IGNORECASE):
+        pass
+    if order is None or re.search(
+        r"\b(?:LIMIT|OFFSET|FETCH)\b", mask[order.end() :], re.IGNORECASE
+    ):
+        return sql
+    if re.search(r"\bSELECT\s+(?:(?:DISTINCT|ALL)\s+)?TOP\b", mask, re.IGNORECASE):
+        return sql
+    return sql[: order.start()].rstrip()
+
+
+def _pushdown_sql(
+    sql: str, agg: str, q: float | None, step: str, dialect: str
+) -> str | None:
+    """Group a time-series SQL query by ``$__timeGroupAlias``, or None.
+
+    The query must follow Grafana's time-series convention: its select list
+    is exactly a ``time`` and a ``value`` column, plus an optional ``metric``
+    column that stays a group. Any other column (a host or region label, say)
+    would be dropped by the grouping, so such queries aggregate locally.
+    Groups repeat the ``$__timeGroup`` expression instead of using ordinals,
+    which T-SQL does not accept.
+    """
+    import re
+
+    template = _SQL_AGGREGATES[dialect].get(agg)
+    columns = _sql_select_columns(sql)
+    if template is None or columns is None:
+        return None
+    if sorted(columns) not in (["time", "value"], ["metric", "time", "value"]):
+        return None
+    if dialect == "mssql" and re.match(r"\s*WITH\b", sql, re.IGNORECASE):
+        return None  # T-SQL has no CTEs inside derived tables
+    metric = "metric" in columns
+    inner = _sql_strip_order_by(sql.strip().rstrip(";"))
+    cols = ", metric" if metric else ""
+    group = f"$__timeGroup(time, '{step}')" + (", metric" if metric else "")
+    return (
+        f"SELECT $__timeGroupAlias(time, '{step}'){cols}, "
+        f"{template.format(q=q)} AS value "
+        f"FROM ({inner}) AS _agg GROUP BY {group} ORDER BY 1"
+    )
+
+
+def _pushdown_query(
+    query: dict, ds_type: str, agg: str, q: float | None, step: str
+) -> str | None:
+    """Rewrite ``query`` in place to aggregate per step on the datasource.
+
+    Returns a short description of the rewrite, or None when the datasource
+    or the query shape has no pushdown (the caller aggregates locally).
+    """
+    if query.get("expr") and ds_type == "prometheus" and not query.get("instant"):
+        query["expr"] = _pushdown_promql(query["expr"], agg, q, step)
+        return query["expr"]
+    dialect = _SQL_DIALECTS.get(ds_type)
+    if query.get("rawSql") and dialect:
+        sql = _pushdown_sql(query["rawSql"], agg, q, step, dialect)
+        if sql is None:
+            return None
+        query["rawSql"] = sql
+        query["format"] = "time_series"
+        return sql
+    return None
+
+
+def _aggregate_values(values: list, agg: str, q: float | None) -> Any:
+    """Aggregate one bucket; None values are ignored."""
+    vals = [v for v in values if v is not None]
+    if agg == "count":
+        return len(vals)
+    if not vals:
+        return None
+    if agg == "last":
+        return vals[-1]
+    if agg == "min":
+        return min(vals)
+    if agg == "max":
+        return max(vals)
+    if agg == "sum":
+        return sum(vals)
+    if agg == "avg":
+        return sum(vals) / len(vals)
+    if agg == "stddev":
+        mean = sum(vals) / len(vals)
+        return (sum((v - mean) ** 2 for v in vals) / len(vals)) ** 0.5
+    # Quantile with linear interpolation, as quantile_over_time does.
+    vals.sort()
+    pos = (len(vals) - 1) * (q or 0.0)
+    lo = int(pos)
+    hi = min(lo + 1, len(vals) - 1)
+    return vals[lo] + (vals[hi] - vals[lo]) * (pos - lo)
+
+
+def _aggregate_frame(frame: dict, step_ms: int, agg: str, q: float | None) -> dict:
+    """Bucket a frame by ``step_ms`` on its time field and aggregate every
+    number field per bucket; other fields keep the bucket's first value.
+
+    Bucket edges are computed once for the time column and every column is
+    then aggregated slice by slice. Frames without a time field are returned
+    unchanged.
+    """
+    fields = frame.get("schema", {}).get("fields", [])
+    values = frame.get("data", {}).get("values", [])
+    time_idx = next((i for i, f in enumerate(fields) if f.get("type") == "time"), None)
+    if time_idx is None or not values or not values[time_idx]:
+        return frame
+
+    times = values[time_idx]
+    order = sorted(
+        range(len(times)), key=lambda i: times[i] if times[i] is not None else 0
+    )
+    if order != list(range(len(order))):
+        values = [
+            [col[i] for i in order] if len(col) == len(times) else col for col in values
+        ]
+        times = values[time_idx]
+
+    keys = [t // step_ms * step_ms if t is not None else None for t in times]
+    edges = (
+        [0] + [i for i in range(1, len(keys)) if keys[i] != keys[i - 1]] + [len(keys)]
+    )
+    spans = list(zip(edges, edges[1:]))
+
+    out: list[list] = []
+    for fi, col in enumerate(values):
+        ftype = fields[fi].get("type") if fi < len(fields) else None
+        if fi == time_idx:
+            out.append([keys[a] for a, _ in spans])
+        elif ftype == "number":
+            out.append([_aggregate_values(col[a:b], agg, q) for a, b in spans])
+        else:
+            out.append([col[a] if a < len(col) else None for a, _ in spans])
+    return {**frame, "data": {**frame.get("data", {}), "values": out}}
+
+
+def _aggregate_result(
+    result: dict, step_ms: int, agg: str, q: float | None
+) -> tuple[int, int]:
+    """Aggregate every frame of a query result in place. Returns (rows before, after)."""
+    before = after = 0
+    with _PHASES.measure("local aggregate"):
+        for ref_result in result.get("results", {}).values():
+            frames = ref_result.get("frames", [])
+            before += _frames_row_count(frames)
+            ref_result["frames"] = [
+                _aggregate_frame(f, step_ms, agg, q) for f in frames
+            ]
+            after += _frames_row_count(ref_result["frames"])
+    return before, after
+
+
+# ---------------------------------------------------------------------------
+# Frame Transforms
+# ---------------------------------------------------------------------------
+
+# A transform maps a query result (``/api/ds/query`` shape) to a new one.
+# Specs are ``name[:arg[:arg]]`` and run in the order given with --transform.
+
+
+def _time_index(fields: list[dict]) -> int | None:
+    return next((i for i, f in enumerate(fields) if f.get("type") == "time"), None)
+
+
+def _series_frames(result: dict, ref_ids: list[str] | None = None):
+    """Yield (refId, frame) for every frame with a time field and values."""
+    for ref_id, ref_result in result.get("results", {}).items():
+        if ref_ids and ref_id not in ref_ids:
+            continue
+        for frame in ref_result.get("frames", []):
+            fields = frame.get("schema", {}).get("fields", [])
+            if _time_index(fields) is not None and frame.get("data", {}).get("values"):
+                yield ref_id, frame
+
+
+def _map_frames(result: dict, fn: Any) -> dict:
+    """New result with ``fn(frame)`` applied to every frame; None drops it."""
+    out = {"results": {}}
+    for ref_id, ref_result in result.get("results", {}).items():
+        frames = [fn(f) for f in ref_result.get("frames", [])]
+        out["results"][ref_id] = {
+            **ref_result,
+            "frames": [f for f in frames if f is not None],
+        }
+    return out
+
+
+def _series_name(ref_id: str, field: dict) -> str:
+    """Column name of a series after a join: ``A value{job="api"}``."""
+    labels = field.get("labels") or {}
+    label_text = ",".join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+    name = field.get("config", {}).get("displayNameFromDS") or field.get("name", "")
+    return f"{ref_id} {name}{{{label_text}}}" if labels else f"{ref_id} {name}"
+
+
+def _transform_resample(step: str, agg: str = "avg") -> Any:
+    step_ms = _parse_duration(step)
+    fn, q = _parse_aggregate(agg)
+    return lambda result: _map_frames(
+        result, lambda f: _aggregate_frame(f, step_ms, fn, q)
+    )
+
+
+def _rate_frame(frame: dict) -> dict:
+    """Per-second rate of every number field; counter resets count from zero."""
+    fields = frame.get("schema", {}).get("fields", [])
+    values = frame.get("data", {}).get("values", [])
+    ti = _time_index(fields)
+    if ti is None or not values or len(values[ti]) < 2:
+        return frame
+    times = values[ti]
+    dt = [
+        (b - a) / 1000 if a is not None and b is not None and b > a else None
+        for a, b in zip(times, times[1:])
+    ]
+    out: list[list] = []
+    for fi, col in enumerate(values):
+        if fi == ti:
+            out.append(times[1:])
+        elif fields[fi].get("type") == "number":
+            out.append(
+                [
+                    (
+                        None
+                        if d is None or a is None or b is None
+                        else ((b - a) if b >= a else b) / d
+                    )
+                    for a, b, d in zip(col, col[1:], dt)
+                ]
+            )
+        else:
+            out.append(col[1:])
+    return {**frame, "data": {**frame.get("data", {}), "values": out}}
+
+
+def _transform_rate() -> Any:
+    return lambda result: _map_frames(result, _rate_frame)
+
+
+def _transform_filter(expr: str) -> Any:
+    """Keep frames whose labels match ``k=v``, ``k!=v``, ``k=~re`` or ``k!~re``."""
+    import re
+
+    m = re.fullmatch(r"\s*([\w.\-]+)\s*(=~|!~|!=|=)\s*(.*)", expr)
+    if not m:
+        raise ValueError(f"invalid filter {expr!r} (expected label=value, !=, =~, !~)")
+    key, op, want = m.groups()
+    pattern = re.compile(want) if "~" in op else None
+
+    def keep(frame: dict) -> dict | None:
+        value = _frame_labels(frame.get("schema", {}).get("fields", [])).get(key, "")
+        if pattern is not None:
+            hit = pattern.fullmatch(value) is not None
+        else:
+            hit = value == want
+        return frame if hit == op.startswith("=") else None
+
+    return lambda result: _map_frames(result, keep)
+
+
+def _transform_topk(k: str, agg: str = "avg") -> Any:
+    """Keep the ``k`` series (frames) with the highest aggregate, per refId."""
+    n = int(k)
+    fn, q = _parse_aggregate(agg)
+
+    def score(frame: dict) -> float:
+        fields = frame.get("schema", {}).get("fields", [])
+        values = frame.get("data", {}).get("values", [])
+        for fi, field in enumerate(fields):
+            if field.get("type") == "number" and fi < len(values):
+                value = _aggregate_values(values[fi], fn, q)
+                return float("-inf") if value is None else value
+        return float("-inf")
+
+    def apply(result: dict) -> dict:
+        out = {"results": {}}
+        for ref_id, ref_result in result.get("results", {}).items():
+            frames = ref_result.get("frames", [])
+            top = set(map(id, sorted(frames, key=score, reverse=True)[:n]))
+            out["results"][ref_id] = {
+                **ref_result,
+                "frames": [f for f in frames if id(f) in top],
+            }
+        return out
+
+    return apply
+
+
+def _transform_join(ref_list: str = "") -> Any:
+    """Outer-join series across refIds on time into one wide frame.
+
+    The joined frame replaces the joined refIds under refId ``joined``; each
+    series becomes a column named after its refId, field and labels.
+    """
+    wanted = [r for r in ref_list.split(",") if r]
+
+    def apply(result: dict) -> dict:
+        columns: list[tuple[dict, dict]] = []  # (field, time -> value)
+        all_times: set = set()
+        joined_refs: set[str] = set()
+        for ref_id, frame in _series_frames(result, wanted or None):
+            joined_refs.add(ref_id)
+            fields = frame["schema"]["fields"]
+            values = frame["data"]["values"]
+            ti = _time_index(fields)
+            times = values[ti]
+            all_times.update(t for t in times if t is not None)
+            for fi, field in enumerate(fields):
+                if fi == ti or fi >= len(values):
+                    continue
+                col_field = {
+                    "name": _series_name(ref_id, field),
+                    "type": field.get("type", "number"),
+                }
+                columns.append((col_field, dict(zip(times, values[fi]))))
+        times_sorted = sorted(all_times)
+        joined = {
+            "schema": {
+                "name": "joined",
+                "fields": [{"name": "Time", "type": "time"}] + [c for c, _ in columns],
+            },
+            "data": {
+                "values": [times_sorted]
+                + [[by_time.get(t) for t in times_sorted] for _, by_time in columns]
+            },
+        }
+        out = {
+            "results": {
+                r: v
+                for r, v in result.get("results", {}).items()
+                if r not in joined_refs
+            }
+        }
+        out["results"]["joined"] = {"frames": [joined] if columns else []}
+        return out
+
+    return apply
+
+
+_TRANSFORMS: dict[str, Any] = {
+    "resample": _transform_resample,
+    "rate": _transform_rate,
+    "filter": _transform_filter,
+    "topk": _transform_topk,
+    "join": _transform_join,
+}
+
+
+def _parse_transforms(specs: list[str]) -> list[Any]:
+    """Compile ``--transform`` specs; exits with a usage error on a bad one."""
+    steps = []
+    for spec in specs:
+        name, _, rest = spec.partition(":")
+        factory = _TRANSFORMS.get(name.strip())
+        if factory is None:
+            print(
+                f"Unknown transform {name!r}. Use one of: {', '.join(_TRANSFORMS)}.",
+                file=sys.stderr,
+            )
+            sys.exit(1)
+        # filter keeps its argument whole (regexes may contain ':').
+        args = [rest] if name == "filter" else [a for a in rest.split(":") if a]
+        try:
+            steps.append(factory(*args))
+        except (TypeError, ValueError) as exc:
+            print(f"ERROR: invalid transform {spec!r}: {exc}", file=sys.stderr)
+            sys.exit(1)
+    return steps
+
+
+def _apply_transforms(result: dict, steps: list[Any]) -> dict:
+    if not steps:
+        return result
+    with _PHASES.measure("transforms"):
+        for step in steps:
+            result = step(result)
+    return result
+
+
+# ---------------------------------------------------------------------------
+# Log Export
+# ---------------------------------------------------------------------------
+
+# Loki's default max_entries_limit_per_query; larger pages are rejected.
+_LOG_PAGE_LIMIT = 5000
+
+
+def _log_entries(frame: dict) -> Any:
+    """Yield ``(ts_ns, labels, line)`` for every log line of a Loki frame.
+
+    Handles both frame shapes Grafana produces: the dataplane frame with a
+    per-row ``labels`` field, and the older frame-per-stream shape with the
+    labels on the ``Line`` field. Nanosecond timestamps come from ``tsNs``
+    when present, else from the time field and its ``nanos`` remainder.
+    """
+    fields = frame.get("schema", {}).get("fields", [])
+    data = frame.get("data", {})
+    values = data.get("values", [])
+    index = {f.get("name"): n for n, f in enumerate(fields)}
+    line_i = index.get("Line", index.get("body"))
+    if line_i is None or line_i >= len(values):
+        return
+    time_i = index.get("Time", index.get("timestamp"))
+    ts_i = index.get("tsNs")
+    labels_i = index.get("labels")
+    nanos = data.get("nanos") or []
+    extra = nanos[time_i] if time_i is not None and time_i < len(nanos) else None
+    stream_labels = fields[line_i].get("labels") or {}
+    for n, line in enumerate(values[line_i]):
+        if ts_i is not None:
+            ts = int(values[ts_i][n])
+        elif time_i is not None:
+            ts = int(values[time_i][n]) * 1_000_000 + (extra[n] if extra else 0)
+        else:
+            continue
+        labels = values[labels_i][n] if labels_i is not None else stream_labels
+        if isinstance(labels, str):
+            labels = json.loads(labels)
+        yield ts, labels or {}, line
+
+
+def _selector_span(expr: str) -> tuple[int, int]:
+    """Start and end (exclusive) of the first stream selector ``{...}``."""
+    start = expr.find("{")
+    if start < 0:
+        raise ValueError(f"No stream selector in LogQL expression: {expr}")
+    i = start + 1
+    while i < len(expr):
+        c = expr[i]
+        if c in '"`':
+            # Skip quoted matcher values; they may contain braces.
+            i += 1
+            while i < len(expr) and expr[i] != c:
+                i += 2 if c == '"' and expr[i] == "\\" else 1
+        elif c == "}":
+            return start, i + 1
+        i += 1
+    raise ValueError(f"Unterminated stream selector in LogQL expression: {expr}")
+
+
+def _shard_expr(expr: str, matcher: str) -> str:
+    """Add a label matcher to the first stream selector of ``expr``."""
+    start, end = _selector_span(expr)
+    inner = expr[start + 1 : end - 1].strip()
+    joined = f"{inner}, {matcher}" if inner else matcher
+    return f"{expr[:start]}{{{joined}}}{expr[end:]}"
+
+
+def _shard_matchers(
+    client: GrafanaClient, ds_uid: str, expr: str, label: str, from_ms: int, to_ms: int
+) -> list[str]:
+    """One ``label="value"`` matcher per value seen in the range, plus ``label=""``.
+
+    Values come from Loki's label values API (through the datasource
+    resource proxy), restricted to the expression's stream selector. The
+    empty matcher picks up streams without the label, so the shards cover
+    the whole selection.
+    """
+    start, end = _selector_span(expr)
+    data = client.get(
+        f"/api/datasources/uid/{ds_uid}/resources/label/{label}/values",
+        params={
+            "start": from_ms * 1_000_000,
+            "end": to_ms * 1_000_000,
+            "query": expr[start:end],
+        },
+    )
+    values = data.get("data", []) if isinstance(data, dict) else data or []
+    return [f"{label}={json.dumps(v)}" for v in values] + [f'{label}=""']
+
+
+class LogCursor:
+    """Forward pagination over one LogQL query, by last-seen timestamp.
+
+    Grafana takes the range in milliseconds, so each page starts at the
+    millisecond of the last line of the previous one. The lines of that
+    millisecond come back again; they are remembered (by timestamp, labels
+    and line) and dropped. Only the boundary lines are kept, so memory is
+    one page plus the lines sharing its last millisecond. When more than a
+    page of lines shares one millisecond, the cursor cannot advance; it then
+    skips that millisecond and counts it in ``skipped_ms``.
+    """
+
+    def __init__(
+        self,
+        client: GrafanaClient,
+        query: dict,
+        from_ms: int,
+        to_ms: int,
+        limit: int = _LOG_PAGE_LIMIT,
+        name: str = "",
+    ) -> None:
+        self.client = client
+        self.query = query
+        self.from_ms = from_ms
+        self.to_ms = to_ms
+        self.limit = limit
+        self.name = name
+        self.pages = self.lines = self.duplicates = self.skipped_ms = 0
+
+    def _fetch(self, from_ms: int) -> list[tuple]:
+        query = dict(self.query, maxLines=self.limit, direction="forward")
+        result = self.client.query_datasource(
+            [query], time_from=str(from_ms), time_to=str(self.to_ms)
+        )
+        ref = result.get("results", {}).get(query["refId"], {})
+        if "error" in ref or ref.get("status", 200) != 200:
+            raise GrafanaAPIError(
+                ref.get("error", "log query failed"), ref.get("status", 400), ref
+            )
+        with _PHASES.measure("log decode", self.name) as span:
+            entries = [
+                e for frame in ref.get("frames", []) for e in _log_entries(frame)
+            ]
+            entries.sort(key=lambda e: e[0])
+            span.rows = len(entries)
+        return entries
+
+    @staticmethod
+    def _key(entry: tuple) -> tuple:
+        ts, labels, line = entry
+        return ts, line, json.dumps(labels, sort_keys=True)
+
+    def __iter__(self) -> Any:
+        """Yield the new lines of each page, in time order."""
+        cursor = self.from_ms
+        seen: set[tuple] = set()
+        seen_max = -1
+        while cursor <= self.to_ms:
+            entries = self._fetch(cursor)
+            self.pages += 1
+            fresh = []
+            for entry in entries:
+                if entry[0] <= seen_max and self._key(entry) in seen:
+                    self.duplicates += 1
+                else:
+                    fresh.append(entry)
+            if fresh:
+                self.lines += len(fresh)
+                yield fresh
+            if len(entries) < self.limit:
+                return
+            next_ms = entries[-1][0] // 1_000_000
+            if next_ms == cursor and not fresh:
+                self.skipped_ms += 1
+                print(
+                    f"WARNING: more than {self.limit} lines at {cursor} ms"
+                    f"{f' ({self.name})' if self.name else ''}; skipping the rest "
+                    "of that millisecond (raise --limit to keep them)",
+                    file=sys.stderr,
+                )
+                cursor, seen, seen_max = cursor + 1, set(), -1
+                continue
+            boundary = next_ms * 1_000_000
+            seen = {k for k in seen if k[0] >= boundary}
+            seen.update(self._key(e) for e in entries if e[0] >= boundary)
+            seen_max = entries[-1][0]
+            cursor = next_ms
+
+
+def _iso_ns(ts: int, cache: dict) -> str:
+    """RFC 3339 UTC timestamp with nanoseconds; the seconds part is memoised."""
+    from datetime import datetime, timezone
+
+    seconds, nanos = divmod(ts, 1_000_000_000)
+    prefix = cache.get(seconds)
+    if prefix is None:
+        if len(cache) > 4096:
+            cache.clear()
+        prefix = cache[seconds] = datetime.fromtimestamp(
+            seconds, tz=timezone.utc
+        ).strftime("%Y-%m-%dT%H:%M:%S")
+    return f"{prefix}.{nanos:09d}Z"
+
+
+class LogSink:
+    """Append log lines to JSONL or Parquet as pages arrive.
+
+    JSONL rows are ``{"time", "labels", "line"}`` with nanosecond RFC 3339
+    times. Parquet gets ``time`` (timestamp[ns, UTC]), ``labels``
+    (map<string, string>) and ``line`` columns, written in row groups of
+    ``_EXPORT_SLICE_ROWS``, so memory stays bounded by one row group.
+    """
+
+    def __init__(self, fmt: str, path: str) -> None:
+        self.fmt = fmt
+        self.path = path
+        self.rows = 0
+        self._pending: list[tuple] = []
+        if fmt == "parquet":
+            self._pa = pa = _require_pyarrow("Parquet")
+            self._schema = pa.schema(
+                [
+                    pa.field("time", pa.timestamp("ns", tz="UTC")),
+                    pa.field("labels", pa.map_(pa.string(), pa.string())),
+                    pa.field("line", pa.string()),
+                ]
+            )
+            self._writer = _open_arrow_writer(pa, fmt, path, self._schema)
+        else:
+            self._file = open(path, "w", encoding="utf-8")
+            self._times: dict = {}
+
+    def write(self, entries: list[tuple]) -> None:
+        with _PHASES.measure("export") as span:
+            self._write(entries)
+            span.rows = len(entries)
+
+    def _write(self, entries: list[tuple]) -> None:
+        self.rows += len(entries)
+        if self.fmt != "parquet":
+            dumps, times = json.dumps, self._times
+            self._file.writelines(
+                f'{{"time": "{_iso_ns(ts, times)}", "labels": {dumps(labels)}, '
+                f'"line": {dumps(line)}}}\n'
+                for ts, labels, line in entries
+            )
+            return
+        self._pending.extend(entries)
+        if len(self._pending) >= _EXPORT_SLICE_ROWS:
+            self._flush()
+
+    def _flush(self) -> None:
+        pa, pending = self._pa, self._pending
+        arrays = [
+            pa.array([e[0] for e in pending], type=pa.int64()).cast(
+                self._schema.field("time").type
+            ),
+            pa.array([list(e[1].items()) for e in pending], type=self._schema[1].type),
+            pa.array([e[2] for e in pending], type=pa.string()),
+        ]
+        self._writer.write_table(pa.Table.from_arrays(arrays, schema=self._schema))
+        self._pending = []
+
+    def close(self) -> None:
+        if self.fmt == "parquet":
+            if self._pending:
+                self._flush()
+            self._writer.close()
+        else:
+            self._file.close()
+
+
+def _export_logs(cursors: list[LogCursor], sink: LogSink, parallel: int) -> None:
+    """Run the cursors on a thread pool and write their pages from this thread.
+
+    Pages pass through a bounded queue, so a slow disk holds the cursors
+    back instead of buffering lines. A failing cursor stops the others.
+    """
+    import queue
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    pages: queue.Queue = queue.Queue(maxsize=2 * max(1, parallel))
+    stop = threading.Event()
+
+    def put(item: Any) -> bool:
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.2)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run(cursor: LogCursor) -> None:
+        try:
+            for page in cursor:
+                if not put(page):
+                    return
+        except BaseException as exc:
+            put(exc)
+            return
+        put(None)
+
+    with ThreadPoolExecutor(max_workers=max(1, parallel)) as pool:
+        for cursor in cursors:
+            pool.submit(run, cursor)
+        try:
+            running = len(cursors)
+            while running:
+                item = pages.get()
+                if item is None:
+                    running -= 1
+                elif isinstance(item, BaseException):
+                    raise item
+                else:
+                    sink.write(item)
+        finally:
+            stop.set()
+            sink.close()
+
+
+# ---------------------------------------------------------------------------
+# Query Result Cache
+# ---------------------------------------------------------------------------
+
+
+def _cache_dir() -> Path:
+    """Throwaway cache root: $GRAFANA_CACHE_DIR or $XDG_CACHE_HOME/grafana-skill."""
+    d = os.environ.get("GRAFANA_CACHE_DIR")
+    if d:
+        return Path(d)
+    return (
+        Path(os.environ.get("XDG_CACHE_HOME") or (Path.home() / ".cache"))
+        / "grafana-skill"
+    )
+
+
+class QueryCache:
+    """Content-addressed on-disk cache for ``/api/ds/query`` responses.
+
+    The key hashes the Grafana instance and token, the datasource uids, the
+    normalised query JSON and the absolute time range. Values are gzip-compressed
+    response JSON. Entries expire after a TTL; the file mtime records when an
+    entry was stored and the atime when it was last read, which drives
+    least-recently-used eviction once the directory exceeds its size bound.
+    """
+
+    def __init__(self, client: GrafanaClient, *, refresh: bool = False):
+        import threading
+
+        self.dir = _cache_dir() / "queries"
+        self.instance = _instance_key(client.base_url, client.org_id, client.token)
+        self.ttl = int(os.environ.get("GRAFANA_QUERY_CACHE_TTL", "600"))
+        self.max_bytes = (
+            int(os.environ.get("GRAFANA_QUERY_CACHE_MAX_MB", "512")) * 1024 * 1024
+        )
+        snap = os.environ.get("GRAFANA_QUERY_CACHE_SNAP", "1m")
+        try:
+            self.snap_ms = _parse_duration(snap)
+        except ValueError as exc:
+            print(f"ERROR: GRAFANA_QUERY_CACHE_SNAP: {exc}", file=sys.stderr)
+            sys.exit(1)
+        if self.snap_ms <= 0:
+            print("ERROR: GRAFANA_QUERY_CACHE_SNAP must be positive", file=sys.stderr)
+            sys.exit(1)
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def snap(self, queries: list[dict], from_ms: int, to_ms: int) -> tuple[int, int]:
+        """Align a resolved relative range so repeated runs share a cache key.
+
+        ``from`` is floored to the query step (at least the snap size), which
+        only widens the window. ``to`` is rounded *up* to the snap size alone:
+        no sample up to ``now`` is cut off, and since the key moves on with
+        every snap interval, a cached window ending at ``now`` is at most one
+        snap interval old, whatever the TTL.
+        """
+        step = max([self.snap_ms] + [int(q.get("intervalMs") or 0) for q in queries])
+        snap = self.snap_ms
+        return from_ms // step * step, -(-to_ms // snap) * snap
+
+    def key(self, queries: list[dict], from_ms: int, to_ms: int) -> str:
+        import hashlib
+
+        ds_uids = sorted(
+            {
+                str((q.get("datasource") or {}).get("uid", ""))
+                for q in queries
+                if isinstance(q.get("datasource"), dict)
+            }
+        )
+        material = json.dumps(
+            {
+                "instance": self.instance,
+                "datasources": ds_uids,
+                "queries": queries,
+                "from": from_ms,
+                "to": to_ms,
+            },
+            sort_keys=True,
+            separators=(",", ":"),
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.dir / key[:2] / f"{key}.json.gz"
+
+    def get(self, key: str) -> dict | None:
+        import gzip
+        import time as _time
+
+        path = self._path(key)
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            return None
+        now = _time.time()
+        if now - st.st_mtime > self.ttl:
+            path.unlink(missing_ok=True)
+            return None
+        try:
+            data = json.loads(gzip.decompress(path.read_bytes()))
+        except (OSError, ValueError):
+            path.unlink(missing_ok=True)
+            return None
+        # Record the read in atime (kept explicitly; mounts may use noatime).
+        os.utime(path, (now, st.st_mtime))
+        return data
+
+    def put(self, key: str, result: dict) -> None:
+        import gzip
+        import tempfile
+
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        blob = gzip.compress(
+            json.dumps(result, separators=(",", ":")).encode("utf-8"), compresslevel=5
+        )
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(blob)
+        os.replace(tmp, path)
+
+    def query(
+        self, client: GrafanaClient, queries: list[dict], from_ms: int, to_ms: int
+    ) -> dict:
+        """Serve one absolute window from the cache, or query and store it."""
+        key = self.key(queries, from_ms, to_ms)
+        if not self.refresh:
+            cached = self.get(key)
+            if cached is not None:
+                with self._lock:
+                    self.hits += 1
+                return cached
+        result = client.query_datasource(
+            queries, time_from=str(from_ms), time_to=str(to_ms)
+        )
+        with self._lock:
+            self.misses += 1
+        if not _has_query_errors(result):
+            self.put(key, result)
+        return result
+
+    def close(self) -> None:
+        """Report hits and enforce the TTL and size bound after a command."""
+        if self.hits:
+            print(
+                f"Cache: {self.hits} hit(s), {self.misses} miss(es) ({self.dir})",
+                file=sys.stderr,
+            )
+        self.evict()
+
+    def evict(self) -> None:
+        """Drop expired entries, then least-recently-read ones above the size bound."""
+        import time as _time
+
+        if not self.dir.exists():
+            return
+        now = _time.time()
+        entries = []
+        total = 0
+        for path in self.dir.glob("*/*.json.gz"):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            if now - st.st_mtime > self.ttl:
+                path.unlink(missing_ok=True)
+                continue
+            entries.append((st.st_atime, st.st_size, path))
+            total += st.st_size
+        if total <= self.max_bytes:
+            return
+        for _atime, size, path in sorted(entries):
+            path.unlink(missing_ok=True)
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+
+def _query_cache(
+    client: GrafanaClient, *, no_cache: bool, refresh: bool
+) -> QueryCache | None:
+    """Build the result cache unless disabled by --no-cache or GRAFANA_QUERY_CACHE=0."""
+    if no_cache or os.environ.get("GRAFANA_QUERY_CACHE", "1") == "0":
+        return None
+    return QueryCache(client, refresh=refresh)
+
+
+# ---------------------------------------------------------------------------
+# Dashboard Queries
+# ---------------------------------------------------------------------------
+
+# Pseudo datasources that never reach /api/ds/query on their own.
+_SKIP_DATASOURCE_UIDS = {"-- Dashboard --", "-- Mixed --"}
+
+# Queries per /api/ds/query request when batching a dashboard's panels.
+_DASHBOARD_BATCH_SIZE = 20
+
+
+def _flatten_panels(dashboard: dict) -> list[dict]:
+    """Top-level panels of a legacy dashboard with collapsed rows expanded."""
+    all_panels: list[dict] = []
+    for panel in dashboard.get("panels", []):
+        if panel.get("type") == "row":
+            all_panels.extend(panel.get("panels", []))
+        else:
+            all_panels.append(panel)
+    return all_panels
+
+
+def _dashboard_variables(dashboard: dict) -> Variables:
+    """Current values of the dashboard's template variables (lists if multi)."""
+    variables: Variables = {}
+    for var in dashboard.get("templating", {}).get("list", []):
+        current = (var.get("current") or {}).get("value")
+        if isinstance(current, list):
+            if not current or "$__all" in current:
+                continue
+            if not all(isinstance(v, str) for v in current):
+                continue
+            current = current[0] if len(current) == 1 else current
+        # "" is a real value (e.g. an empty textbox) and must still be substituted
+        if var.get("name") and isinstance(current, (str, list)) and current != "$__all":
+            variables[var["name"]] = current
+    return variables
+
+
+# Datasource types whose query variables are plain SQL (first column = values).
+_SQL_VARIABLE_TYPES = ("mysql", "postgres", "mssql", "grafana-postgresql-datasource")
+
+
+def _custom_options(query: str) -> list[str]:
+    """Values of a custom variable: comma-separated, ``text : value`` pairs allowed."""
+    import re
+
+    values = []
+    for item in re.split(r"(?<!\\),", query):
+        item = item.strip().replace("\\,", ",")
+        if " : " in item:
+            item = item.split(" : ", 1)[1].strip()
+        if item:
+            values.append(item)
+    return values
+
+
+def _query_variable_options(
+    client: GrafanaClient, var: dict, variables: Variables
+) -> list[str] | None:
+    """Live values of a query variable, or None if its query is not understood.
+
+    ``label_values()`` is resolved through the Prometheus or Loki label
+    values API behind the datasource resource proxy, SQL variables through
+    ``/api/ds/query``. Other variables in the query are substituted first,
+    so chained variables follow their parents' values. Failed requests also
+    return None, so the caller falls back to the saved options.
+    """
+    try:
+        return _live_variable_options(client, var, variables)
+    except GrafanaAPIError as exc:
+        print(
+            f"WARNING: cannot list values of ${var.get('name')} ({exc}); "
+            "using the options saved with the dashboard",
+            file=sys.stderr,
+        )
+        return None
+
+
+def _live_variable_options(
+    client: GrafanaClient, var: dict, variables: Variables
+) -> list[str] | None:
+    import re
+
+    ds = _resolve_variables(var.get("datasource"), variables)
+    uid = ds.get("uid") if isinstance(ds, dict) else ds
+    ds_type = ds.get("type") if isinstance(ds, dict) else None
+    if not uid:
+        return None
+    ds_type = ds_type or client.datasource_map().get(uid, {}).get("type")
+    query = var.get("query")
+    if isinstance(query, dict):
+        query = query.get("query") or query.get("rawSql") or ""
+    query = _resolve_variables(
+        query or "", variables, _MULTI_VALUE_FORMATS.get(ds_type)
+    )
+
+    if ds_type in _SQL_VARIABLE_TYPES:
+        result = client.query_datasource(
+            [
+                {
+                    "refId": "A",
+                    "datasource": {"uid": uid, "type": ds_type},
+                    "rawSql": query,
+                    "format": "table",
+                }
+            ]
+        )
+        if _has_query_errors(result):
+            return None
+        return [
+            str(v)
+            for frame in _ref_frames(result, "A")
+            for v in (frame.get("data", {}).get("values") or [[]])[0]
+            if v is not None
+        ]
+
+    m = re.fullmatch(r"\s*label_values\(\s*(?:(.*?)\s*,\s*)?(\w+)\s*\)\s*", query)
+    if not m:
+        return None
+    selector, label = m.group(1), m.group(2)
+    if ds_type == "loki":
+        params = {"query": selector} if selector else None
+        endpoint = f"/api/datasources/uid/{uid}/resources/label/{label}/values"
+    elif ds_type == "prometheus":
+        params = {"match[]": selector} if selector else None
+        endpoint = f"/api/datasources/uid/{uid}/resources/api/v1/label/{label}/values"
+    else:
+        return None
+    data = client.get(endpoint, params=params)
+    return [str(v) for v in (data.get("data", []) if isinstance(data, dict) else data)]
+
+
+# JavaScript RegExp flags with a Python equivalent; g, u and y change nothing
+# for a single search over a str.
+_JS_REGEX_FLAGS = {"i": "IGNORECASE", "m": "MULTILINE", "s": "DOTALL"}
+
+
+def _js_regex(pattern: str) -> Any:
+    """Compile a Grafana variable regex, written as a JavaScript RegExp.
+
+    ``/body/flags`` delimiters are stripped and the flags mapped; a bare
+    pattern is used as-is. Named groups ``(?<name>...)`` become Python's
+    ``(?P<name>...)``. Raises ``re.error`` for anything Python rejects.
+    """
+    import re
+
+    flags = 0
+    if pattern.startswith("/") and pattern.rfind("/") > 0:
+        pattern, opts = pattern[1:].rsplit("/", 1)
+        for opt in opts:
+            if opt in _JS_REGEX_FLAGS:
+                flags |= getattr(re, _JS_REGEX_FLAGS[opt])
+            elif opt not in "guy":
+                raise re.error(f"unknown flag {opt!r}")
+    pattern = re.sub(r"(?<!\\)\(\?<(?=[A-Za-z_])", "(?P<", pattern)
+    return re.compile(pattern, flags)
+
+
+def _variable_options(
+    client: GrafanaClient, dashboard: dict, name: str, variables: Variables
+) -> list[str]:
+    """All values of a template variable, for sweeping a panel across them.
+
+    Custom, interval and constant variables come from the dashboard JSON.
+    Query variables are resolved live, falling back to the options saved
+    with the dashboard. The variable's ``regex`` filters the values and
+    extracts the ``value`` or ``text`` group, else the first group, if it
+    has one; an invalid regex is reported and ignored. ``All`` is never a
+    value.
+    Raises ValueError when no values can be found.
+    """
+    import re
+
+    var = next(
+        (
+            v
+            for v in dashboard.get("templating", {}).get("list", [])
+            if v.get("name") == name
+        ),
+        None,
+    )
+    if var is None:
+        raise ValueError(f"Dashboard has no template variable {name!r}")
+    kind = var.get("type")
+    values: list[str] | None = None
+    if kind in ("custom", "interval"):
+        values = _custom_options(str(var.get("query") or ""))
+    elif kind == "constant":
+        values = [str(var.get("query") or "")]
+    elif kind == "query":
+        values = _query_variable_options(client, var, variables)
+    if not values:
+        values = [
+            str(o.get("value"))
+            for o in var.get("options") or []
+            if o.get("value") is not None
+        ]
+
+    pattern = (var.get("regex") or "").strip()
+    if pattern:
+        try:
+            regex = _js_regex(pattern)
+        except re.error as exc:
+            print(
+                f"WARNING: variable {name!r}: ignoring regex {pattern!r}: {exc}",
+                file=sys.stderr,
+            )
+        else:
+            matched = []
+            for value in values:
+                m = regex.search(value)
+                if m is None:
+                    continue
+                groups = m.groupdict()
+                matched.append(
+                    groups.get("value")
+                    or groups.get("text")
+                    or (m.group(1) if m.groups() else value)
+                )
+            values = matched
+
+    values = [v for v in dict.fromkeys(values) if v != "$__all"]
+    if not values:
+        raise ValueError(
+            f"No values found for variable {name!r}; list them with "
+            f"--var-all {name}=a,b,c"
+        )
+    return values
+
+
+def _panel_queries(panel: dict, variables: Variables) -> list[dict]:
+    """Build ``/api/ds/query`` queries from a panel's targets.
+
+    Multi-value variables without a format modifier are rendered the way
+    the target's datasource type does it (``_MULTI_VALUE_FORMATS``).
+    """
+    queries: list[dict] = []
+    for idx, target in enumerate(panel.get("targets", [])):
+        q = dict(target)
+        q["refId"] = q.get("refId", chr(65 + idx))
+        q["maxDataPoints"] = q.get("maxDataPoints", 1000)
+        q["intervalMs"] = q.get("intervalMs", 15000)
+        # Ensure datasource is set (panel-level or target-level)
+        if "datasource" not in q and panel.get("datasource"):
+            q["datasource"] = panel["datasource"]
+        if variables:
+            ds = q.get("datasource")
+            ds_type = ds.get("type") if isinstance(ds, dict) else None
+            q = _resolve_variables(q, variables, _MULTI_VALUE_FORMATS.get(ds_type))
+        queries.append(q)
+    return queries
+
+
+@dataclass
+class PanelJob:
+    """Queries of one dashboard panel, renamed to batch-unique refIds."""
+
+    dashboard_uid: str
+    panel: dict
+    time_from: str
+    time_to: str
+    ref_ids: dict[str, str]  # batch refId -> original refId
+    queries: list[dict]
+
+
+def _dashboard_jobs(
+    dashboard_uid: str,
+    dashboard: dict,
+    variables: Variables,
+    time_from: str | None,
+    time_to: str | None,
+    counter: Any,
+) -> list[PanelJob]:
+    """One PanelJob per panel with runnable targets.
+
+    Hidden targets and pseudo datasources are skipped. The dashboard's saved
+    time range and current variable values apply unless overridden.
+    """
+    saved = dashboard.get("time") or {}
+    job_from = time_from or saved.get("from") or "now-1h"
+    job_to = time_to or saved.get("to") or "now"
+    merged = {**_dashboard_variables(dashboard), **variables}
+
+    jobs: list[PanelJob] = []
+    for panel in _flatten_panels(dashboard):
+        job = _panel_job(dashboard_uid, panel, merged, job_from, job_to, counter)
+        if job is not None:
+            jobs.append(job)
+    return jobs
+
+
+def _panel_job(
+    dashboard_uid: str,
+    panel: dict,
+    variables: Variables,
+    time_from: str,
+    time_to: str,
+    counter: Any,
+) -> PanelJob | None:
+    """The runnable queries of one panel as a PanelJob, or None if there are none."""
+    ref_ids: dict[str, str] = {}
+    queries: list[dict] = []
+    for q in _panel_queries(panel, variables):
+        ds = q.get("datasource")
+        uid = ds.get("uid") if isinstance(ds, dict) else ds
+        # Targets without a datasource go out as they are, like panel-query
+        # sends them, and run on the default datasource.
+        if q.get("hide") or uid in _SKIP_DATASOURCE_UIDS:
+            continue
+        batch_ref = f"Q{next(counter)}"
+        ref_ids[batch_ref] = q["refId"]
+        queries.append({**q, "refId": batch_ref})
+    if not queries:
+        return None
+    return PanelJob(dashboard_uid, panel, time_from, time_to, ref_ids, queries)
+
+
+def _batch_jobs(jobs: list[PanelJob], batch_size: int) -> list[list[dict]]:
+    """Group the queries of all jobs into per-datasource, per-range batches."""
+    groups: dict[str, list[dict]] = {}
+    for job in jobs:
+        for q in job.queries:
+            key = json.dumps(
+                [q.get("datasource"), job.time_from, job.time_to], sort_keys=True
+            )
+            groups.setdefault(key, []).append((job, q))
+    batches: list[list] = []
+    for items in groups.values():
+        for start in range(0, len(items), batch_size):
+            batches.append(items[start : start + batch_size])
+    return batches
+
+
+def _panel_result(job: PanelJob, results: dict[str, dict]) -> dict:
+    """Reassemble one panel's ``/api/ds/query`` result from the batch results.
+
+    Frames keep their data; when the panel has several targets, each frame's
+    first field gets a ``refId`` label so all targets fit into one table.
+    """
+    tag = len(job.ref_ids) > 1
+    frames: list[dict] = []
+    errors: dict[str, str] = {}
+    for batch_ref, ref_id in job.ref_ids.items():
+        ref_result = results.get(batch_ref, {})
+        if "error" in ref_result:
+            errors[ref_id] = ref_result["error"]
+        elif ref_result.get("status", 200) != 200:
+            errors[ref_id] = f"status {ref_result['status']}"
+        for frame in ref_result.get("frames", []):
+            frames.append(_tag_frame(frame, {"refId": ref_id}) if tag else frame)
+    return {"frames": frames, "errors": errors}
+
+
+def _tag_frame(frame: dict, labels: dict[str, str]) -> dict:
+    """Copy of ``frame`` with ``labels`` added to its first field's labels."""
+    fields = frame.get("schema", {}).get("fields", [])
+    if not fields:
+        return frame
+    first = dict(fields[0])
+    first["labels"] = {**(first.get("labels") or {}), **labels}
+    return {**frame, "schema": {**frame["schema"], "fields": [first, *fields[1:]]}}
+
+
+def _run_panel_jobs(
+    client: GrafanaClient,
+    jobs: list[PanelJob],
+    *,
+    parallel: int,
+    cache: QueryCache | None,
+    batch_size: int = _DASHBOARD_BATCH_SIZE,
+) -> list[dict]:
+    """Run all panel jobs in shared batches; returns one result per job."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    batches = _batch_jobs(jobs, batch_size)
+    print(
+        f"Running {sum(len(j.queries) for j in jobs)} queries from {len(jobs)} "
+        f"panel(s) in {len(batches)} request(s) with {parallel} worker(s)...",
+        file=sys.stderr,
+    )
+
+    def run(batch: list) -> dict:
+        job = batch[0][0]
+        try:
+            result = _run_queries(
+                client,
+                [q for _job, q in batch],
+                job.time_from,
+                job.time_to,
+                cache=cache,
+                check_errors=False,
+            )
+        except GrafanaAPIError as exc:
+            # Grafana answers 4xx/5xx when any query of a batch fails, but the
+            # body still carries the per-refId results of the others.
+            if isinstance(exc.response, dict) and "results" in exc.response:
+                return exc.response["results"]
+            return {q["refId"]: {"error": str(exc)} for _job, q in batch}
+        return result.get("results", {})
+
+    results: dict[str, dict] = {}
+    with ThreadPoolExecutor(max_workers=max(1, parallel)) as pool:
+        for batch_results in pool.map(run, batches):
+            results.update(batch_results)
+    return [_panel_result(job, results) for job in jobs]
+
+
+def _panel_matrix(
+    client: GrafanaClient,
+    dashboard_uid: str,
+    dashboard: dict,
+    panel: dict,
+    variables: Variables,
+    sweep: dict[str, list[str] | None],
+    time_from: str,
+    time_to: str,
+    *,
+    parallel: int,
+    cache: QueryCache | None,
+) -> tuple[dict, int]:
+    """Run a panel once per combination of variable values, as one result.
+
+    ``sweep`` maps variable names to their values, or to None to take all
+    options of the dashboard variable. Each combination becomes a PanelJob,
+    so the queries share batched requests and run on the worker pool.
+    Frames are tagged with their combination's values as labels, which the
+    exporters turn into columns. Returns the result and the failure count.
+    """
+    import itertools
+
+    # Chained variables resolve against the dashboard's current values,
+    # overridden by --var; the swept queries see the same values.
+    current = {**_dashboard_variables(dashboard), **variables}
+    options = {
+        name: values or _variable_options(client, dashboard, name, current)
+        for name, values in sweep.items()
+    }
+    combos = [
+        dict(zip(options, values)) for values in itertools.product(*options.values())
+    ]
+    print(
+        f"Sweeping panel {panel.get('id')} over {len(combos)} combination(s) of "
+        + ", ".join(f"{name} ({len(values)})" for name, values in options.items()),
+        file=sys.stderr,
+    )
+    counter = itertools.count()
+    jobs: list[PanelJob] = []
+    for combo in combos:
+        job = _panel_job(
+            dashboard_uid, panel, {**current, **combo}, time_from, time_to, counter
+        )
+        if job is None:
+            raise ValueError(f"Panel {panel.get('id')} has no runnable queries")
+        jobs.append(job)
+
+    frames: list[dict] = []
+    failed = 0
+    for combo, panel_result in zip(
+        combos, _run_panel_jobs(client, jobs, parallel=parallel, cache=cache)
+    ):
+        frames.extend(_tag_frame(frame, combo) for frame in panel_result["frames"])
+        for ref_id, error in panel_result["errors"].items():
+            failed += 1
+            values = ", ".join(f"{k}={v}" for k, v in combo.items())
+            print(f"  [{values}] query {ref_id} failed: {error}", file=sys.stderr)
+    return {"results": {"matrix": {"frames": frames}}}, failed
+
+
+# ---------------------------------------------------------------------------
+# Dashboard Validation
+# ---------------------------------------------------------------------------
+
+_VALID_LAYOUT_KINDS = {"GridLayout", "RowsLayout", "AutoGridLayout", "TabsLayout"}
+_VALID_VARIABLE_KINDS = {
+    "QueryVariable",
+    "CustomVariable",
+    "ConstantVariable",
+    "TextVariable",
+    "DatasourceVariable",
+    "IntervalVariable",
+    "GroupByVariable",
+    "AdhocVariable",
+    "SwitchVariable",
+}
+
+
+@dataclass
+class ValidationIssue:
+    """A single validation finding."""
+
+    level: str  # "error" | "warning"
+    path: str  # JSON path
+    rule: str  # machine-readable rule ID
+    message: str  # human-readable message
+
+
+def _validate_v2beta1(data: dict) -> list[ValidationIssue]:
+    """Validate a v2beta1 dashboard."""
+    issues: list[ValidationIssue] = []
+
+    def err(path: str, rule: str, msg: str) -> None:
+        issues.append(ValidationIssue("error", path, rule, msg))
+
+    def warn(path: str, rule: str, msg: str) -> None:
+        issues.append(ValidationIssue("warning", path, rule, msg))
+
+    # --- Envelope ---
+    if data.get("apiVersion") != "dashboard.grafana.app/v2beta1":
+        err(
+            "apiVersion",
+            "invalid-api-version",
+            f'expected "dashboard.grafana.app/v2beta1", got {data.get("apiVersion")!r}',
+        )
+    if data.get("kind") != "Dashboard":
+        err("kind", "invalid-kind", f'expected "Dashboard", got {data.get("kind")!r}')
+    meta = data.get("metadata")
+    if not isinstance(meta, dict) or not meta.get("name"):
+        err("metadata.name", "missing-required-field", '"metadata.name" is required')
+
+    spec = data.get("spec")
+    if not isinstance(spec, dict):
+        err(
+            "spec", "missing-required-field", '"spec" is required and must be an object'
+        )
+        return issues
+
+    # --- Required spec fields ---
+    critical_required = {"title", "elements", "layout", "timeSettings"}
+    soft_required = {
+        "annotations",
+        "cursorSync",
+        "links",
+        "preload",
+        "tags",
+        "variables",
+    }
+    for field in critical_required:
+        if field not in spec:
+            err(f"spec.{field}", "missing-required-field", f'"{field}" is required')
+    for field in soft_required:
+        if field not in spec:
+            warn(
+                f"spec.{field}",
+                "missing-recommended-field",
+                f'"{field}" is recommended by the OpenAPI spec',
+            )
+
+    # --- CursorSync enum ---
+    cs = spec.get("cursorSync")
+    if cs is not None and cs not in ("Off", "Crosshair", "Tooltip"):
+        err(
+            "spec.cursorSync",
+            "invalid-enum",
+            f'must be "Off", "Crosshair", or "Tooltip", got {cs!r}',
+        )
+
+    # --- Elements ---
+    elements = spec.get("elements", {})
+    if not isinstance(elements, dict):
+        err("spec.elements", "invalid-type", '"elements" must be an object')
+        elements = {}
+
+    for name, el in elements.items():
+        p = f"spec.elements.{name}"
+        if not isinstance(el, dict):
+            err(p, "invalid-type", "element must be an object")
+            continue
+        kind = el.get("kind")
+        if kind not in ("Panel", "LibraryPanel"):
+            err(
+                f"{p}.kind",
+                "invalid-kind",
+                f'expected "Panel" or "LibraryPanel", got {kind!r}',
+            )
+            continue
+        el_spec = el.get("spec")
+        if not isinstance(el_spec, dict):
+            err(f"{p}.spec", "missing-required-field", '"spec" is required')
+            continue
+
+        if kind == "Panel":
+            if "vizConfig" not in el_spec:
+                err(
+                    f"{p}.spec.vizConfig",
+                    "missing-required-field",
+                    '"vizConfig" is required',
+                )
+            elif isinstance(el_spec["vizConfig"], dict):
+                vc = el_spec["vizConfig"]
+                if vc.get("kind") != "VizConfig":
+                    err(
+                        f"{p}.spec.vizConfig.kind",
+                        "invalid-kind",
+                        f'expected "VizConfig", got {vc.get("kind")!r}',
+                    )
+
+            data_node = el_spec.get("data")
+            if data_node is not None and isinstance(data_node, dict):
+                if data_node.get("kind") != "QueryGroup":
+                    err(
+                        f"{p}.spec.data.kind",
+                        "invalid-kind",
+                        f'expected "QueryGroup", got {data_node.get("kind")!r}',
+                    )
+                queries = data_node.get("spec", {}).get("queries", [])
+                for qi, q in enumerate(queries):
+                    qp = f"{p}.spec.data.spec.queries[{qi}]"
+                    if isinstance(q, dict):
+                        q_spec = q.get("spec", {})
+                        if not q_spec.get("refId"):
+                            warn(
+                                f"{qp}.spec.refId",
+                                "missing-ref-id",
+                                '"refId" is recommended for each query',
+                            )
+
+    # --- Layout ---
+    layout = spec.get("layout")
+    if isinstance(layout, dict):
+        referenced_elements = set()
+        _validate_layout(layout, "spec.layout", elements, referenced_elements, issues)
+
+        # Orphan detection
+        for name in elements:
+            if name not in referenced_elements:
+                warn(
+                    f"spec.elements.{name}",
+                    "orphan-element",
+                    "not referenced by any layout item",
+                )
+    elif layout is not None:
+        err("spec.layout", "invalid-type", '"layout" must be an object')
+
+    # --- Variables ---
+    variables = spec.get("variables", [])
+    if isinstance(variables, list):
+        var_names: list[str] = []
+        for vi, v in enumerate(variables):
+            vp = f"spec.variables[{vi}]"
+            if not isinstance(v, dict):
+                err(vp, "invalid-type", "variable must be an object")
+                continue
+            vkind = v.get("kind")
+            if vkind and vkind not in _VALID_VARIABLE_KINDS:
+                warn(
+                    f"{vp}.kind",
+                    "unknown-variable-kind",
+                    f"unknown variable kind {vkind!r}",
+                )
+            vname = (v.get("spec") or {}).get("name")
+            if vname:
+                if vname in var_names:
+                    err(
+                        f"{vp}.spec.name",
+                        "duplicate-variable-name",
+                        f'variable name "{vname}" is already used',
+                    )
+                var_names.append(vname)
+
+    return issues
+
+
+def _validate_layout(
+    layout: dict,
+    path: str,
+    elements: dict,
+    referenced: set,
+    issues: list[ValidationIssue],
+) -> None:
+    """Recursively validate a layout node and collect element references."""
+
+    def err(p: str, rule: str, msg: str) -> None:
+        issues.append(ValidationIssue("error", p, rule, msg))
+
+    kind = layout.get("kind")
+    if kind not in _VALID_LAYOUT_KINDS:
+        err(
+            f"{path}.kind",
+            "invalid-layout-kind",
+            f"expected one of {sorted(_VALID_LAYOUT_KINDS)}, got {kind!r}",
+        )
+        return
+
+    layout_spec = layout.get("spec")
+    if not isinstance(layout_spec, dict):
+        err(f"{path}.spec", "missing-required-field", '"spec" is required')
+        return
+
+    if kind == "GridLayout":
+        items = layout_spec.get("items", [])
+        for ii, item in enumerate(items):
+            ip = f"{path}.spec.items[{ii}]"
+            _validate_grid_item(item, ip, elements, referenced, issues)
+
+    elif kind == "RowsLayout":
+        rows = layout_spec.get("rows", [])
+        for ri, row in enumerate(rows):
+            rp = f"{path}.spec.rows[{ri}]"
+            if not isinstance(row, dict):
+                err(rp, "invalid-type", "row must be an object")
+                continue
+            row_spec = row.get("spec", {})
+            if isinstance(row_spec, dict):
+                nested = row_spec.get("layout")
+                if isinstance(nested, dict):
+                    _validate_layout(
+                        nested, f"{rp}.spec.layout", elements, referenced, issues
+                    )
+
+    elif kind == "AutoGridLayout":
+        items = layout_spec.get("items", [])
+        for ii, item in enumerate(items):
+            ip = f"{path}.spec.items[{ii}]"
+            if isinstance(item, dict):
+                item_spec = item.get("spec", {})
+                if isinstance(item_spec, dict):
+                    _validate_element_ref(
+                        item_spec.get("element"),
+                        f"{ip}.spec.element",
+                        elements,
+                        referenced,
+                        issues,
+                    )
+
+    elif kind == "TabsLayout":
+        tabs = layout_spec.get("tabs", [])
+        for ti, tab in enumerate(tabs):
+            tp = f"{path}.spec.tabs[{ti}]"
+            if isinstance(tab, dict):
+                tab_spec = tab.get("spec", {})
+                if isinstance(tab_spec, dict):
+                    nested = tab_spec.get("layout")
+                    if isinstance(nested, dict):
+                        _validate_layout(
+                            nested, f"{tp}.spec.layout", elements, referenced, issues
+                        )
+
+
+def _validate_grid_item(
+    item: Any,
+    path: str,
+    elements: dict,
+    referenced: set,
+    issues: list[ValidationIssue],
+) -> None:
+    """Validate a single GridLayoutItem."""
+
+    def err(p: str, rule: str, msg: str) -> None:
+        issues.append(ValidationIssue("error", p, rule, msg))
+
+    if not isinstance(item, dict):
+        err(path, "invalid-type", "grid item must be an object")
+        return
+    item_spec = item.get("spec")
+    if not isinstance(item_spec, dict):
+        err(f"{path}.spec", "missing-required-field", '"spec" is required')
+        return
+
+    # Grid bounds
+    x = item_spec.get("x")
+    y = item_spec.get("y")
+    w = item_spec.get("width")
+    h = item_spec.get("height")
+
+    for field, val in [("x", x), ("y", y), ("width", w), ("height", h)]:
+        if not isinstance(val, (int, float)):
+            err(
+                f"{path}.spec.{field}",
+                "missing-required-field",
+                f'"{field}" is required and must be a number',
+            )
+
+    if isinstance(x, (int, float)) and isinstance(w, (int, float)):
+        if x < 0:
+            err(f"{path}.spec.x", "grid-bounds", f"x must be >= 0, got {x}")
+        if w <= 0:
+            err(f"{path}.spec.width", "grid-bounds", f"width must be > 0, got {w}")
+        if x + w > 24:
+            err(f"{path}.spec", "grid-overflow", f"x({x}) + width({w}) = {x+w} > 24")
+    if isinstance(y, (int, float)) and y < 0:
+        err(f"{path}.spec.y", "grid-bounds", f"y must be >= 0, got {y}")
+    if isinstance(h, (int, float)) and h <= 0:
+        err(f"{path}.spec.height", "grid-bounds", f"height must be > 0, got {h}")
+
+    _validate_element_ref(
+        item_spec.get("element"), f"{path}.spec.element", elements, referenced, issues
+    )
+
+
+def _validate_element_ref(
+    ref: Any,
+    path: str,
+    elements: dict,
+    referenced: set,
+    issues: list[ValidationIssue],
+) -> None:
+    """Validate an ElementReference and track the reference."""
+    if not isinstance(ref, dict):
+        issues.append(
+            ValidationIssue(
+                "error",
+                path,
+                "missing-required-field",
+                '"element" reference is required',
+            )
+        )
+        return
+    name = ref.get("name")
+    if not name:
+        issues.append(
+            ValidationIssue(
+                "error",
+                f"{path}.name",
+                "missing-required-field",
+                '"name" is required in ElementReference',
+            )
+        )
+        return
+    referenced.add(name)
+    if name not in elements:
+        issues.append(
+            ValidationIssue(
+                "error",
+                f"{path}.name",
+                "broken-reference",
+                f'element "{name}" not found in spec.elements',
+            )
+        )
+
+
+def _validate_legacy(data: dict) -> list[ValidationIssue]:
+    """Validate a legacy-format dashboard."""
+    issues: list[ValidationIssue] = []
+
+    def err(path: str, rule: str, msg: str) -> None:
+        issues.append(ValidationIssue("error", path, rule, msg))
+
+    def warn(path: str, rule: str, msg: str) -> None:
+        issues.append(ValidationIssue("warning", path, rule, msg))
+
+    # Handle wrapped format
+    if "dashboard" in data and isinstance(data["dashboard"], dict):
+        dashboard = data["dashboard"]
+        prefix = "dashboard"
+    else:
+        dashboard = data
+        prefix = ""
+
+    def p(field: str) -> str:
+        return f"{prefix}.{field}" if prefix else field
+
+    if not dashboard.get("title"):
+        err(p("title"), "missing-required-field", '"title" is required')
+
+    panels = dashboard.get("panels", [])
+    if not isinstance(panels, list):
+        err(p("panels"), "invalid-type", '"panels" must be an array')
+        return issues
+
+    seen_ids: list[int] = []
+    for pi, panel in enumerate(panels):
+        pp = p(f"panels[{pi}]")
+        if not isinstance(panel, dict):
+            err(pp, "invalid-type", "panel must be an object")
+            continue
+
+        if panel.get("type") == "row":
+            continue  # rows don't need gridPos validation
+
+        if not panel.get("type"):
+            err(f"{pp}.type", "missing-required-field", '"type" is required')
+
+        pid = panel.get("id")
+        if isinstance(pid, (int, float)):
+            if pid in seen_ids:
+                err(f"{pp}.id", "duplicate-panel-id", f"panel id {pid} is duplicated")
+            seen_ids.append(int(pid))
+
+        gp = panel.get("gridPos")
+        if not isinstance(gp, dict):
+            warn(f"{pp}.gridPos", "missing-grid-pos", '"gridPos" is recommended')
+        else:
+            x = gp.get("x", 0)
+            w = gp.get("w", 0)
+            h = gp.get("h", 0)
+            if (
+                isinstance(x, (int, float))
+                and isinstance(w, (int, float))
+                and x + w > 24
+            ):
+                err(f"{pp}.gridPos", "grid-overflow", f"x({x}) + w({w}) = {x+w} > 24")
+            if isinstance(h, (int, float)) and h <= 0:
+                err(f"{pp}.gridPos.h", "grid-bounds", f"h must be > 0, got {h}")
+
+        targets = panel.get("targets", [])
+        for ti, t in enumerate(targets):
+            if isinstance(t, dict) and not t.get("refId"):
+                warn(
+                    f"{pp}.targets[{ti}].refId",
+                    "missing-ref-id",
+                    '"refId" is recommended',
+                )
+
+    return issues
+
+
+def _format_issues_text(fmt: str, issues: list[ValidationIssue]) -> str:
+    """Format validation issues as human-readable text."""
+    errors = [i for i in issues if i.level == "error"]
+    warnings = [i for i in issues if i.level == "warning"]
+    lines = [f"Format: {fmt}"]
+
+    if not errors and not warnings:
+        lines.append("Status: VALID")
+        return "\n".join(lines)
+
+    parts = []
+    if errors:
+        parts.append(f"{len(errors)} error{'s' if len(errors) != 1 else ''}")
+    if warnings:
+        parts.append(f"{len(warnings)} warning{'s' if len(warnings) != 1 else ''}")
+    status = "INVALID" if errors else "VALID"
+    lines.append(f"Status: {status} ({', '.join(parts)})")
+
+    if errors:
+        lines.append("\nERRORS:")
+        for i in errors:
+            lines.append(f"  [E] {i.path}: {i.rule} \u2014 {i.message}")
+    if warnings:
+        lines.append("\nWARNINGS:")
+        for i in warnings:
+            lines.append(f"  [W] {i.path}: {i.rule} \u2014 {i.message}")
+
+    return "\n".join(lines)
+
+
+def _format_issues_json(fmt: str, issues: list[ValidationIssue]) -> str:
+    """Format validation issues as JSON."""
+    errors = [i for i in issues if i.level == "error"]
+    warnings = [i for i in issues if i.level == "warning"]
+    result = {
+        "format": fmt,
+        "valid": len(errors) == 0,
+        "errors": [
+            {"path": i.path, "rule": i.rule, "message": i.message} for i in errors
+        ],
+        "warnings": [
+            {"path": i.path, "rule": i.rule, "message": i.message} for i in warnings
+        ],
+    }
+    return json.dumps(result, indent=2, ensure_ascii=False)
+
+
+def _load_dashboard_file(path: Path) -> Any:
+    """Parse a dashboard file as YAML (by suffix) or JSON."""
+    text = path.read_text()
+    if path.suffix in (".yaml", ".yml"):
+        import yaml  # type: ignore[import-untyped]
+
+        return yaml.safe_load(text)
+    return json.loads(text)
+
+
+def _validate_data(data: dict, fmt_override: str | None) -> tuple[str, list]:
+    """Detect the format and validate. Returns (display format, issues).
+
+    Raises ValueError for an unknown ``fmt_override``.
+    """
+    if fmt_override and fmt_override != "auto":
+        fmt = fmt_override
+    elif data.get("apiVersion") == "dashboard.grafana.app/v2beta1":
+        fmt = "v2beta1"
+    elif "apiVersion" in data and "kind" in data:
+        fmt = "v2beta1"  # treat other K8s versions as v2beta1
+    else:
+        fmt = "legacy"
+
+    if fmt in ("v2beta1", "k8s"):
+        return "v2beta1", _validate_v2beta1(data)
+    if fmt == "legacy":
+        return "legacy", _validate_legacy(data)
+    raise ValueError(f"Unknown format: {fmt}. Use 'auto', 'legacy', or 'v2beta1'.")
+
+
+# ---------------------------------------------------------------------------
+# Bulk Validation
+# ---------------------------------------------------------------------------
+
+_VALIDATE_SUFFIXES = (".json", ".yaml", ".yml")
+# Working files the CLI writes next to dashboards; not dashboards themselves.
+_VALIDATE_SKIP_SUFFIXES = (".base.json", ".merged.json")
+
+
+def _validation_targets(paths: list[str]) -> list[Path]:
+    """Expand files and directories (recursively) into dashboard files."""
+    files: list[Path] = []
+    for p in map(Path, paths):
+        if not p.is_dir():
+            files.append(p)
+            continue
+        for f in sorted(p.rglob("*")):
+            rel = f.relative_to(p).parts
+            if (
+                f.is_file()
+                and f.suffix in _VALIDATE_SUFFIXES
+                and not f.name.endswith(_VALIDATE_SKIP_SUFFIXES)
+                and not any(part.startswith(".") for part in rel)
+            ):
+                files.append(f)
+    return files
+
+
+def _validation_record(
+    fmt: str, issues: list[ValidationIssue], strict: bool
+) -> dict[str, Any]:
+    """JSON-ready result for one file, shaped like ``validate --json``."""
+    errors = [i for i in issues if i.level == "error"]
+    warnings = [i for i in issues if i.level == "warning"]
+    return {
+        "format": fmt,
+        "valid": not errors and not (strict and warnings),
+        "errors": [
+            {"path": i.path, "rule": i.rule, "message": i.message} for i in errors
+        ],
+        "warnings": [
+            {"path": i.path, "rule": i.rule, "message": i.message} for i in warnings
+        ],
+    }
+
+
+def _validate_file_worker(
+    file_path: str, fmt_override: str | None, strict: bool
+) -> dict[str, Any]:
+    """Validate one file; runs in a worker process, so it never exits."""
+    try:
+        data = _load_dashboard_file(Path(file_path))
+        if not isinstance(data, dict):
+            raise ValueError("file must contain a JSON/YAML object")
+        fmt, issues = _validate_data(data, fmt_override)
+    except Exception as exc:
+        fmt = "unknown"
+        issues = [ValidationIssue("error", "", "parse-error", str(exc))]
+    return {"file": file_path, **_validation_record(fmt, issues, strict)}
+
+
+class ValidationCache:
+    """Validation results keyed by file content, format override and rules.
+
+    The key includes a digest of this script, so editing the validator
+    invalidates every entry. Entries live in ``<cache dir>/validate/<digest>/``;
+    ``evict`` removes the directories of other script versions and drops the
+    least recently read entries above ``GRAFANA_VALIDATE_CACHE_MAX_MB``.
+    """
+
+    def __init__(self, fmt_override: str | None, strict: bool) -> None:
+        import hashlib
+
+        rules = hashlib.sha256(Path(__file__).read_bytes()).hexdigest()
+        self.root = _cache_dir() / "validate"
+        self.dir = self.root / rules[:16]
+        self.salt = f"{rules}|{fmt_override or 'auto'}|{strict}".encode()
+        self.max_bytes = (
+            int(os.environ.get("GRAFANA_VALIDATE_CACHE_MAX_MB", "64")) * 1024 * 1024
+        )
+
+    def key(self, path: Path) -> str | None:
+        import hashlib
+
+        try:
+            content = path.read_bytes()
+        except OSError:
+            return None
+        return hashlib.sha256(self.salt + b"\0" + content).hexdigest()
+
+    def get(self, key: str) -> dict[str, Any] | None:
+        import time as _time
+
+        path = self.dir / f"{key}.json"
+        try:
+            data = json.loads(path.read_text())
+            # Record the read in atime (kept explicitly; mounts may use noatime).
+            os.utime(path, (_time.time(), path.stat().st_mtime))
+        except (OSError, ValueError):
+            return None
+        return data
+
+    def put(self, key: str, record: dict[str, Any]) -> None:
+        self.dir.mkdir(parents=True, exist_ok=True)
+        result = {k: v for k, v in record.items() if k != "file"}
+        tmp = self.dir / f"{key}.{os.getpid()}.tmp"
+        tmp.write_text(json.dumps(result, ensure_ascii=False))
+        os.replace(tmp, self.dir / f"{key}.json")
+
+    def evict(self) -> None:
+        """Drop other script versions, then least-recently-read entries above the bound."""
+        import shutil
+
+        if not self.root.exists():
+            return
+        for path in self.root.iterdir():
+            if path != self.dir:
+                if path.is_dir():
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    path.unlink(missing_ok=True)  # flat entries of older versions
+        entries = []
+        total = 0
+        for path in self.dir.glob("*.json"):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_atime, st.st_size, path))
+            total += st.st_size
+        if total <= self.max_bytes:
+            return
+        for _atime, size, path in sorted(entries):
+            path.unlink(missing_ok=True)
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+
+def _validate_many(
+    paths: list[str],
+    fmt_override: str | None,
+    *,
+    strict: bool,
+    jobs: int,
+    use_cache: bool,
+) -> None:
+    """Validate many files in a process pool, streaming JSONL to stdout.
+
+    One line per file: ``{"file", "format", "valid", "errors", "warnings",
+    "cached"}``. Unchanged files are answered from the cache first; the rest
+    are fanned out to worker processes. Exits 1 if any file is invalid.
+    """
+    files = _validation_targets(paths)
+    cache = ValidationCache(fmt_override, strict) if use_cache else None
+    invalid = cached = 0
+
+    def emit(record: dict[str, Any], from_cache: bool) -> None:
+        nonlocal invalid
+        invalid += not record["valid"]
+        print(json.dumps({**record, "cached": from_cache}, ensure_ascii=False))
+
+    pending: list[tuple[Path, str | None]] = []
+    for f in files:
+        key = cache.key(f) if cache else None
+        hit = cache.get(key) if cache and key else None
+        if hit is not None:
+            cached += 1
+            emit({"file": str(f), **hit}, True)
+        else:
+            pending.append((f, key))
+    sys.stdout.flush()
+
+    names = [str(f) for f, _ in pending]
+    n = len(names)
+    if jobs <= 1 or n < 2:
+        results = (_validate_file_worker(f, fmt_override, strict) for f in names)
+        pool = None
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        pool = ProcessPoolExecutor(max_workers=min(jobs, n))
+        results = pool.map(
+            _validate_file_worker,
+            names,
+            [fmt_override] * n,
+            [strict] * n,
+            chunksize=max(1, min(16, n // (jobs * 4))),
+        )
+    try:
+        for (_, key), record in zip(pending, results):
+            if cache and key and record["format"] != "unknown":
+                cache.put(key, record)
+            emit(record, False)
+            sys.stdout.flush()
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    if cache:
+        cache.evict()
+
+    print(
+        f"Validated {len(files)} file(s) ({cached} cached): {invalid} invalid",
+        file=sys.stderr,
+    )
+    if invalid:
+        sys.exit(1)
+
+
+# ---------------------------------------------------------------------------
+# CLI commands
+# ---------------------------------------------------------------------------
+
+
+def _pp(data: Any) -> None:
+    """Pretty-print JSON."""
+    print(json.dumps(data, indent=2, ensure_ascii=False))
+
+
+def cmd_health(client: GrafanaClient, _args: list[str], **_kw: Any) -> None:
+    _pp(client.health())
+
+
+def cmd_list(
+    client: GrafanaClient,
+    args: list[str],
+    *,
+    ops: DashboardOps | None = None,
+    **_kw: Any,
+) -> None:
+    """List dashboards. Flags: --query <q>, --tag <t>, --folder <uid>, --limit <n>,
+    --label <selector>, --field <selector> (K8s mode), --json"""
+    query = tag = folder_uid = label_selector = field_selector = None
+    limit = 100
+    as_json = False
+    i = 0
+    while i < len(args):
+        if args[i] == "--query" and i + 1 < len(args):
+            query = args[i + 1]
+            i += 2
+        elif args[i] == "--tag" and i + 1 < len(args):
+            tag = args[i + 1]
+            i += 2
+        elif args[i] == "--folder" and i + 1 < len(args):
+            folder_uid = args[i + 1]
+            i += 2
+        elif args[i] == "--limit" and i + 1 < len(args):
+            limit = int(args[i + 1])
+            i += 2
+        elif args[i] == "--label" and i + 1 < len(args):
+            label_selector = args[i + 1]
+            i += 2
+        elif args[i] == "--field" and i + 1 < len(args):
+            field_selector = args[i + 1]
+            i += 2
+        elif args[i] == "--json":
+            as_json = True
+            i += 1
+        else:
+            i += 1
+
+    if (label_selector or field_selector) and (not ops or ops.api_mode != "k8s"):
+        print("--label/--field require the K8s API mode (--api k8s)", file=sys.stderr)
+        sys.exit(1)
+    if ops:
+        results = ops.search(
+            query=query,
+            tag=tag,
+            folder_uid=folder_uid,
+            limit=limit,
+            label_selector=label_selector,
+            field_selector=field_selector,
+        )
+    else:
+        results = client.search_dashboards(
+            query=query, tag=tag, folder_uid=folder_uid, limit=limit
+        )
+    if as_json:
+        _pp(results)
+    else:
+        print(f"\nDashboards ({len(results)}):\n" + "-" * 72)
+        for d in results:
+            tags = f" [{', '.join(d.get('tags', []))}]" if d.get("tags") else ""
+            folder = f" ({d.get('folderTitle', '')})" if d.get("folderTitle") else ""
+            print(f"  {d['uid']:20s}  {d['title']}{folder}{tags}")
+        print("-" * 72)
+
+
+def cmd_get(
+    client: GrafanaClient,
+    args: list[str],
+    *,
+    ops: DashboardOps | None = None,
+    **_kw: Any,
+) -> None:
+    """Get dashboard by UID. Usage: get <uid> [--json]"""
+    if not args:
+        print("Usage: get <uid> [--json]", file=sys.stderr)
+        sys.exit(1)
+    uid = args[0]
+    as_json = "--json" in args
+
+    if ops:
+        dashboard, occ, raw = ops.get_raw(uid)
+        if as_json:
+            _pp(raw)
+        else:
+            meta = (
+                raw.get("meta", {})
+                if ops.api_mode == "legacy"
+                else raw.get("metadata", {})
+            )
+            print(f"\nDashboard: {dashboard.get('title', '?')}\n" + "-" * 72)
+            print(f"  UID:      {dashboard.get('uid')}")
+            print(f"  API Mode: {ops.api_mode}")
+            if occ.api_mode == "k8s":
+                print(f"  OCC:      resourceVersion={occ.resource_version}")
+            else:
+                print(f"  OCC:      version={occ.version}")
+            if ops.api_mode == "legacy":
+                print(f"  Folder:   {meta.get('folderTitle', 'General')}")
+                print(f"  URL:      {meta.get('url')}")
+                print(f"  Updated:  {meta.get('updated')}")
+            else:
+                print(f"  Created:  {meta.get('creationTimestamp', '?')}")
+            print(f"  Panels:   {len(dashboard.get('panels', []))}")
+            if dashboard.get("tags"):
+                print(f"  Tags:     {', '.join(dashboard['tags'])}")
+            print("-" * 72)
+    else:
+        result = client.get_dashboard(uid)
+        if as_json:
+            _pp(result)
+        else:
+            meta = result.get("meta", {})
+            dash = result.get("dashboard", {})
+            print(f"\nDashboard: {dash.get('title', '?')}\n" + "-" * 72)
+            print(f"  UID:      {dash.get('uid')}")
+            print(f"  Version:  {meta.get('version')}")
+            print(f"  Folder:   {meta.get('folderTitle', 'General')}")
+            print(f"  URL:      {meta.get('url')}")
+            print(f"  Updated:  {meta.get('updated')}")
+            print(f"  Panels:   {len(dash.get('panels', []))}")
+            if dash.get("tags"):
+                print(f"  Tags:     {', '.join(dash['tags'])}")
+            print("-" * 72)
+
+
+def cmd_export(
+    client: GrafanaClient,
+    args: list[str],
+    *,
+    ops: DashboardOps | None = None,
+    **_kw: Any,
+) -> None:
+    """Export dashboard JSON. Usage: export <uid> [--output <path>] [--format <legacy|k8s>] [--no-base]"""
+    if not args:
+        print(
+            "Usage: export <uid> [--output <path>] [--format <legacy|k8s>] [--no-base]",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+    uid = args[0]
+    output = None
+    out_format = None
+    no_base = "--no-base" in args
+    if "--output" in args:
+        idx = args.index("--output")
+        output = args[idx + 1] if idx + 1 < len(args) else None
+    if "--format" in args:
+        idx = args.index("--format")
+        out_format = args[idx + 1] if idx + 1 < len(args) else None
+
+    if ops:
+        dashboard, occ = ops.get(uid)
+    else:
+        result = client.get_dashboard(uid)
+        dashboard = result["dashboard"]
+        occ = OccMeta(version=result["meta"].get("version"), api_mode="legacy")
+
+    out_data: dict
+    if out_format == "k8s":
+        out_data = legacy_to_k8s(dashboard)
+    else:
+        out_data = dashboard
+
+    out_path = output or f"{uid}.json"
+    Path(out_path).write_text(json.dumps(out_data, indent=2, ensure_ascii=False) + "\n")
+    print(f"Exported to: {out_path}")
+
+    if not no_base:
+        bp = write_sidecar(out_path, dashboard, occ)
+        print(f"Base saved:  {bp}")
+
+
+def cmd_export_all(
+    client: GrafanaClient,
+    args: list[str],
+    *,
+    ops: DashboardOps | None = None,
+    **_kw: Any,
+) -> None:
+    """Export every dashboard into a per-folder tree, skipping unchanged ones.
+
+    Usage: export-all [--output-dir <dir>] [--format <legacy|k8s>] [--parallel <n>]
+                      [--no-base] [--force] [--prune] [--json]
+    """
+    out_dir = Path("grafana-export")
+    out_format: str | None = None
+    parallel = 8
+    no_base = force = prune = as_json = False
+    i = 0
+    while i < len(args):
+        a = args[i]
+        if a == "--output-dir" and i + 1 < len(args):
+            out_dir = Path(args[i + 1])
+            i += 2
+        elif a == "--format" and i + 1 < len(args):
+            out_format = args[i + 1]
+            i += 2
+        elif a == "--parallel" and i + 1 < len(args):
+            parallel = int(args[i + 1])
+            i += 2
+        elif a == "--no-base":
+            no_base = True
+            i += 1
+        elif a == "--force":
+            force = True
+            i += 1
+        elif a == "--prune":
+            prune = True
+            i += 1
+        elif a == "--json":
+            as_json = True
+            i += 1
+        else:
+            i += 1
+
+    ops = ops or DashboardOps(client)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    manifest = ExportManifest(out_dir)
+    try:
+        out_format = _export_format(out_dir, manifest, out_format)
+        summary = _pull_dashboards(
+            client,
+            ops,
+            out_dir,
+            manifest,
+            out_format=out_format,
+            parallel=parallel,
+            sidecar=not no_base,
+            force=force,
+            prune=prune,
+        )
+    finally:
+        manifest.close()
+    _report_pull(summary, out_dir, prune=prune, as_json=as_json)
+
+
+def _report_pull(
+    summary: dict[str, Any], out_dir: Path, *, prune: bool, as_json: bool
+) -> None:
+    if as_json:
+        _pp(summary)
+    else:
+        print(
+            f"Exported {len(summary['written'])}, unchanged {summary['unchanged']}, "
+            f"failed {len(summary['failed'])}, "
+            f"{'pruned' if prune else 'gone from server'} {len(summary['removed'])} "
+            f"-> {out_dir}"
+        )
+        if summary["local_changes"]:
+            print(
+                f"Kept {len(summary['local_changes'])} locally edited dashboard(s): "
+                + ", ".join(summary["local_changes"])
+            )
+    if summary["failed"]:
+        sys.exit(1)
+
+
+def cmd_sync(
+    client: GrafanaClient,
+    args: list[str],
+    *,
+    ops: DashboardOps | None = None,
+    **_kw: Any,
+) -> None:
+    """Incrementally sync an export tree with the server.
+
+    Usage: sync [--dir <dir>] [--push] [--message <m>] [--parallel <n>]
+                [--format <legacy|k8s>] [--prune] [--json]
+    """
+    out_dir = Path("grafana-export")
+    out_format: str | None = None
+    message = "Synced via CLI"
+    parallel = 8
+    push = prune = as_json = False
+    i = 0
+    while i < len(args):
+        a = args[i]
+        if a in ("--dir", "--output-dir") and i + 1 < len(args):
+            out_dir = Path(args[i + 1])
+            i += 2
+        elif a == "--format" and i + 1 < len(args):
+            out_format = args[i + 1]
+            i += 2
+        elif a == "--message" and i + 1 < len(args):
+            message = args[i + 1]
+            i += 2
+        elif a == "--parallel" and i + 1 < len(args):
+            parallel = int(args[i + 1])
+            i += 2
+        elif a == "--push":
+            push = True
+            i += 1
+        elif a == "--prune":
+            prune = True
+            i += 1
+        elif a == "--json":
+            as_json = True
+            i += 1
+        else:
+            i += 1
+
+    ops = ops or DashboardOps(client)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    manifest = ExportManifest(out_dir)
+    try:
+        out_format = _export_format(out_dir, manifest, out_format)
+        pushed: dict[str, list[str]] = {}
+        if push:
+            pushed = _push_dashboards(ops, out_dir, manifest, message=message)
+            manifest.db.commit()
+        summary = _pull_dashboards(
+            client,
+            ops,
+            out_dir,
+            manifest,
+            out_format=out_format,
+            parallel=parallel,
+            prune=prune,
+        )
+    finally:
+        manifest.close()
+    if pushed and not as_json:
+        print(
+            f"Pushed {len(pushed['pushed'])}, conflicts {len(pushed['conflicts'])}, "
+            f"failed {len(pushed['push_failed'])}"
+        )
+    summary.update(pushed)
+    _report_pull(summary, out_dir, prune=prune, as_json=as_json)
+    if pushed.get("conflicts") or pushed.get("push_failed"):
+        sys.exit(1)
+
+
+def cmd_create(
+    client: GrafanaClient,
+    args: list[str],
+    *,
+    ops: DashboardOps | None = None,
+    **_kw: Any,
+) -> None:
+    """Create dashboard from JSON. Usage: create --file <path> [--folder <uid>] [--title <t>] [--message <m>]"""
+    file_path = folder_uid = title = message = None
+    force = False
+    i = 0
+    while i < len(args):
+        if args[i] == "--file" and i + 1 < len(args):
+            file_path = args[i + 1]
+            i += 2
+        elif args[i] == "--folder" and i + 1 < len(args):
+            folder_uid = args[i + 1]
+            i += 2
+        elif args[i] == "--title" and i + 1 < len(args):
+            title = args[i + 1]
+            i += 2
+        elif args[i] == "--message" and i + 1 < len(args):
+            message = args[i + 1]
+            i += 2
+        elif args[i] in ("--overwrite", "--force"):
+            force = True
+            i += 1
+        else:
+            i += 1
+    if not file_path:
+        print(
+            "Usage: create --file <path> [--folder <uid>] [--title <t>]",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+    dashboard = read_working(file_path)
+    dashboard["id"] = None
+    dashboard["uid"] = None
+    if title:
+        dashboard["title"] = title
+
+    if ops:
+        result = ops.create(
+            dashboard, folder_uid=folder_uid, message=message or "Created via CLI"
+        )
+    else:
+        result = client.save_dashboard(
+            dashboard,
+            folder_uid=folder_uid,
+            message=message or "Created via CLI",
+            overwrite=force,
+        )
+    _pp(result)
+
+
+def cmd_update(
+    client: GrafanaClient,
+    args: list[str],
+    *,
+    ops: DashboardOps | None = None,
+    **_kw: Any,
+) -> None:
+    """Update dashboard. Usage: update <uid> --file <path> [--message <m>] [--force]"""
+    if not args:
+        print("Usage: update <uid> --file <path>", file=sys.stderr)
+        sys.exit(1)
+    uid = args[0]
+    file_path = message = None
+    force = False
+    i = 1
+    while i < len(args):
+        if args[i] == "--file" and i + 1 < len(args):
+            file_path = args[i + 1]
+            i += 2
+        elif args[i] == "--message" and i + 1 < len(args):
+            message = args[i + 1]
+            i += 2
+        elif args[i] in ("--overwrite", "--force"):
+            force = True
+            i += 1
+        else:
+            i += 1
+    if not file_path:
+        print("--file required", file=sys.stderr)
+        sys.exit(1)
+
+    # 1. Read local file and normalize
+    dashboard = read_working(file_path)
+    dashboard["uid"] = uid
+
+    # 2. Check for .base.json sidecar
+    base_info = read_base(file_path)
+
+    if force:
+        # --force: bypass OCC entirely
+        if ops:
+            result = ops.save_force(
+                dashboard, message=message or "Updated via CLI (force)"
+            )
+        else:
+            existing = client.get_dashboard(uid)
+            folder_uid = existing["meta"].get("folderUid")
+            result = client.save_dashboard(
+                dashboard,
+                folder_uid=folder_uid,
+                message=message or "Updated via CLI (force)",
+                overwrite=True,
+            )
+        _pp(result)
+        return
+
+    # 3. Get OCC metadata
+    if base_info:
+        base_dashboard, occ = base_info
+    else:
+        # No sidecar — fetch server version for OCC
+        if ops:
+            _, occ = ops.get(uid)
+        else:
+            existing = client.get_dashboard(uid)
+            occ = OccMeta(
+                version=existing["dashboard"].get("version"), api_mode="legacy"
+            )
+        base_dashboard = None
+
+    # 4. Attempt save with OCC
+    if ops:
+        folder_uid = None
+        if ops.api_mode == "legacy":
+            try:
+                _, _, raw = ops.get_raw(uid)
+                folder_uid = raw.get("meta", {}).get("folderUid")
+            except GrafanaAPIError:
+                pass
+    else:
+        existing = client.get_dashboard(uid)
+        folder_uid = existing["meta"].get("folderUid")
+        dashboard["version"] = occ.version
+
+    try:
+        if ops:
+            result = ops.save(
+                dashboard,
+                occ,
+                folder_uid=folder_uid,
+                message=message or "Updated via CLI",
+            )
+        else:
+            result = client.save_dashboard(
+                dashboard,
+                folder_uid=folder_uid,
+                message=message or "Updated via CLI",
+                overwrite=False,
+            )
+        _pp(result)
+    except (PreconditionFailedError, ConflictError) as exc:
+        # 5. Conflict — attempt three-way merge if we have a base
+        if base_dashboard is not None:
+            print(
+                f"Conflict detected ({exc.status_code}). Attempting three-way merge...",
+                file=sys.stderr,
+            )
+            # Fetch server version as "theirs"
+            if ops:
+                theirs, new_occ = ops.get(uid)
+            else:
+                server = client.get_dashboard(uid)
+                theirs = server["dashboard"]
+                new_occ = OccMeta(
+                    version=server["dashboard"].get("version"), api_mode="legacy"
+                )
+
+            merged, conflicts = three_way_merge(base_dashboard, dashboard, theirs)
+            merged["uid"] = uid
+
+            if conflicts:
+                print(_format_conflicts(conflicts), file=sys.stderr)
+                # Write merged result for manual resolution
+                merged_path = Path(file_path).parent / f"{uid}.merged.json"
+                merged_path.write_text(
+                    json.dumps(merged, indent=2, ensure_ascii=False) + "\n"
+                )
+                print(
+                    f"\nMerged (with conflicts) written to: {merged_path}",
+                    file=sys.stderr,
+                )
+                print(
+                    "Resolve conflicts manually, then retry with --force or update the file.",
+                    file=sys.stderr,
+                )
+                sys.exit(2)
+
+            # Clean merge — retry save
+            print("Clean merge successful. Saving merged result...", file=sys.stderr)
+            if ops:
+                result = ops.save(
+                    merged,
+                    new_occ,
+                    folder_uid=folder_uid,
+                    message=message or "Updated via CLI (auto-merged)",
+                )
+            else:
+                merged["version"] = new_occ.version
+                result = client.save_dashboard(
+                    merged,
+                    folder_uid=folder_uid,
+                    message=message or "Updated via CLI (auto-merged)",
+                    overwrite=False,
+                )
+            _pp(result)
+
+            # Update sidecar with new base
+            write_sidecar(file_path, merged, new_occ)
+        else:
+            print(
+                f"Conflict detected ({exc.status_code}), but no .base.json sidecar found.",
+                file=sys.stderr,
+            )
+            print(
+                "Re-export with: export <uid> (creates sidecar), edit, then retry.",
+                file=sys.stderr,
+            )
+            sys.exit(2)
+
+
+def cmd_delete(
+    client: GrafanaClient,
+    args: list[str],
+    *,
+    ops: DashboardOps | None = None,
+    **_kw: Any,
+) -> None:
+    """Delete dashboard. Usage: delete <uid>"""
+    if not args:
+        print("Usage: delete <uid>", file=sys.stderr)
+        sys.exit(1)
+    if ops:
+        _pp(ops.delete(args[0]))
+    else:
+        _pp(client.delete_dashboard(args[0]))
+
+
+def cmd_clone(client: GrafanaClient, args: list[str], **_kw: Any) -> None:
+    """Clone dashboard. Usage: clone <uid> [--title <t>] [--folder <uid>]"""
+    if not args:
+        print("Usage: clone <uid> [--title <t>] [--folder <uid>]", file=sys.stderr)
+        sys.exit(1)
+    uid = args[0]
+    title = folder_uid = None
+    i = 1
+    while i < len(args):
+        if args[i] == "--title" and i + 1 < len(args):
+            title = args[i + 1]
+            i += 2
+        elif args[i] == "--folder" and i + 1 < len(args):
+            folder_uid = args[i + 1]
+            i += 2
+        else:
+            i += 1
+    source = client.get_dashboard(uid)
+    dashboard = source["dashboard"].copy()
+    dashboard["id"] = None
+    dashboard["uid"] = None
+    dashboard["title"] = title or f"{dashboard['title']} (Copy)"
+    result = client.save_dashboard(
+        dashboard,
+        folder_uid=folder_uid or source["meta"].get("folderUid"),
+        message=f"Cloned from {uid}",
+    )
+    _pp(result)
+
+
+def cmd_versions(client: GrafanaClient, args: list[str], **_kw: Any) -> None:
+    """List dashboard versions. Usage: versions <uid> [--limit <n>]"""
+    if not args:
+        print("Usage: versions <uid>", file=sys.stderr)
+        sys.exit(1)
+    limit = 20
+    if "--limit" in args:
+        idx = args.index("--limit")
+        limit = int(args[idx + 1]) if idx + 1 < len(args) else 20
+    versions = client.get_dashboard_versions(args[0], limit=limit)
+    print(f"\nVersions ({len(versions)}):\n" + "-" * 72)
+    for v in versions:
+        restored = (
+            f" (restored from v{v['restoredFrom']})"
+            if v.get("restoredFrom", 0) > 0
+            else ""
+        )
+        print(
+            f"  v{v['version']:>3}  {v.get('created', '?')}  by {v.get('createdBy', '?')}  {v.get('message', '')}{restored}"
+        )
+    print("-" * 72)
+
+
+def cmd_restore(client: GrafanaClient, args: list[str], **_kw: Any) -> None:
+    """Restore dashboard version. Usage: restore <uid> --version <n>"""
+    if not args:
+        print("Usage: restore <uid> --version <n>", file=sys.stderr)
+        sys.exit(1)
+    uid = args[0]
+    version = None
+    if "--version" in args:
+        idx = args.index("--version")
+        version = int(args[idx + 1]) if idx + 1 < len(args) else None
+    if version is None:
+        print("--version required", file=sys.stderr)
+        sys.exit(1)
+    _pp(client.restore_dashboard_version(uid, version))
+
+
+def cmd_folders(client: GrafanaClient, args: list[str], **_kw: Any) -> None:
+    """List folders. Usage: folders [--json]"""
+    as_json = "--json" in args
+    folders = client.list_folders()
+    if as_json:
+        _pp(folders)
+    else:
+        print(f"\nFolders ({len(folders)}):\n" + "-" * 72)
+        for f in folders:
+            print(f"  {f['uid']:20s}  {f['title']}")
+        print("-" * 72)
+
+
+def cmd_datasources(client: GrafanaClient, args: list[str], **_kw: Any) -> None:
+    """List datasources. Usage: datasources [--json]"""
+    as_json = "--json" in args
+    sources = client.list_datasources()
+    if as_json:
+        _pp(sources)
+    else:
+        print(f"\nDatasources ({len(sources)}):\n" + "-" * 72)
+        for s in sources:
+            default = " (default)" if s.get("isDefault") else ""
+            print(f"  {s.get('uid', '?'):20s}  {s['name']:30s}  {s['type']}{default}")
+        print("-" * 72)
+
+
+def cmd_cache(_client: GrafanaClient | None, args: list[str], **_kw: Any) -> None:
+    """Inspect or clear the local caches (offline).
+
+    Usage: cache info | cache clear [queries|metadata|validate|index|all]
+    """
+    import shutil
+
+    root = _cache_dir()
+    kinds = {
+        "queries": root / "queries",
+        "metadata": root / "metadata",
+        "validate": root / "validate",
+        "index": root / "index",
+    }
+    action = args[0] if args else "info"
+    if action == "info":
+        print(f"Cache directory: {root}")
+        for name, path in kinds.items():
+            files = [p for p in path.rglob("*") if p.is_file()] if path.exists() else []
+            size = sum(p.stat().st_size for p in files)
+            print(
+                f"  {name:10s} {len(files):6d} file(s)  {size / 1024 / 1024:8.1f} MiB"
+            )
+    elif action == "clear":
+        which = args[1] if len(args) > 1 else "all"
+        if which not in (*kinds, "all"):
+            print(
+                "Usage: cache clear [queries|metadata|validate|index|all]",
+                file=sys.stderr,
+            )
+            sys.exit(1)
+        for name, path in kinds.items():
+            if which in (name, "all") and path.exists():
+                shutil.rmtree(path)
+                print(f"Cleared {name} cache: {path}")
+    else:
+        print(
+            "Usage: cache info | cache clear [queries|metadata|validate|index|all]",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+
+def cmd_index(
+    client: GrafanaClient,
+    args: list[str],
+    *,
+    ops: DashboardOps | None = None,
+    **_kw: Any,
+) -> None:
+    """Build or refresh the local dashboard index used by ``find``.
+
+    Usage: index [--full] [--parallel <n>] [--json]
+    """
+    import time as _time
+
+    parallel = 8
+    full = as_json = False
+    i = 0
+    while i < len(args):
+        a = args[i]
+        if a == "--parallel" and i + 1 < len(args):
+            parallel = int(args[i + 1])
+            i += 2
+        elif a == "--full":
+            full = True
+            i += 1
+        elif a == "--json":
+            as_json = True
+            i += 1
+        else:
+            i += 1
+
+    ops = ops or DashboardOps(client)
+    started = _time.perf_counter()
+    index = DashboardIndex(_index_path(client.base_url, client.org_id, client.token))
+    try:
+        summary = _refresh_index(client, ops, index, parallel=parallel, full=full)
+    finally:
+        index.close()
+    summary["path"] = str(index.path)
+    summary["seconds"] = round(_time.perf_counter() - started, 2)
+    if as_json:
+        _pp(summary)
+        return
+    print(
+        f"Indexed {summary['indexed']} changed dashboard(s), "
+        f"{summary['unchanged']} unchanged, {summary['removed']} removed "
+        f"in {summary['seconds']}s: {summary['path']}"
+    )
+    if summary["failed"]:
+        print(f"{len(summary['failed'])} dashboard(s) failed.", file=sys.stderr)
+        sys.exit(1)
+
+
+def _index_files() -> list[Path]:
+    """Index of the configured instance and token, or all without GRAFANA_URL."""
+    url = os.environ.get("GRAFANA_URL")
+    if url:
+        org = os.environ.get("GRAFANA_ORG_ID")
+        path = _index_path(
+            url.rstrip("/"), int(org) if org else None, os.environ.get("GRAFANA_TOKEN")
+        )
+        return [path] if path.exists() else []
+    root = _cache_dir() / "index"
+    return sorted(root.glob("*.sqlite")) if root.exists() else []
+
+
+def _snippet(text: str, needle: str | None, width: int = 120) -> str:
+    """The line of ``text`` containing ``needle`` (else the first), shortened."""
+    lines = [line.strip() for line in (text or "").splitlines() if line.strip()]
+    line = next(
+        (l for l in lines if needle and needle.lower() in l.lower()),
+        lines[0] if lines else "",
+    )
+    return line if len(line) <= width else line[: width - 1] + "…"
+
+
+def cmd_find(_client: Any, args: list[str], **_kw: Any) -> None:
+    """Look up dashboards, panels, targets and variables in the local index (offline).
+
+    Usage: find [text] [--metric name] [--label name] [--datasource uid|type]
+                [--variable name] [--kind dashboard|panel|target|variable]
+                [--limit n] [--json]
+
+    ``text`` matches any substring; ``--metric`` and ``--label`` match
+    whole metric and label names inside target queries.
+    """
+    import re
+    import time as _time
+
+    text = metric = label = datasource = variable = kind = None
+    limit = 100
+    as_json = False
+    i = 0
+    while i < len(args):
+        a = args[i]
+        if a == "--metric" and i + 1 < len(args):
+            metric = args[i + 1]
+            i += 2
+        elif a == "--label" and i + 1 < len(args):
+            label = args[i + 1]
+            i += 2
+        elif a == "--datasource" and i + 1 < len(args):
+            datasource = args[i + 1]
+            i += 2
+        elif a == "--variable" and i + 1 < len(args):
+            variable = args[i + 1]
+            i += 2
+        elif a == "--kind" and i + 1 < len(args):
+            kind = args[i + 1]
+            i += 2
+        elif a == "--limit" and i + 1 < len(args):
+            limit = int(args[i + 1])
+            i += 2
+        elif a == "--json":
+            as_json = True
+            i += 1
+        elif not a.startswith("--") and text is None:
+            text = a
+            i += 1
+        else:
+            i += 1
+
+    if not any((text, metric, label, datasource, variable, kind)):
+        print(
+            "Usage: find [text] [--metric m] [--label l] [--datasource ds] "
+            "[--variable v] [--kind k] [--json]",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+    paths = _index_files()
+    if not paths:
+        print(
+            "No dashboard index found; build it with: grafana.sh index",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+    # Whole-name matches on top of the substring lookup, as PromQL/LogQL
+    # name metrics and labels: `metric{`, `metric[`, `label="..."`, `by (label)`.
+    checks = []
+    if metric:
+        name = re.escape(metric)
+        checks.append(re.compile(rf"(?<![\w:]){name}(?![\w:])"))
+    if label:
+        name = re.escape(label)
+        checks.append(
+            re.compile(
+                rf"(?<![\w.]){name}\s*(=~|!~|!=|=)|"
+                rf"\b(by|without|on|ignoring|group_left|group_right)\s*\([^)]*\b{name}\b"
+            )
+        )
+    term = metric or label or text
+    if metric or label:
+        kind = kind or "target"
+    if variable:
+        kind = kind or "variable"
+    post_filter = bool(checks) or term != text
+
+    started = _time.perf_counter()
+    matches: list[dict] = []
+    for path in paths:
+        index = DashboardIndex(path)
+        try:
+            url = index.meta("url")
+            rows = index.find(
+                term,
+                kind=kind,
+                name=variable,
+                datasource=datasource,
+                limit=0 if post_filter else limit,
+            )
+        finally:
+            index.close()
+        for row in rows:
+            body = row["text"] or ""
+            if not all(c.search(body) for c in checks):
+                continue
+            if text and term != text and text.lower() not in body.lower():
+                continue
+            row["instance"] = url
+            matches.append(row)
+    matches = matches[:limit] if limit else matches
+    elapsed_ms = (_time.perf_counter() - started) * 1000
+
+    if as_json:
+        _pp(matches)
+    else:
+        needle = metric or label or text
+        for row in matches:
+            where = row["dashboard_title"] or row["uid"]
+            if row["panel_id"] is not None:
+                where += f" › [{row['panel_id']}] {row['panel_title'] or ''}"
+            kind_name = row["kind"] + (f" {row['name']}" if row["name"] else "")
+            ds = f"  ({row['datasource']})" if row["datasource"] else ""
+            print(f"{row['uid']}  {where}  {kind_name}{ds}")
+            if row["kind"] in ("target", "variable"):
+                print(f"    {_snippet(row['text'], needle)}")
+    print(f"{len(matches)} match(es) in {elapsed_ms:.0f} ms", file=sys.stderr)
+
+
+def cmd_annotations(client: GrafanaClient, args: list[str], **_kw: Any) -> None:
+    """Query annotations. Usage: annotations [--dashboard <uid>] [--tag <t>] [--limit <n>] [--json]"""
+    dashboard_uid = None
+    tags: list[str] = []
+    limit = 100
+    as_json = False
+    i = 0
+    while i < len(args):
+        if args[i] == "--dashboard" and i + 1 < len(args):
+            dashboard_uid = args[i + 1]
+            i += 2
+        elif args[i] == "--tag" and i + 1 < len(args):
+            tags.append(args[i + 1])
+            i += 2
+        elif args[i] == "--limit" and i + 1 < len(args):
+            limit = int(args[i + 1])
+            i += 2
+        elif args[i] == "--json":
+            as_json = True
+            i += 1
+        else:
+            i += 1
+    result = client.query_annotations(
+        dashboard_uid=dashboard_uid, tags=tags or None, limit=limit
+    )
+    if as_json:
+        _pp(result)
+    else:
+        print(f"\nAnnotations ({len(result)}):\n" + "-" * 72)
+        for a in result:
+            tag_str = f" [{', '.join(a.get('tags', []))}]" if a.get("tags") else ""
+            print(f"  {a.get('id', '?'):>6}  {a.get('text', '')[:60]}{tag_str}")
+        print("-" * 72)
+
+
+def cmd_alerts(client: GrafanaClient, args: list[str], **_kw: Any) -> None:
+    """List alert rules. Usage: alerts [--active] [--json]"""
+    as_json = "--json" in args
+    show_active = "--active" in args
+    if show_active:
+        result = client.get_active_alerts()
+    else:
+        result = client.list_alert_rules()
+    if as_json:
+        _pp(result)
+    else:
+        print(
+            f"\n{'Active alerts' if show_active else 'Alert rules'} ({len(result)}):\n"
+            + "-" * 72
+        )
+        for r in result:
+            title = r.get("title") or r.get("labels", {}).get("alertname", "?")
+            state = r.get("status", {}).get("state", "") if show_active else ""
+            if state:
+                state = f" [{state}]"
+            print(f"  {r.get('uid', '?'):20s}  {title}{state}")
+        print("-" * 72)
+
+
+def cmd_user(client: GrafanaClient, _args: list[str], **_kw: Any) -> None:
+    _pp(client.get_current_user())
+
+
+def cmd_org(client: GrafanaClient, _args: list[str], **_kw: Any) -> None:
+    _pp(client.get_current_org())
+
+
+def cmd_raw(client: GrafanaClient, args: list[str], **_kw: Any) -> None:
+    """Raw API call. Usage: raw <METHOD> <endpoint> [--body <json>]"""
+    if len(args) < 2:
+        print(
+            "Usage: raw <GET|POST|PUT|DELETE> <endpoint> [--body <json>]",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+    method = args[0].upper()
+    endpoint = args[1]
+    json_body = None
+    if "--body" in args:
+        idx = args.index("--body")
+        json_body = json.loads(args[idx + 1]) if idx + 1 < len(args) else None
+    result = client._request(method, endpoint, json_body=json_body)
+    _pp(result)
+
+
+# -- New commands (Phase 7) -----------------------------------------------
+
+
+def cmd_diff(
+    client: GrafanaClient,
+    args: list[str],
+    *,
+    ops: DashboardOps | None = None,
+    **_kw: Any,
+) -> None:
+    """Structural diff: local file vs server.
+
+    Usage: diff <uid> --file <path> [--format <report|patch>] [--output <path>]
+    """
+    if not args:
+        print("Usage: diff <uid> --file <path>", file=sys.stderr)
+        sys.exit(1)
+    uid = args[0]
+    file_path = output = None
+    out_format = "report"
+    i = 1
+    while i < len(args):
+        if args[i] == "--file" and i + 1 < len(args):
+            file_path = args[i + 1]
+            i += 2
+        elif args[i] == "--format" and i + 1 < len(args):
+            out_format = args[i + 1]
+            i += 2
+        elif args[i] == "--output" and i + 1 < len(args):
+            output = args[i + 1]
+            i += 2
+        else:
+            i += 1
+    if not file_path:
+        print("--file required", file=sys.stderr)
+        sys.exit(1)
+    if out_format not in ("report", "patch"):
+        print(f"Unknown format: {out_format}. Use report or patch.", file=sys.stderr)
+        sys.exit(1)
+
+    local = read_working(file_path)
+    if ops:
+        server, _ = ops.get(uid)
+    else:
+        result = client.get_dashboard(uid)
+        server = result["dashboard"]
+
+    # Patch direction: server -> local, i.e. what an update would change.
+    changes = json_diff(server, local, ignore=_VOLATILE_FIELDS)
+    patch = [c.op for c in changes]
+
+    if output:
+        Path(output).write_text(json.dumps(patch, indent=2, ensure_ascii=False) + "\n")
+        print(f"JSON Patch ({len(patch)} operations) written to: {output}")
+        return
+    if out_format == "patch":
+        _pp(patch)
+        return
+
+    print(f"\nDiff: {file_path} vs server ({uid})\n" + "=" * 72)
+    if changes:
+        print(_format_diff_report(changes))
+        print(f"\n  {len(changes)} change(s)")
+    else:
+        print("\n  No differences found.")
+    print("=" * 72)
+
+
+def cmd_merge(
+    client: GrafanaClient,
+    args: list[str],
+    *,
+    ops: DashboardOps | None = None,
+    **_kw: Any,
+) -> None:
+    """Three-way merge. Usage: merge <uid> --file <path> [--base <path>] [--output <path>]"""
+    if not args:
+        print(
+            "Usage: merge <uid> --file <path> [--base <path>] [--output <path>]",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+    uid = args[0]
+    file_path = base_path = output = None
+    i = 1
+    while i < len(args):
+        if args[i] == "--file" and i + 1 < len(args):
+            file_path = args[i + 1]
+            i += 2
+        elif args[i] == "--base" and i + 1 < len(args):
+            base_path = args[i + 1]
+            i += 2
+        elif args[i] == "--output" and i + 1 < len(args):
+            output = args[i + 1]
+            i += 2
+        else:
+            i += 1
+    if not file_path:
+        print("--file required", file=sys.stderr)
+        sys.exit(1)
+
+    # Ours = local file
+    ours = read_working(file_path)
+
+    # Base = explicit --base, or sidecar
+    if base_path:
+        base = read_working(base_path)
+    else:
+        base_info = read_base(file_path)
+        if base_info is None:
+            print(
+                "No base found. Provide --base or export with sidecar first.",
+                file=sys.stderr,
+            )
+            sys.exit(1)
+        base, _ = base_info
+
+    # Theirs = server
+    if ops:
+        theirs, _ = ops.get(uid)
+    else:
+        result = client.get_dashboard(uid)
+        theirs = result["dashboard"]
+
+    merged, conflicts = three_way_merge(base, ours, theirs)
+    merged["uid"] = uid
+
+    out_path = output or f"{uid}.merged.json"
+    Path(out_path).write_text(json.dumps(merged, indent=2, ensure_ascii=False) + "\n")
+
+    if conflicts:
+        print(_format_conflicts(conflicts), file=sys.stderr)
+        print(f"\nMerged (with conflicts) written to: {out_path}")
+        sys.exit(2)
+    else:
+        print(f"Clean merge written to: {out_path}")
+
+
+def cmd_convert(client: GrafanaClient, args: list[str], **_kw: Any) -> None:
+    """Convert dashboard format. Usage: convert --file <path> --to <legacy|k8s> [--output <path>]"""
+    file_path = to_format = output = None
+    i = 0
+    while i < len(args):
+        if args[i] == "--file" and i + 1 < len(args):
+            file_path = args[i + 1]
+            i += 2
+        elif args[i] == "--to" and i + 1 < len(args):
+            to_format = args[i + 1]
+            i += 2
+        elif args[i] == "--output" and i + 1 < len(args):
+            output = args[i + 1]
+            i += 2
+        else:
+            i += 1
+    if not file_path or not to_format:
+        print(
+            "Usage: convert --file <path> --to <legacy|k8s> [--output <path>]",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+    if to_format not in ("legacy", "k8s"):
+        print(f"Unknown format: {to_format}. Use 'legacy' or 'k8s'.", file=sys.stderr)
+        sys.exit(1)
+
+    data = json.loads(Path(file_path).read_text())
+    # Strip sidecar metadata if present
+    data.pop("_occ_meta", None)
+    current_format = detect_format(data)
+
+    if current_format == to_format:
+        print(f"File is already in {to_format} format.")
+        return
+
+    if to_format == "k8s":
+        # Legacy to K8s
+        # Handle wrapped legacy format
+        if "dashboard" in data and "meta" in data:
+            dashboard = data["dashboard"]
+        else:
+            dashboard = data
+        result = legacy_to_k8s(dashboard)
+    else:
+        # K8s to legacy
+        result = k8s_to_legacy(data)
+
+    out_path = output or file_path
+    Path(out_path).write_text(json.dumps(result, indent=2, ensure_ascii=False) + "\n")
+    print(f"Converted {current_format} → {to_format}: {out_path}")
+
+
+def cmd_validate(_client: Any, args: list[str], **_kw: Any) -> None:
+    """Validate dashboard JSON or YAML files.
+
+    Usage: validate --file <path> [--format auto|legacy|v2beta1] [--strict] [--json]
+           validate <path|dir>... [--format ...] [--strict] [--jobs N] [--no-cache]
+
+    With several files or any directory, files are validated in parallel and
+    results are streamed as JSONL (see ``_validate_many``).
+    """
+    paths: list[str] = []
+    fmt_override = None
+    strict = output_json = False
+    no_cache = False
+    jobs = os.cpu_count() or 1
+    i = 0
+    while i < len(args):
+        if args[i] == "--file" and i + 1 < len(args):
+            paths.append(args[i + 1])
+            i += 2
+        elif args[i] == "--format" and i + 1 < len(args):
+            fmt_override = args[i + 1]
+            i += 2
+        elif args[i] == "--strict":
+            strict = True
+            i += 1
+        elif args[i] == "--json":
+            output_json = True
+            i += 1
+        elif args[i] in ("--jobs", "-j") and i + 1 < len(args):
+            jobs = int(args[i + 1])
+            i += 2
+        elif args[i] == "--no-cache":
+            no_cache = True
+            i += 1
+        elif not args[i].startswith("-"):
+            paths.append(args[i])
+            i += 1
+        else:
+            i += 1
+    if not paths:
+        print(
+            "Usage: validate --file <path> [--format auto|legacy|v2beta1] [--strict] [--json]\n"
+            "       validate <path|dir>... [--format ...] [--strict] [--jobs N] [--no-cache]",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+    if fmt_override not in (None, "auto", "legacy", "v2beta1", "k8s"):
+        print(
+            f"Unknown format: {fmt_override}. Use 'auto', 'legacy', or 'v2beta1'.",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+    if len(paths) > 1 or Path(paths[0]).is_dir():
+        _validate_many(
+            paths, fmt_override, strict=strict, jobs=jobs, use_cache=not no_cache
+        )
+        return
+
+    data = _load_dashboard_file(Path(paths[0]))
+    if not isinstance(data, dict):
+        print("ERROR: file must contain a JSON/YAML object", file=sys.stderr)
+        sys.exit(1)
+    try:
+        display_fmt, issues = _validate_data(data, fmt_override)
+    except ValueError as exc:
+        print(str(exc), file=sys.stderr)
+        sys.exit(1)
+
+    # Output
+    if output_json:
+        print(_format_issues_json(display_fmt, issues))
+    else:
+        print(_format_issues_text(display_fmt, issues))
+
+    # Exit code
+    errors = [i for i in issues if i.level == "error"]
+    warnings = [i for i in issues if i.level == "warning"]
+    if errors or (strict and warnings):
+        sys.exit(1)
+
+
+def cmd_query(client: GrafanaClient, args: list[str], **_kw: Any) -> None:
+    """Execute a datasource query.
+
+    Usage:
+      query <ds_uid> --expr <promql|logql>  [options]
+      query <ds_uid> --raw-sql <sql>        [options]
+      query <ds_uid> --query <json>         [options]
+
+    ``--step`` sets the query resolution; with ``--aggregate`` the values in
+    each step are aggregated on the datasource where the query can be
+    rewritten (PromQL ``*_over_time``, SQL ``$__timeGroupAlias``), and
+    locally over the decoded frames otherwise.
+    """
+    if not args:
+        print(
+            "Usage: query <ds_uid> --expr <expr> | --raw-sql <sql> | --query <json> [options]",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+    ds_uid = args[0]
+    expr = raw_sql = raw_query = ds_type = ref_id = fmt = output = output_dir = None
+    time_from = "now-1h"
+    time_to = "now"
+    max_data_points = 1000
+    interval_ms = 15000
+    instant = False
+    preview: int | None = None
+    as_json = False
+    chunk: str | None = None
+    parallel = 4
+    no_cache = refresh = False
+    transforms: list[str] = []
+    step: str | None = None
+    aggregate: str | None = None
+    pushdown = True
+    stream = False
+    i = 1
+    while i < len(args):
+        a = args[i]
+        if a == "--expr" and i + 1 < len(args):
+            expr = args[i + 1]
+            i += 2
+        elif a == "--raw-sql" and i + 1 < len(args):
+            raw_sql = args[i + 1]
+            i += 2
+        elif a == "--query" and i + 1 < len(args):
+            raw_query = args[i + 1]
+            i += 2
+        elif a == "--type" and i + 1 < len(args):
+            ds_type = args[i + 1]
+            i += 2
+        elif a == "--from" and i + 1 < len(args):
+            time_from = args[i + 1]
+            i += 2
+        elif a == "--to" and i + 1 < len(args):
+            time_to = args[i + 1]
+            i += 2
+        elif a == "--format" and i + 1 < len(args):
+            fmt = args[i + 1]
+            i += 2
+        elif a == "--output" and i + 1 < len(args):
+            output = args[i + 1]
+            i += 2
+        elif a == "--output-dir" and i + 1 < len(args):
+            output_dir = args[i + 1]
+            i += 2
+        elif a == "--max-data-points" and i + 1 < len(args):
+            max_data_points = int(args[i + 1])
+            i += 2
+        elif a == "--interval-ms" and i + 1 < len(args):
+            interval_ms = int(args[i + 1])
+            i += 2
+        elif a == "--ref-id" and i + 1 < len(args):
+            ref_id = args[i + 1]
+            i += 2
+        elif a == "--preview" and i + 1 < len(args):
+            preview = int(args[i + 1])
+            i += 2
+        elif a == "--chunk" and i + 1 < len(args):
+            chunk = args[i + 1]
+            i += 2
+        elif a == "--parallel" and i + 1 < len(args):
+            parallel = int(args[i + 1])
+            i += 2
+        elif a == "--step" and i + 1 < len(args):
+            step = args[i + 1]
+            i += 2
+        elif a == "--aggregate" and i + 1 < len(args):
+            aggregate = args[i + 1]
+            i += 2
+        elif a == "--stream":
+            stream = True
+            i += 1
+        elif a == "--no-pushdown":
+            pushdown = False
+            i += 1
+        elif a == "--transform" and i + 1 < len(args):
+            transforms.append(args[i + 1])
+            i += 2
+        elif a == "--no-cache":
+            no_cache = True
+            i += 1
+        elif a == "--refresh":
+            refresh = True
+            i += 1
+        elif a == "--instant":
+            instant = True
+            i += 1
+        elif a == "--json":
+            as_json = True
+            i += 1
+        else:
+            i += 1
+
+    if not expr and not raw_sql and not raw_query:
+        print("One of --expr, --raw-sql, or --query is required.", file=sys.stderr)
+        sys.exit(1)
+    transform_steps = _parse_transforms(transforms)
+    if chunk and instant:
+        print("--chunk cannot be combined with --instant.", file=sys.stderr)
+        sys.exit(1)
+    if (step or aggregate) and instant:
+        print("--step/--aggregate cannot be combined with --instant.", file=sys.stderr)
+        sys.exit(1)
+    if aggregate and not step:
+        print("--aggregate needs --step (e.g. --step 1d).", file=sys.stderr)
+        sys.exit(1)
+    try:
+        step_ms = _parse_duration(step) if step else 0
+        agg, quantile = _parse_aggregate(aggregate) if aggregate else ("", None)
+    except ValueError as exc:
+        print(f"ERROR: {exc}", file=sys.stderr)
+        sys.exit(1)
+
+    # Auto-detect datasource type if not specified
+    if not ds_type:
+        ds_type = client.datasource_map().get(ds_uid, {}).get("type")
+    if not ds_type:
+        # Unknown to the cached map: a new datasource, or a name instead of a uid.
+        client.metadata.invalidate("datasources")
+        ds_info = client.get_datasource(ds_uid)
+        ds_type = ds_info.get("type", "prometheus")
+
+    # Build query object
+    query: dict[str, Any] = {
+        "refId": ref_id or "A",
+        "datasource": {"uid": ds_uid, "type": ds_type},
+        "maxDataPoints": max_data_points,
+        "intervalMs": interval_ms,
+    }
+
+    if raw_query:
+        query.update(json.loads(raw_query))
+    elif raw_sql:
+        query["rawSql"] = raw_sql
+        query.setdefault("format", "table")
+    elif expr:
+        query["expr"] = expr
+        if instant:
+            query["instant"] = True
+            query["range"] = False
+        else:
+            query["range"] = True
+            query["instant"] = False
+
+    pushed = None
+    range_ms = 0
+    if step:
+        import time as _time
+
+        raw_step_ms = max(interval_ms, 1)
+        try:
+            now_ms = int(_time.time() * 1000)
+            range_ms = _resolve_time(time_to, now_ms) - _resolve_time(time_from, now_ms)
+            raw_step_ms = max(raw_step_ms, range_ms // max(max_data_points, 1))
+        except ValueError:
+            pass
+        if aggregate and pushdown:
+            pushed = _pushdown_query(query, ds_type, agg, quantile, step)
+        if pushed or not aggregate:
+            # Resolution = step: the step is the minimum interval, and enough
+            # data points are allowed that Grafana does not widen it.
+            query["intervalMs"] = step_ms
+            query["interval"] = step
+            if range_ms > 0:
+                query["maxDataPoints"] = max(max_data_points, range_ms // step_ms + 1)
+
+    if stream:
+        if (
+            as_json
+            or preview is not None
+            or chunk
+            or transform_steps
+            or (aggregate and not pushed)
+        ):
+            print(
+                "--stream writes straight to a file; it cannot be combined with "
+                "--json, --preview, --chunk, --transform or local aggregation.",
+                file=sys.stderr,
+            )
+            sys.exit(1)
+        _stream_query_output(
+            client,
+            [query],
+            time_from,
+            time_to,
+            output=output,
+            output_dir=output_dir,
+            fmt=fmt,
+        )
+        return
+
+    cache = _query_cache(client, no_cache=no_cache, refresh=refresh)
+    result = _run_queries(
+        client, [query], time_from, time_to, chunk=chunk, parallel=parallel, cache=cache
+    )
+    if cache is not None:
+        cache.close()
+
+    if aggregate and pushed:
+        frames = [
+            f for r in result.get("results", {}).values() for f in r.get("frames", [])
+        ]
+        returned = _frames_row_count(frames)
+        raw = len(frames) * (range_ms // raw_step_ms + 1) if range_ms > 0 else 0
+        print(f"Aggregated on the datasource: {pushed}", file=sys.stderr)
+        if raw > returned:
+            print(
+                f"{returned} points returned instead of ~{raw} at the raw step "
+                f"(~{raw - returned} saved)",
+                file=sys.stderr,
+            )
+    elif aggregate:
+        before, after = _aggregate_result(result, step_ms, agg, quantile)
+        how = "requested" if not pushdown else f"no pushdown for {ds_type}"
+        print(
+            f"Aggregated locally ({how}): {before} -> {after} points "
+            f"({before - after} saved downstream)",
+            file=sys.stderr,
+        )
+
+    result = _apply_transforms(result, transform_steps)
+    ref_ids = list(result.get("results", {}).keys())
+    _handle_query_output(
+        result,
+        ref_ids,
+        as_json=as_json,
+        preview=preview,
+        output=output,
+        output_dir=output_dir,
+        fmt=fmt,
+    )
+
+
+def cmd_logs_export(client: GrafanaClient, args: list[str], **_kw: Any) -> None:
+    """Export every log line of a LogQL query, paging by time cursor.
+
+    Usage: logs-export <ds_uid> --expr <logql> [--from t] [--to t] [--limit n]
+             [--shard <matcher>]... [--shard-by <label>] [--parallel n]
+             [--format jsonl|parquet] [--output path | --output-dir dir]
+
+    Each shard (the expression with one more label matcher) gets its own
+    cursor; cursors run concurrently and their pages are written as they
+    arrive, so lines are in time order within a shard only.
+    """
+    if not args or args[0].startswith("--"):
+        print(
+            "Usage: logs-export <ds_uid> --expr <logql> [--from t] [--to t] [options]",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+    ds_uid = args[0]
+    expr = fmt = output = output_dir = shard_by = None
+    time_from = "now-1h"
+    time_to = "now"
+    limit = _LOG_PAGE_LIMIT
+    parallel = 4
+    shards: list[str] = []
+    i = 1
+    while i < len(args):
+        a = args[i]
+        if a == "--expr" and i + 1 < len(args):
+            expr = args[i + 1]
+            i += 2
+        elif a == "--from" and i + 1 < len(args):
+            time_from = args[i + 1]
+            i += 2
+        elif a == "--to" and i + 1 < len(args):
+            time_to = args[i + 1]
+            i += 2
+        elif a == "--limit" and i + 1 < len(args):
+            limit = int(args[i + 1])
+            i += 2
+        elif a == "--shard" and i + 1 < len(args):
+            shards.append(args[i + 1])
+            i += 2
+        elif a == "--shard-by" and i + 1 < len(args):
+            shard_by = args[i + 1]
+            i += 2
+        elif a == "--parallel" and i + 1 < len(args):
+            parallel = int(args[i + 1])
+            i += 2
+        elif a == "--format" and i + 1 < len(args):
+            fmt = args[i + 1]
+            i += 2
+        elif a == "--output" and i + 1 < len(args):
+            output = args[i + 1]
+            i += 2
+        elif a == "--output-dir" and i + 1 < len(args):
+            output_dir = args[i + 1]
+            i += 2
+        else:
+            i += 1
+
+    if not expr:
+        print("--expr <logql> is required.", file=sys.stderr)
+        sys.exit(1)
+    if shards and shard_by:
+        print("Use either --shard or --shard-by, not both.", file=sys.stderr)
+        sys.exit(1)
+    fmt = fmt or (output and _format_from_path(output)) or "parquet"
+    if fmt not in ("jsonl", "parquet"):
+        print(f"Unknown format: {fmt}. Use jsonl or parquet.", file=sys.stderr)
+        sys.exit(1)
+    if limit <= 0:
+        print("--limit must be positive.", file=sys.stderr)
+        sys.exit(1)
+
+    import time as _time
+
+    try:
+        now_ms = int(_time.time() * 1000)
+        from_ms = _resolve_time(time_from, now_ms)
+        to_ms = _resolve_time(time_to, now_ms)
+        _selector_span(expr)
+    except ValueError as exc:
+        print(f"ERROR: {exc}", file=sys.stderr)
+        sys.exit(1)
+    if from_ms >= to_ms:
+        print("ERROR: --from must be before --to", file=sys.stderr)
+        sys.exit(1)
+
+    if shard_by:
+        shards = _shard_matchers(client, ds_uid, expr, shard_by, from_ms, to_ms)
+        print(f"Sharding by {shard_by}: {len(shards)} shard(s)", file=sys.stderr)
+    ds_type = client.datasource_map().get(ds_uid, {}).get("type", "loki")
+    cursors = []
+    for matcher in shards or [""]:
+        query = {
+            "refId": "A",
+            "datasource": {"uid": ds_uid, "type": ds_type},
+            "expr": _shard_expr(expr, matcher) if matcher else expr,
+            "queryType": "range",
+        }
+        cursors.append(LogCursor(client, query, from_ms, to_ms, limit, matcher))
+
+    path = output or _auto_output_path(
+        output_dir, "grafana_logs", _EXPORT_EXTENSIONS[fmt]
+    )
+    sink = LogSink(fmt, path)
+    _export_logs(cursors, sink, parallel)
+
+    if len(cursors) > 1:
+        for c in cursors:
+            print(f"  {c.name}: {c.lines} lines, {c.pages} page(s)", file=sys.stderr)
+    pages = sum(c.pages for c in cursors)
+    duplicates = sum(c.duplicates for c in cursors)
+    skipped = sum(c.skipped_ms for c in cursors)
+    if not sink.rows:
+        os.unlink(path)
+        print("No log lines in range", file=sys.stderr)
+        return
+    print(
+        f"Exported {sink.rows} lines from {pages} page(s) "
+        f"({duplicates} boundary duplicates dropped"
+        f"{f', {skipped} overfull ms skipped' if skipped else ''}): {path}",
+        file=sys.stderr,
+    )
+
+
+def cmd_panel_query(client: GrafanaClient, args: list[str], **_kw: Any) -> None:
+    """Execute queries from a dashboard panel.
+
+    Usage: panel-query <dashboard_uid> <panel_id> [options]
+
+    ``--var-all NAME`` (or ``NAME=a,b,c``) sweeps the panel across all
+    values of a variable; several sweeps form a matrix. The combinations run
+    in parallel and land in one output with a column per swept variable.
+    """
+    if len(args) < 2:
+        print(
+            "Usage: panel-query <dashboard_uid> <panel_id> [options]", file=sys.stderr
+        )
+        sys.exit(1)
+
+    dashboard_uid = args[0]
+    panel_id = int(args[1])
+    time_from = "now-1h"
+    time_to = "now"
+    variables: Variables = {}
+    fmt = output = output_dir = None
+    preview: int | None = None
+    as_json = False
+    chunk: str | None = None
+    parallel = 4
+    no_cache = refresh = False
+    transforms: list[str] = []
+    sweep: dict[str, list[str] | None] = {}
+    i = 2
+    while i < len(args):
+        a = args[i]
+        if a == "--from" and i + 1 < len(args):
+            time_from = args[i + 1]
+            i += 2
+        elif a == "--to" and i + 1 < len(args):
+            time_to = args[i + 1]
+            i += 2
+        elif a == "--var" and i + 1 < len(args):
+            _add_variable(variables, args[i + 1])
+            i += 2
+        elif a == "--var-all" and i + 1 < len(args):
+            k, sep, v = args[i + 1].partition("=")
+            sweep[k] = _custom_options(v) if sep else None
+            i += 2
+        elif a == "--format" and i + 1 < len(args):
+            fmt = args[i + 1]
+            i += 2
+        elif a == "--output" and i + 1 < len(args):
+            output = args[i + 1]
+            i += 2
+        elif a == "--output-dir" and i + 1 < len(args):
+            output_dir = args[i + 1]
+            i += 2
+        elif a == "--preview" and i + 1 < len(args):
+            preview = int(args[i + 1])
+            i += 2
+        elif a == "--chunk" and i + 1 < len(args):
+            chunk = args[i + 1]
+            i += 2
+        elif a == "--parallel" and i + 1 < len(args):
+            parallel = int(args[i + 1])
+            i += 2
+        elif a == "--transform" and i + 1 < len(args):
+            transforms.append(args[i + 1])
+            i += 2
+        elif a == "--no-cache":
+            no_cache = True
+            i += 1
+        elif a == "--refresh":
+            refresh = True
+            i += 1
+        elif a == "--json":
+            as_json = True
+            i += 1
+        else:
+            i += 1
+    transform_steps = _parse_transforms(transforms)
+    if sweep and chunk:
+        print("--var-all cannot be combined with --chunk.", file=sys.stderr)
+        sys.exit(1)
+
+    # Fetch dashboard and find panel
+    dash_data = client.get_dashboard(dashboard_uid)
+    all_panels = _flatten_panels(dash_data.get("dashboard", {}))
+
+    target_panel = None
+    for panel in all_panels:
+        if panel.get("id") == panel_id:
+            target_panel = panel
+            break
+
+    if not target_panel:
+        print(
+            f"Panel {panel_id} not found in dashboard {dashboard_uid}", file=sys.stderr
+        )
+        sys.exit(1)
+
+    targets = target_panel.get("targets", [])
+    if not targets:
+        print(f"Panel {panel_id} has no query targets.", file=sys.stderr)
+        sys.exit(1)
+
+    cache = _query_cache(client, no_cache=no_cache, refresh=refresh)
+    failed = 0
+    if sweep:
+        try:
+            result, failed = _panel_matrix(
+                client,
+                dashboard_uid,
+                dash_data.get("dashboard", {}),
+                target_panel,
+                variables,
+                sweep,
+                time_from,
+                time_to,
+                parallel=parallel,
+                cache=cache,
+            )
+        except ValueError as exc:
+            print(f"ERROR: {exc}", file=sys.stderr)
+            sys.exit(1)
+    else:
+        queries = _panel_queries(target_panel, variables)
+        result = _run_queries(
+            client,
+            queries,
+            time_from,
+            time_to,
+            chunk=chunk,
+            parallel=parallel,
+            cache=cache,
+        )
+    if cache is not None:
+        cache.close()
+
+    result = _apply_transforms(result, transform_steps)
+    ref_ids = list(result.get("results", {}).keys())
+    _handle_query_output(
+        result,
+        ref_ids,
+        as_json=as_json,
+        preview=preview,
+        output=output,
+        output_dir=output_dir,
+        fmt=fmt,
+    )
+    if failed:
+        print(f"{failed} query(ies) failed.", file=sys.stderr)
+        sys.exit(1)
+
+
+def cmd_panel_list(client: GrafanaClient, args: list[str], **_kw: Any) -> None:
+    """List panels in a dashboard.
+
+    Usage: panel-list <dashboard_uid> [--json]
+    """
+    if not args:
+        print("Usage: panel-list <dashboard_uid> [--json]", file=sys.stderr)
+        sys.exit(1)
+
+    dashboard_uid = args[0]
+    as_json = "--json" in args
+
+    dash_data = client.get_dashboard(dashboard_uid)
+    all_panels = _flatten_panels(dash_data.get("dashboard", {}))
+
+    if as_json:
+        _pp(
+            [
+                {
+                    "id": p.get("id"),
+                    "title": p.get("title", ""),
+                    "type": p.get("type", ""),
+                    "datasource": p.get("datasource"),
+                    "targets": len(p.get("targets", [])),
+                }
+                for p in all_panels
+            ]
+        )
+    else:
+        print(f"\nPanels ({len(all_panels)}):\n" + "-" * 72)
+        for p in all_panels:
+            ds = p.get("datasource")
+            ds_str = ""
+            if isinstance(ds, dict):
+                ds_str = ds.get("uid", ds.get("type", ""))
+            elif isinstance(ds, str):
+                ds_str = ds
+            targets = len(p.get("targets", []))
+            print(
+                f"  {p.get('id', '?'):>4}  {p.get('title', ''):40s}  {p.get('type', ''):16s}  {ds_str}  ({targets} queries)"
+            )
+        print("-" * 72)
+
+
+def cmd_dashboard_query(client: GrafanaClient, args: list[str], **_kw: Any) -> None:
+    """Run the queries of every panel on one or more dashboards.
+
+    Usage: dashboard-query <dashboard_uid> [<dashboard_uid>...] [options]
+    """
+    uids = []
+    for a in args:
+        if a.startswith("--"):
+            break
+        uids.append(a)
+    if not uids:
+        print(
+            "Usage: dashboard-query <dashboard_uid> [<dashboard_uid>...] [options]",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+    time_from = time_to = None
+    variables: Variables = {}
+    fmt = "parquet"
+    output_dir: str | None = None
+    parallel = 4
+    no_cache = refresh = as_json = False
+    i = len(uids)
+    while i < len(args):
+        a = args[i]
+        if a == "--from" and i + 1 < len(args):
+            time_from = args[i + 1]
+            i += 2
+        elif a == "--to" and i + 1 < len(args):
+            time_to = args[i + 1]
+            i += 2
+        elif a == "--var" and i + 1 < len(args):
+            _add_variable(variables, args[i + 1])
+            i += 2
+        elif a == "--format" and i + 1 < len(args):
+            fmt = args[i + 1]
+            i += 2
+        elif a == "--output-dir" and i + 1 < len(args):
+            output_dir = args[i + 1]
+            i += 2
+        elif a == "--parallel" and i + 1 < len(args):
+            parallel = int(args[i + 1])
+            i += 2
+        elif a == "--no-cache":
+            no_cache = True
+            i += 1
+        elif a == "--refresh":
+            refresh = True
+            i += 1
+        elif a == "--json":
+            as_json = True
+            i += 1
+        else:
+            i += 1
+
+    if fmt not in _EXPORT_EXTENSIONS:
+        print(
+            f"Unknown format: {fmt}. Use {', '.join(_EXPORT_EXTENSIONS)}.",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+    if fmt in _ARROW_FORMATS:
+        _require_pyarrow(fmt)
+    if not output_dir:
+        import tempfile
+
+        output_dir = tempfile.mkdtemp(prefix="grafana_dashboards_")
+
+    import itertools
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=max(1, parallel)) as pool:
+        dashboards = list(pool.map(client.get_dashboard, uids))
+
+    counter = itertools.count()
+    jobs: list[PanelJob] = []
+    for uid, dash_data in zip(uids, dashboards):
+        jobs.extend(
+            _dashboard_jobs(
+                uid,
+                dash_data.get("dashboard", {}),
+                variables,
+                time_from,
+                time_to,
+                counter,
+            )
+        )
+    if not jobs:
+        print("No panels with query targets found.", file=sys.stderr)
+        sys.exit(1)
+
+    cache = _query_cache(client, no_cache=no_cache, refresh=refresh)
+    panel_results = _run_panel_jobs(client, jobs, parallel=parallel, cache=cache)
+    if cache is not None:
+        cache.close()
+
+    index: list[dict] = []
+    failed = 0
+    for job, panel_result in zip(jobs, panel_results):
+        panel_id = job.panel.get("id")
+        title = job.panel.get("title", "")
+        slug = _safe_name(title)
+        dash_dir = os.path.join(output_dir, job.dashboard_uid)
+        os.makedirs(dash_dir, exist_ok=True)
+        path = os.path.join(
+            dash_dir, f"panel-{panel_id}_{slug or 'untitled'}.{_EXPORT_EXTENSIONS[fmt]}"
+        )
+        frames = panel_result["frames"]
+        exported = _export_frames(
+            {"results": {"panel": {"frames": frames}}}, "panel", fmt, path
+        )
+        entry = {
+            "dashboard": job.dashboard_uid,
+            "panel_id": panel_id,
+            "title": title,
+            "from": job.time_from,
+            "to": job.time_to,
+            "rows": _frames_row_count(frames),
+            "file": exported,
+            "errors": panel_result["errors"],
+        }
+        index.append(entry)
+        status = f"{entry['rows']} rows -> {exported}" if exported else "no data"
+        print(
+            f"  {job.dashboard_uid}  {panel_id!s:>4}  {title[:40]:40s}  {status}",
+            file=sys.stderr,
+        )
+        for ref_id, error in entry["errors"].items():
+            failed += 1
+            print(f"      query {ref_id} failed: {error}", file=sys.stderr)
+
+    with open(os.path.join(output_dir, "index.json"), "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=2, ensure_ascii=False)
+    print(
+        f"Wrote {sum(1 for e in index if e['file'])} panel file(s) to {output_dir}",
+        file=sys.stderr,
+    )
+    if as_json:
+        _pp(index)
+    if failed:
+        print(f"{failed} query(ies) failed.", file=sys.stderr)
+        sys.exit(1)
+
+
+# ---------------------------------------------------------------------------
+# Main
+# ---------------------------------------------------------------------------
+
+COMMANDS: dict[str, Any] = {
+    "health": cmd_health,
+    "list": cmd_list,
+    "get": cmd_get,
+    "export": cmd_export,
+    "export-all": cmd_export_all,
+    "sync": cmd_sync,
+    "create": cmd_create,
+    "update": cmd_update,
+    "delete": cmd_delete,
+    "clone": cmd_clone,
+    "versions": cmd_versions,
+    "restore": cmd_restore,
+    "folders": cmd_folders,
+    "datasources": cmd_datasources,
+    "annotations": cmd_annotations,
+    "alerts": cmd_alerts,
+    "user": cmd_user,
+    "org": cmd_org,
+    "raw": cmd_raw,
+    "cache": cmd_cache,
+    "index": cmd_index,
+    "find": cmd_find,
+    "diff": cmd_diff,
+    "merge": cmd_merge,
+    "convert": cmd_convert,
+    "validate": cmd_validate,
+    "query": cmd_query,
+    "logs-export": cmd_logs_export,
+    "panel-query": cmd_panel_query,
+    "panel-list": cmd_panel_list,
+    "dashboard-query": cmd_dashboard_query,
+}
+
+# Commands that benefit from DashboardOps
+_OPS_COMMANDS = {
+    "list",
+    "get",
+    "export",
+    "export-all",
+    "sync",
+    "create",
+    "update",
+    "delete",
+    "diff",
+    "merge",
+    "index",
+}
+
+# Commands that work offline (no GRAFANA_URL / GRAFANA_TOKEN required)
+_OFFLINE_COMMANDS = {"validate", "convert", "cache", "find"}
+
+USAGE = """\
+Grafana API CLI
+
+USAGE: grafana.sh [options] <command> [args...]
+
+OPTIONS (handled by wrapper):
+  --url <url>            Grafana base URL (overrides GRAFANA_URL)
+  --org-id <id>          Organization ID (overrides GRAFANA_ORG_ID)
+  --api <auto|legacy|k8s> API mode (default: auto, overrides GRAFANA_API_MODE)
+  --namespace <ns>       K8s namespace (default: default, overrides GRAFANA_NAMESPACE)
+  --env-file <path>      Load env vars from file (repeatable, later wins)
+  --timeout <duration>   Global timeout (default: 5m)
+  --verbose              Log per-request timing and retries to stderr
+  --timings              Print a per-phase timing breakdown to stderr
+  --timings-json         Same as --timings, as one JSON line
+
+COMMANDS:
+  health                           Check Grafana health
+  list [--query q] [--tag t]       List/search dashboards
+  get <uid> [--json]               Get dashboard details
+  export <uid> [--output path]     Export dashboard JSON (+ base sidecar)
+  export-all [--output-dir dir]    Back up all dashboards into a per-folder tree
+  sync [--dir dir] [--push]        Pull changed dashboards (and push local edits)
+  create --file <path> [--folder]  Create dashboard from JSON
+  update <uid> --file <path>       Update with OCC (three-way merge on conflict)
+  delete <uid>                     Delete dashboard
+  clone <uid> [--title t]          Clone dashboard
+  versions <uid>                   List dashboard versions
+  restore <uid> --version <n>      Restore dashboard version
+  diff <uid> --file <path>         Structural diff: local vs server (--format patch: RFC 6902)
+  merge <uid> --file <path>        Three-way merge: local vs server
+  convert --file <path> --to fmt   Convert between legacy and K8s format
+  validate --file <path>           Validate dashboard JSON/YAML (offline)
+  validate <path|dir>... [--jobs N] Validate many files in parallel, JSONL output
+  query <ds_uid> --expr <expr>     Query a datasource (PromQL, LogQL, etc.)
+  query <ds_uid> --raw-sql <sql>   Query a SQL datasource
+  query <ds_uid> --query <json>    Query with raw JSON body
+  query <ds_uid> ... --chunk 1d    Split the range into aligned chunks, run in parallel
+  query <ds_uid> ... --refresh     Bypass cached results (--no-cache: no read/write)
+  query <ds_uid> ... --step 1d --aggregate p95   Aggregate per step, on the datasource if possible
+  query <ds_uid> ... --stream --output f   Parse and export the response frame by frame
+  query|panel-query ... --transform rate --transform topk:5   Post-process frames in process
+  logs-export <ds_uid> --expr <logql>  Page through all log lines by time cursor (JSONL/Parquet)
+  panel-query <dash> <panel_id>    Execute queries from a dashboard panel
+  panel-query <dash> <id> --var-all cluster   Sweep the panel over all variable values
+  panel-list <dash_uid>            List panels in a dashboard
+  dashboard-query <uid>... [--output-dir d]  Run every panel's queries, one file per panel
+  folders [--json]                 List folders
+  datasources [--json]             List datasources
+  annotations [--dashboard uid]    Query annotations
+  alerts [--active] [--json]       List alert rules / active alerts
+  user                             Current user info
+  org                              Current org info
+  raw <METHOD> <endpoint>          Raw API call
+  cache info | clear [kind]        Show or clear the query/metadata/validate/index caches (offline)
+  index [--full]                   Build or refresh the local dashboard index (incremental)
+  find <text> | --metric m | --label l | --datasource ds | --variable v   Search the index (offline)
+  --daemon [start|stop|status]     Resident daemon: later calls reuse its warm connections
+
+ENVIRONMENT:
+  GRAFANA_URL        Grafana base URL (e.g. https://myinstance.grafana.net)
+  GRAFANA_TOKEN      Service account token
+  GRAFANA_ORG_ID     Organization ID (optional)
+  GRAFANA_API_MODE   API mode: auto, legacy, k8s (default: auto)
+  GRAFANA_NAMESPACE  K8s namespace (default: default)
+  GRAFANA_MAX_RETRIES         Retries for idempotent calls on 429/5xx (default: 4)
+  GRAFANA_HTTP2               Set to 1 to use HTTP/2 (needs h2)
+  GRAFANA_CACHE_DIR  Cache directory (default: $XDG_CACHE_HOME/grafana-skill)
+  GRAFANA_QUERY_CACHE_TTL     Query result cache TTL in seconds (default: 600)
+  GRAFANA_QUERY_CACHE_MAX_MB  Query result cache size bound (default: 512)
+  GRAFANA_VALIDATE_CACHE_MAX_MB  Validation cache size bound (default: 64)
+  GRAFANA_METADATA_TTL        API mode/datasource/folder cache TTL in seconds (default: 3600)
+  GRAFANA_DAEMON              Set to 0 to bypass a running daemon
+  GRAFANA_DAEMON_IDLE         Daemon exits after this many idle seconds (default: 1800)
+  GRAFANA_TIMINGS             Set to 1 (text) or json for a timing breakdown on stderr
+
+EXIT CODES:
+  0   Success
+  1   Error (invalid args, API error, missing prerequisites)
+  2   Unresolved merge conflicts
+  124 Timeout (killed by gtimeout)
+"""
+
+
+# ---------------------------------------------------------------------------
+# Daemon Mode
+# ---------------------------------------------------------------------------
+
+# The executable entry point next to this module (used to spawn the daemon).
+_ENTRY_SCRIPT = Path(__file__).resolve().with_name("grafana.py")
+
+# Settings a daemon is bound to. They are hashed into the socket name, so a
+# call with another URL, token, org or mode never reaches the wrong daemon.
+_DAEMON_KEY_VARS = (
+    "GRAFANA_URL",
+    "GRAFANA_TOKEN",
+    "GRAFANA_ORG_ID",
+    "GRAFANA_API_MODE",
+    "GRAFANA_NAMESPACE",
+    "GRAFANA_CACHE_DIR",
+    "GRAFANA_HTTP2",
+    "GRAFANA_MAX_CONNECTIONS",
+)
+
+
+def _client_from_env() -> tuple[GrafanaClient, str, str]:
+    """Build the client from the environment. Returns (client, api_mode, namespace)."""
+    base_url = os.environ.get("GRAFANA_URL")
+    token = os.environ.get("GRAFANA_TOKEN")
+    if not base_url:
+        print("GRAFANA_URL is required (use --url or --env-file)", file=sys.stderr)
+        sys.exit(1)
+    if not token:
+        print(
+            "GRAFANA_TOKEN is required (use --env-file or set GRAFANA_TOKEN)",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+    org_id = (
+        int(os.environ["GRAFANA_ORG_ID"]) if os.environ.get("GRAFANA_ORG_ID") else None
+    )
+    api_mode = os.environ.get("GRAFANA_API_MODE", "auto")
+    namespace = os.environ.get("GRAFANA_NAMESPACE", "default")
+    return GrafanaClient(base_url, token, org_id=org_id), api_mode, namespace
+
+
+def _invoke(
+    command_name: str,
+    command_args: list[str],
+    client: GrafanaClient,
+    ops: Any = None,
+) -> None:
+    """Run an online command, turning API errors into exit code 1.
+
+    With ``GRAFANA_TIMINGS`` set, a timing summary (``json``: a JSON
+    object) is printed to stderr afterwards, also when the command fails.
+    """
+    import time as _time
+
+    extra_kwargs: dict[str, Any] = {}
+    if command_name in _OPS_COMMANDS:
+        extra_kwargs["ops"] = ops
+    timings = os.environ.get("GRAFANA_TIMINGS", "0")
+    _PHASES.reset(timings not in ("", "0"))
+    start = _time.perf_counter()
+    try:
+        COMMANDS[command_name](client, command_args, **extra_kwargs)
+    except GrafanaAPIError as exc:
+        print(f"ERROR [{exc.status_code}]: {exc.message}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if _PHASES.enabled:
+            report = _timings_report(client, (_time.perf_counter() - start) * 1000)
+            if timings == "json":
+                print(json.dumps(report), file=sys.stderr)
+            else:
+                _print_timings(report)
+
+
+def _daemon_paths() -> tuple[Path, Path]:
+    """Per-user (socket, pid file) for the current connection settings.
+
+    Lives in ``$XDG_RUNTIME_DIR/grafana-skill`` or ``/tmp/grafana-skill-<uid>``;
+    the directory is created 0700 and refused if anyone else can enter it.
+    The name also hashes this script's path, size and mtime, so an edited or
+    upgraded script never talks to a daemon still running the old code.
+    """
+    import hashlib
+    import stat
+
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    d = (
+        Path(runtime) / "grafana-skill"
+        if runtime
+        else Path(f"/tmp/grafana-skill-{os.getuid()}")
+    )
+    d.mkdir(mode=0o700, parents=True, exist_ok=True)
+    st = d.stat()
+    if st.st_uid != os.getuid() or st.st_mode & (stat.S_IRWXG | stat.S_IRWXO):
+        raise PermissionError(f"{d} must be owned by you and have mode 0700")
+    script = Path(__file__).resolve()
+    code = script.stat()
+    material = [os.environ.get(v, "") for v in _DAEMON_KEY_VARS]
+    material.append(f"{script}|{code.st_size}|{code.st_mtime_ns}")
+    key = hashlib.sha256("\0".join(material).encode()).hexdigest()[:16]
+    return d / f"daemon-{key}.sock", d / f"daemon-{key}.pid"
+
+
+def _daemon_connect(request: dict, timeout: float | None = None) -> Any:
+    """Send one JSON request to the daemon and return the connected socket,
+    or None when no daemon is listening."""
+    import socket
+
+    try:
+        sock_path, _ = _daemon_paths()
+    except OSError:
+        return None
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.settimeout(timeout)
+        s.connect(str(sock_path))
+    except OSError:
+        s.close()
+        return None
+    try:
+        s.sendall((json.dumps(request) + "\n").encode("utf-8"))
+    except BaseException:
+        s.close()
+        raise
+    return s
+
+
+def _daemon_request(request: dict, timeout: float | None = None) -> dict | None:
+    """Send one JSON request to the daemon; None when no daemon is listening."""
+    s = _daemon_connect(request, timeout)
+    if s is None:
+        return None
+    with s, s.makefile("rb") as replies:
+        line = replies.readline()
+    if not line:
+        raise ConnectionError("daemon closed the connection without a reply")
+    return json.loads(line)
+
+
+def _daemon_forward(command_name: str, command_args: list[str]) -> int | None:
+    """Run a command on a resident daemon. Returns its exit code, or None
+    when no daemon serves the current settings (the caller runs it locally)."""
+    env = {
+        k: v
+        for k, v in os.environ.items()
+        if k.startswith("GRAFANA_") and k not in _DAEMON_KEY_VARS
+    }
+    request = {
+        "op": "run",
+        "argv": [command_name, *command_args],
+        "cwd": os.getcwd(),
+        "env": env,
+    }
+    try:
+        s = _daemon_connect(request)
+        if s is None:
+            return None
+        # Output arrives in chunks while the command runs; the last line
+        # carries the exit code.
+        with s, s.makefile("rb") as replies:
+            for line in replies:
+                reply = json.loads(line)
+                try:
+                    if "stdout" in reply:
+                        sys.stdout.write(reply["stdout"])
+                        sys.stdout.flush()
+                    if "stderr" in reply:
+                        sys.stderr.write(reply["stderr"])
+                        sys.stderr.flush()
+                except BrokenPipeError:
+                    # Our reader went away (e.g. `| head`); closing the socket
+                    # stops the command at its next output.
+                    return 1
+                if "exit" in reply:
+                    return int(reply["exit"])
+        raise ConnectionError("daemon closed the connection before the command ended")
+    except (OSError, ValueError) as exc:
+        # The request may have been (partly) executed; never re-run it.
+        print(f"ERROR: grafana daemon call failed: {exc}", file=sys.stderr)
+        return 1
+
+
+class _DaemonStream:
+    """stdout or stderr of a daemon call, sent to the client as it is written.
+
+    Text goes out as ``{"stdout": ...}`` / ``{"stderr": ...}`` lines at line
+    ends, at most every 50 ms unless 64 KiB are pending. Once the client is
+    gone (e.g. killed by the wrapper's timeout), the next write raises
+    BrokenPipeError, which aborts the command; later writes are dropped.
+    """
+
+    def __init__(self, conn: Any, name: str, peer: _DaemonStream | None = None) -> None:
+        import threading
+
+        self.conn = conn
+        self.name = name
+        # Both streams of a call share the send lock and the disconnect flag.
+        self.lock = peer.lock if peer else threading.RLock()
+        self.gone = peer.gone if peer else threading.Event()
+        self.parts: list[str] = []
+        self.size = 0
+        self.last = 0.0
+
+    def write(self, text: str) -> int:
+        import time as _time
+
+        with self.lock:
+            self.parts.append(text)
+            self.size += len(text)
+            if self.size >= 1 << 16 or (
+                "\n" in text and _time.monotonic() - self.last >= 0.05
+            ):
+                self.flush()
+        return len(text)
+
+    def flush(self) -> None:
+        import time as _time
+
+        with self.lock:
+            if not self.parts or self.gone.is_set():
+                self.parts.clear()
+                return
+            text = "".join(self.parts)
+            self.parts.clear()
+            self.size = 0
+            self.last = _time.monotonic()
+            try:
+                self.conn.sendall((json.dumps({self.name: text}) + "\n").encode())
+            except OSError:
+                self.gone.set()
+                raise BrokenPipeError("grafana daemon: client disconnected") from None
+
+    def isatty(self) -> bool:
+        return False
+
+
+class GrafanaDaemon:
+    """Resident process that serves CLI calls over a Unix socket.
+
+    Keeps one ``GrafanaClient`` (and its pooled TLS connections), the
+    detected API mode and the metadata cache warm across calls. The protocol
+    is one JSON line per request and reply, as in ``camoufox-daemon.py``,
+    except that ``run`` streams its output (``_DaemonStream``) before the
+    final ``{"exit": ...}`` line. Commands run one at a time (they use the
+    process-wide cwd, environment and stdout), each in the caller's
+    directory with the caller's ``GRAFANA_*`` tuning variables. A command
+    whose caller disconnects is aborted at its next output; one that prints
+    nothing runs to completion. Exits after ``GRAFANA_DAEMON_IDLE`` seconds
+    (default 1800) without a call.
+    """
+
+    def __init__(self) -> None:
+        import threading
+        import time as _time
+
+        self.client, self.api_mode, self.namespace = _client_from_env()
+        self.ops: DashboardOps | None = None
+        self.lock = threading.Lock()
+        self.started = _time.time()
+        self.served = 0
+        self.idle = float(os.environ.get("GRAFANA_DAEMON_IDLE", "1800"))
+        self.stopping = False
+
+    def _ops(self) -> DashboardOps:
+        if self.ops is None:
+            self.ops = DashboardOps(
+                self.client, api_mode=self.api_mode, namespace=self.namespace
+            )
+        return self.ops
+
+    def run(self, argv: list[str], cwd: str, env: dict[str, str], conn: Any) -> dict:
+        """Run one command, streaming its output to ``conn``; returns the exit reply."""
+        import traceback
+        from contextlib import redirect_stderr, redirect_stdout
+
+        out = _DaemonStream(conn, "stdout")
+        err = _DaemonStream(conn, "stderr", out)
+        code: Any = 0
+        with self.lock:
+            saved_env = dict(os.environ)
+            saved_cwd = os.getcwd()
+            try:
+                for k in list(os.environ):
+                    if k.startswith("GRAFANA_") and k not in _DAEMON_KEY_VARS:
+                        del os.environ[k]
+                os.environ.update(env)
+                os.chdir(cwd)
+                self.client.timings.clear()
+                self.client.metadata.forget()
+                with redirect_stdout(out), redirect_stderr(err):
+                    try:
+                        self.client.reload_settings()
+                        name = argv[0] if argv else ""
+                        if name not in COMMANDS or name in _OFFLINE_COMMANDS:
+                            print(f"Unknown command: {name}", file=sys.stderr)
+                            code = 1
+                        else:
+                            ops = self._ops() if name in _OPS_COMMANDS else None
+                            _invoke(name, argv[1:], self.client, ops)
+                    except SystemExit as exc:
+                        code = exc.code
+                    except Exception:
+                        traceback.print_exc()
+                        code = 1
+            finally:
+                os.chdir(saved_cwd)
+                os.environ.clear()
+                os.environ.update(saved_env)
+            self.served += 1
+        if code is None:
+            code = 0
+        elif not isinstance(code, int):
+            err.write(f"{code}\n")
+            code = 1
+        out.flush()
+        err.flush()
+        return {"exit": code}
+
+    def handle(self, conn: Any) -> None:
+        import time as _time
+
+        try:
+            buf = b""
+            while b"\n" not in buf:
+                chunk = conn.recv(1 << 20)
+                if not chunk:
+                    return
+                buf += chunk
+            request = json.loads(buf.split(b"\n", 1)[0])
+            op = request.get("op")
+            if op == "run":
+                reply = self.run(
+                    request.get("argv", []),
+                    request.get("cwd", "/"),
+                    request.get("env", {}),
+                    conn,
+                )
+            elif op == "status":
+                reply = {
+                    "pid": os.getpid(),
+                    "url": self.client.base_url,
+                    "api_mode": self.ops.api_mode if self.ops else self.api_mode,
+                    "uptime_s": round(_time.time() - self.started, 1),
+                    "served": self.served,
+                }
+            elif op == "stop":
+                self.stopping = True
+                reply = {"stopped": os.getpid()}
+            else:
+                reply = {"stdout": "", "stderr": f"unknown op: {op}\n", "exit": 1}
+            conn.sendall((json.dumps(reply) + "\n").encode("utf-8"))
+        except BrokenPipeError:
+            print("grafana daemon: client disconnected", file=sys.__stderr__)
+        except Exception as exc:
+            print(f"grafana daemon: connection failed: {exc}", file=sys.__stderr__)
+        finally:
+            conn.close()
+
+    def serve(self) -> None:
+        import signal
+        import socket
+        import threading
+
+        sock_path, pid_path = _daemon_paths()
+        sock_path.unlink(missing_ok=True)
+        srv = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o177)
+        try:
+            srv.bind(str(sock_path))
+        finally:
+            os.umask(old_umask)
+        srv.listen(16)
+        srv.settimeout(1.0)
+        pid_path.write_text(str(os.getpid()))
+
+        def shutdown(_signum: int, _frame: Any) -> None:
+            self.stopping = True
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+
+        # Warm up: API mode detection and the datasource map.
+        try:
+            self._ops()
+            self.client.datasource_map()
+        except Exception as exc:
+            print(f"grafana daemon: warm-up failed: {exc}", file=sys.stderr)
+
+        import time as _time
+
+        last = _time.monotonic()
+        try:
+            while not self.stopping:
+                try:
+                    conn, _ = srv.accept()
+                except socket.timeout:
+                    if _time.monotonic() - last > self.idle and not self.lock.locked():
+                        break
+                    continue
+                last = _time.monotonic()
+                conn.settimeout(None)
+                threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+        finally:
+            srv.close()
+            # Let a running command finish before the process exits.
+            with self.lock:
+                for p in (sock_path, pid_path):
+                    p.unlink(missing_ok=True)
+
+
+def _daemon_main(action: str) -> None:
+    """Manage the resident daemon. Usage: --daemon [start|stop|status|serve]"""
+    import subprocess
+    import time as _time
+
+    if action == "serve":
+        GrafanaDaemon().serve()
+        return
+    if action == "status":
+        status = _daemon_request({"op": "status"}, timeout=5)
+        if status is None:
+            print("No grafana daemon running for these settings.")
+            sys.exit(1)
+        _pp(status)
+        return
+    if action == "stop":
+        reply = _daemon_request({"op": "stop"}, timeout=5)
+        print("Daemon stopped." if reply else "No grafana daemon running.")
+        return
+    if action != "start":
+        print("Usage: --daemon [start|stop|status]", file=sys.stderr)
+        sys.exit(1)
+
+    if _daemon_request({"op": "status"}, timeout=5) is not None:
+        print("Daemon already running.")
+        return
+    _client_from_env()  # fail fast on missing credentials
+    log = _cache_dir() / "daemon.log"
+    log.parent.mkdir(parents=True, exist_ok=True)
+    with open(log, "ab") as log_file:
+        proc = subprocess.Popen(
+            [sys.executable, str(_ENTRY_SCRIPT), "--daemon", "serve"],
+            stdin=subprocess.DEVNULL,
+            stdout=log_file,
+            stderr=log_file,
+            start_new_session=True,
+            close_fds=True,
+        )
+    deadline = _time.monotonic() + 30
+    while _time.monotonic() < deadline:
+        status = _daemon_request({"op": "status"}, timeout=5)
+        if status is not None:
+            print(f"Daemon started (pid {status['pid']}).")
+            return
+        if proc.poll() is not None:
+            tail = log.read_text(errors="replace")[-2000:]
+            print(
+                f"ERROR: daemon exited during start-up. Last log:\n{tail}",
+                file=sys.stderr,
+            )
+            sys.exit(1)
+        _time.sleep(0.05)
+    print(f"ERROR: daemon did not become ready within 30s. See {log}.", file=sys.stderr)
+    sys.exit(1)
+
+
+def main() -> None:
+    args = sys.argv[1:]
+    if not args or args[0] in ("--help", "-h", "help"):
+        print(USAGE)
+        sys.exit(0)
+
+    if args[0] == "--daemon":
+        _daemon_main(args[1] if len(args) > 1 else "start")
+        return
+
+    command_name = args[0]
+    command_args = args[1:]
+
+    if command_name not in COMMANDS:
+        print(f"Unknown command: {command_name}\n", file=sys.stderr)
+        print(USAGE, file=sys.stderr)
+        sys.exit(1)
+
+    # Offline commands skip credential checks
+    if command_name in _OFFLINE_COMMANDS:
+        COMMANDS[command_name](None, command_args)
+        return
+
+    # A resident daemon (--daemon) for the same settings runs it warm. None
+    # serves missing credentials, so that error skips the socket lookup.
+    if (
+        os.environ.get("GRAFANA_DAEMON", "1") != "0"
+        and os.environ.get("GRAFANA_URL")
+        and os.environ.get("GRAFANA_TOKEN")
+    ):
+        code = _daemon_forward(command_name, command_args)
+        if code is not None:
+            sys.exit(code)
+
+    client, api_mode, namespace = _client_from_env()
+
+    # Build DashboardOps for commands that need it
+    ops = None
+    if command_name in _OPS_COMMANDS:
+        ops = DashboardOps(client, api_mode=api_mode, namespace=namespace)
+
+    _invoke(command_name, command_args, client, ops)
@@ -0,0 +1,678 @@
+#!/usr/bin/env python3
+"""Benchmark harness for the grafana skill, with regression check against a stored baseline.
+
+Measures the hot paths of grafana.py on synthetic data, in-process (no interpreter start
+in the numbers):
+  decode_frames                  frame decoding, 10k..10M points (10 series)
+  export/<fmt>                   every exporter (tsv, jsonl, parquet, arrow, feather)
+  three_way_merge                dashboards of 10..1,000 panels, disjoint edits
+  query, query-stream            `query` end to end against mock_server.py (up to 1M points)
+  export-all, sync, sync-push,   the bulk commands against mock_server.py, legacy and K8s
+  index, dashboard-query         API, 10..1,000 panels (10 per dashboard; dashboard-query
+                                 runs one dashboard with all of them)
+Bulk runs are also checked for the right outcome (files written, OCC merges pushed, 429s
+retried), so a "fast" run that silently did nothing fails instead of looking like a win.
+
+Every benchmark is run --repeat times and its fastest run is kept: slower runs measure
+the machine's other load, not the code. The baseline stores fastest runs too, so like is
+compared with like. It is a regression when it is more than --tolerance slower and at
+least MIN_DELTA_MS in absolute terms (timer noise on the tiny cases); a suspect result is
+measured a second time before it counts.
+
+Baselines are machine specific and are not part of the repository. They live in
+$XDG_CACHE_HOME/grafana-skill/benchmark_baseline.json; without one, the first run records
+it and compares nothing. A baseline recorded on another machine is reported, not
+compared against; re-record it with --update-baseline.
+
+Usage: tests/benchmark.py [--tier quick|default|full] [--only REGEX] [--repeat N]
+                          [--tolerance 0.25] [--baseline PATH] [--update-baseline] [--json]
+  quick    10k/100k points, 10/100 panels (about a minute)
+  default  up to 1M points and 1,000 panels
+  full     adds 10M points (in-process only; needs several GB of memory)
+
+Needs httpx (as grafana.py does); pyarrow for the Arrow-based exports, which are skipped
+without it. Exit code 1 on a regression or a failed benchmark.
+"""
+
+import argparse
+import gc
+import importlib.util
+import io
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from contextlib import redirect_stderr, redirect_stdout
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+SCRIPT = HERE.parent / "scripts" / "grafana_cli.py"  # grafana.py only imports it
+BASELINE = (
+    Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache")
+    / "grafana-skill"
+    / "benchmark_baseline.json"
+)
+
+TIERS = {
+    "quick": {"points": [10_000, 100_000], "panels": [10, 100]},
+    "default": {"points": [10_000, 100_000, 1_000_000], "panels": [10, 100, 1_000]},
+    "full": {
+        "points": [10_000, 100_000, 1_000_000, 10_000_000],
+        "panels": [10, 100, 1_000],
+    },
+}
+SERIES = 10  # synthetic results are SERIES frames of points/SERIES rows
+HTTP_MAX_POINTS = 1_000_000  # larger bodies are only benchmarked in-process
+PANELS_PER_DASHBOARD = 10
+EXPORT_FORMATS = ("tsv", "jsonl", "parquet", "arrow", "feather")
+MIN_DELTA_MS = 5.0
+
+
+class BenchError(Exception):
+    """A benchmark did not run or produced the wrong outcome."""
+
+
+def _label(n):
+    for div, suffix in ((1_000_000, "M"), (1_000, "k")):
+        if n >= div and n % div == 0:
+            return f"{n // div}{suffix}"
+    return str(n)
+
+
+def _load_grafana():
+    spec = importlib.util.spec_from_file_location("grafana_cli", SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["grafana_cli"] = module  # dataclasses resolve their module by name
+    spec.loader.exec_module(module)
+    return module
+
+
+def _synthetic_result(points):
+    """A /api/ds/query response for refId A: SERIES labelled frames, `points` rows in total."""
+    rows = points // SERIES
+    start = 1_700_000_000_000
+    times = list(range(start, start + rows * 1000, 1000))
+    frames = []
+    for s in range(SERIES):
+        frames.append(
+            {
+                "schema": {
+                    "fields": [
+                        {"name": "Time", "type": "time"},
+                        {
+                            "name": "Value",
+                            "type": "number",
+                            "labels": {"instance": f"host-{s:03d}", "job": "bench"},
+                        },
+                    ]
+                },
+                "data": {"values": [times, [float(i % 997) + s for i in range(rows)]]},
+            }
+        )
+    return {"results": {"A": {"frames": frames}}}
+
+
+def _merge_inputs(panels):
+    """(base, ours, theirs) dashboards with disjoint edits: the merge must be clean."""
+    base = {
+        "uid": "merge-bench",
+        "title": "Merge bench",
+        "version": 1,
+        "templating": {"list": [{"name": "env", "type": "custom", "query": "a,b"}]},
+        "panels": [
+            {
+                "id": pid,
+                "type": "timeseries",
+                "title": f"Panel {pid}",
+                "gridPos": {"h": 8, "w": 12, "x": 0, "y": pid * 8},
+                "datasource": {"type": "prometheus", "uid": "prom"},
+                "targets": [
+                    {"refId": "A", "expr": f'rate(x_total{{job="j{pid}"}}[5m])'}
+                ],
+                "fieldConfig": {"defaults": {"unit": "short"}, "overrides": []},
+            }
+            for pid in range(1, panels + 1)
+        ],
+    }
+    ours = json.loads(json.dumps(base))
+    theirs = json.loads(json.dumps(base))
+    for i, panel in enumerate(ours["panels"]):
+        if i % 10 == 0:
+            panel["title"] += " (ours)"
+    for i, panel in enumerate(theirs["panels"]):
+        if i % 10 == 5:
+            panel["targets"][0]["expr"] += " * 2"
+    theirs["panels"].append(dict(base["panels"][0], id=panels + 1, title="Added"))
+    theirs["version"] = 2
+    return base, ours, theirs
+
+
+class Mock:
+    """mock_server.py in a subprocess, reconfigured per benchmark group."""
+
+    def __init__(self, tmp):
+        portfile = Path(tmp) / "mock.port"
+        self.proc = subprocess.Popen(
+            [sys.executable, str(HERE / "mock_server.py"), str(portfile)]
+        )
+        for _ in range(100):
+            if portfile.exists() and portfile.read_text():
+                break
+            time.sleep(0.05)
+        else:
+            self.proc.kill()
+            raise BenchError("mock server did not start")
+        self.url = f"http://127.0.0.1:{portfile.read_text()}"
+
+    def call(self, path, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(
+            self.url + path, data=data, method="POST" if data else "GET"
+        )
+        with urllib.request.urlopen(req) as resp:
+            return json.load(resp)
+
+    def configure(self, **config):
+        return self.call("/_mock/config", config)
+
+    def stats(self):
+        return self.call("/_mock/stats")
+
+    def close(self):
+        self.proc.terminate()
+        self.proc.wait()
+
+
+class Harness:
+    def __init__(self, g, mock, tmp, repeat, only=None, baseline=None, tolerance=0.25):
+        self.g = g
+        self.mock = mock
+        self.tmp = Path(tmp)
+        self.repeat = repeat
+        self.only = re.compile(only) if only else None
+        self.baseline = baseline or {}
+        self.tolerance = tolerance
+        self.results = {}
+        self.errors = {}
+
+    # -- running -------------------------------------------------------------
+
+    def bench(self, name, run, setup=None, check=None, repeat=None):
+        """Time run(state) `repeat` times; setup() and check(state, out) are not timed.
+
+        A result slower than the baseline is measured once more before it counts,
+        so a single burst of load on the machine does not read as a regression.
+        """
+        if self.only and not self.only.search(name):
+            return
+        times = []
+        try:
+            for _round in range(2):
+                for _ in range(repeat or self.repeat):
+                    state = setup() if setup else None
+                    gc.collect()
+                    start = time.perf_counter()
+                    out = run(state)
+                    times.append((time.perf_counter() - start) * 1000)
+                    if check:
+                        check(state, out)
+                ref = self.baseline.get(name)
+                if ref is None or not _regressed(min(times), ref, self.tolerance):
+                    break
+        except BenchError as exc:
+            self.errors[name] = str(exc)
+            print(f"  {name:<40} FAILED: {exc}", flush=True)
+            return
+        self.results[name] = min(times)
+        print(f"  {name:<40} {self.results[name]:>10.1f} ms", flush=True)
+
+    def command(self, name, args, api="legacy"):
+        """Run one CLI command in-process against the mock; returns its stdout."""
+        g = self.g
+        client = g.GrafanaClient(self.mock.url, "bench-token")
+        ops = g.DashboardOps(client, api) if name in g._OPS_COMMANDS else None
+        out, err = io.StringIO(), io.StringIO()
+        try:
+            with redirect_stdout(out), redirect_stderr(err):
+                g._invoke(name, args, client, ops)
+        except SystemExit as exc:
+            if exc.code:
+                tail = err.getvalue().strip().splitlines()[-3:]
+                raise BenchError(
+                    f"{name} exited {exc.code}: {' | '.join(tail)}"
+                ) from None
+        finally:
+            client._client.close()
+        return out.getvalue()
+
+    def fresh_dir(self, name):
+        path = self.tmp / name
+        shutil.rmtree(path, ignore_errors=True)
+        path.mkdir(parents=True)
+        return path
+
+    def warm_up(self):
+        """Pay one-off costs (lazy imports, first connection) outside the numbers."""
+        if importlib.util.find_spec("pyarrow") is not None:
+            import pyarrow.ipc  # noqa: F401
+            import pyarrow.parquet  # noqa: F401
+        self.command("health", [])
+
+    # -- in-process ----------------------------------------------------------
+
+    def run_frames(self, points_sizes):
+        g = self.g
+        have_arrow = importlib.util.find_spec("pyarrow") is not None
+        for points in points_sizes:
+            label = _label(points)
+            result = _synthetic_result(points)
+
+            def check_rows(_state, table, points=points):
+                rows = table.num_rows
+                if rows != points // SERIES * SERIES:
+                    raise BenchError(f"decoded {rows} rows, expected {points}")
+
+            self.bench(
+                f"decode_frames/{label}",
+                lambda _s: g._decode_frames(result),
+                check=check_rows,
+            )
+            for fmt in EXPORT_FORMATS:
+                if fmt in g._ARROW_FORMATS and not have_arrow:
+                    print(f"  export/{fmt}/{label:<30} skipped (no pyarrow)")
+                    continue
+                path = self.tmp / f"export.{fmt}"
+
+                def setup(path=path):
+                    path.unlink(missing_ok=True)
+                    return path
+
+                def check_file(path, exported):
+                    if not exported or not path.stat().st_size:
+                        raise BenchError("nothing exported")
+
+                self.bench(
+                    f"export/{fmt}/{label}",
+                    lambda p, fmt=fmt: g._export_frames(result, "A", fmt, str(p)),
+                    setup=setup,
+                    check=check_file,
+                )
+            del result
+            gc.collect()
+
+    def run_merge(self, panel_sizes):
+        g = self.g
+        for panels in panel_sizes:
+            base, ours, theirs = _merge_inputs(panels)
+
+            def check(_state, out, panels=panels):
+                merged, conflicts = out
+                if conflicts or len(merged["panels"]) != panels + 1:
+                    raise BenchError(
+                        f"{len(conflicts)} conflict(s), {len(merged['panels'])} panels"
+                    )
+
+            self.bench(
+                f"three_way_merge/{panels}p",
+                lambda _s: g.three_way_merge(base, ours, theirs),
+                check=check,
+            )
+
+    # -- against the mock ----------------------------------------------------
+
+    def run_query(self, points_sizes):
+        have_arrow = importlib.util.find_spec("pyarrow") is not None
+        fmt = "parquet" if have_arrow else "tsv"
+        for points in points_sizes:
+            if points > HTTP_MAX_POINTS:
+                continue
+            label = _label(points)
+            self.mock.configure(points=points // SERIES, series=SERIES)
+            for variant, extra in (("query", []), ("query-stream", ["--stream"])):
+                path = self.tmp / f"query.{fmt}"
+
+                def setup(path=path):
+                    path.unlink(missing_ok=True)
+                    return path
+
+                def check(path, _out):
+                    if not path.exists():
+                        raise BenchError("no output written")
+
+                self.bench(
+                    f"{variant}/{fmt}/{label}",
+                    lambda p, extra=extra: self.command(
+                        "query",
+                        [
+                            "prom",
+                            "--expr",
+                            "up",
+                            "--output",
+                            str(p),
+                            "--no-cache",
+                            *extra,
+                        ],
+                    ),
+                    setup=setup,
+                    check=check,
+                )
+
+    def run_bulk(self, panel_sizes):
+        for panels in panel_sizes:
+            dashboards = max(1, panels // PANELS_PER_DASHBOARD)
+            for api in ("legacy", "k8s"):
+                self._bulk_api(api, panels, dashboards)
+            self._bulk_throttled(panels, dashboards)
+            self._dashboard_query(panels)
+
+    def _export(self, api, out_dir, parallel=8):
+        return json.loads(
+            self.command(
+                "export-all",
+                ["--output-dir", str(out_dir), "--parallel", str(parallel), "--json"],
+                api,
+            )
+        )
+
+    def _bulk_api(self, api, panels, dashboards):
+        tag = f"{api}/{panels}p"
+        self.mock.configure(
+            api=api,
+            dashboards=dashboards,
+            panels=PANELS_PER_DASHBOARD,
+            throttle_every=0,
+        )
+
+        def exported(_state, summary):
+            if len(summary["written"]) != dashboards:
+                raise BenchError(
+                    f"wrote {len(summary['written'])} of {dashboards} dashboards"
+                )
+
+        self.bench(
+            f"export-all/{tag}",
+            lambda d: self._export(api, d),
+            setup=lambda: self.fresh_dir("export"),
+            check=exported,
+        )
+
+        tree = self.fresh_dir("sync")
+        self._export(api, tree)
+
+        def unchanged(_state, out):
+            summary = json.loads(out)
+            if summary["unchanged"] != dashboards:
+                raise BenchError(f"{summary['unchanged']} of {dashboards} unchanged")
+
+        self.bench(
+            f"sync/{tag}",
+            lambda _s: self.command("sync", ["--dir", str(tree), "--json"], api),
+            check=unchanged,
+        )
+
+        edits = max(1, dashboards // 10)
+
+        def stale_edits():
+            # Edit the first panel locally and the last one "elsewhere": every push
+            # hits 412/409, merges cleanly and is saved on the second attempt.
+            self.mock.configure(
+                api=api, dashboards=dashboards, panels=PANELS_PER_DASHBOARD
+            )
+            out_dir = self.fresh_dir("push")
+            self._export(api, out_dir)
+            uids = [f"dash-{n:04d}" for n in range(edits)]
+            for path in out_dir.rglob("dash-*.json"):
+                if path.stem in uids:
+                    data = json.loads(path.read_text())
+                    body = data["spec"] if "spec" in data else data
+                    body["panels"][0]["title"] += " (local)"
+                    path.write_text(json.dumps(data, indent=2))
+            self.mock.call("/_mock/touch", {"uids": uids})
+            return out_dir
+
+        def pushed(_state, out):
+            summary = json.loads(out)
+            stats = self.mock.stats()
+            if len(summary.get("pushed", [])) != edits or summary.get("conflicts"):
+                raise BenchError(
+                    f"pushed {summary.get('pushed')}, conflicts {summary.get('conflicts')}"
+                )
+            if stats["conflicts"] != edits:
+                raise BenchError(
+                    f"{stats['conflicts']} OCC rejections, expected {edits}"
+                )
+
+        self.bench(
+            f"sync-push/{tag}",
+            lambda d: self.command("sync", ["--dir", str(d), "--push", "--json"], api),
+            setup=stale_edits,
+            check=pushed,
+        )
+
+        def indexed(_state, out):
+            summary = json.loads(out)
+            if summary["indexed"] != dashboards:
+                raise BenchError(f"indexed {summary['indexed']} of {dashboards}")
+
+        self.bench(
+            f"index/{tag}",
+            lambda _s: self.command("index", ["--full", "--json"], api),
+            check=indexed,
+        )
+
+    def _bulk_throttled(self, panels, dashboards):
+        # Every 3rd read is answered 429: measures the retry path's overhead.
+        def setup():
+            self.mock.configure(
+                api="legacy",
+                dashboards=dashboards,
+                panels=PANELS_PER_DASHBOARD,
+                throttle_every=3,
+            )
+            return self.fresh_dir("export")
+
+        def check(_state, summary):
+            if len(summary["written"]) != dashboards:
+                raise BenchError(
+                    f"wrote {len(summary['written'])} of {dashboards} dashboards"
+                )
+            if not self.mock.stats()["throttled"]:
+                raise BenchError("no request was throttled")
+
+        self.bench(
+            f"export-all-429/legacy/{panels}p",
+            lambda d: self._export("legacy", d),
+            setup=setup,
+            check=check,
+        )
+        self.mock.configure(throttle_every=0)
+
+    def _dashboard_query(self, panels):
+        self.mock.configure(
+            api="legacy",
+            dashboards=1,
+            panels=panels,
+            points=100,
+            series=2,
+            throttle_every=0,
+        )
+        before = {}
+
+        def setup():
+            before["queries"] = self.mock.stats()["queries"]
+            return self.fresh_dir("dq")
+
+        def check(_state, _out):
+            ran = self.mock.stats()["queries"] - before["queries"]
+            if ran < panels:
+                raise BenchError(f"{ran} queries for {panels} panels")
+
+        self.bench(
+            f"dashboard-query/{panels}p",
+            lambda d: self.command(
+                "dashboard-query",
+                [
+                    "dash-0000",
+                    "--format",
+                    "jsonl",
+                    "--output-dir",
+                    str(d),
+                    "--no-cache",
+                    "--json",
+                ],
+            ),
+            setup=setup,
+            check=check,
+        )
+
+
+def _regressed(ms, ref, tolerance):
+    return ms > ref * (1 + tolerance) and ms - ref >= MIN_DELTA_MS
+
+
+def _compare(results, errors, baseline, tolerance):
+    """Print the comparison table; returns the names of regressed benchmarks."""
+    base = baseline.get("results", {})
+    regressions = []
+    print()
+    print(f"  {'benchmark':<40} {'best':>10} {'baseline':>10} {'change':>8}")
+    for name, ms in results.items():
+        ref = base.get(name)
+        if ref is None:
+            print(f"  {name:<40} {ms:>8.1f}ms {'-':>10} {'':>8}  new")
+            continue
+        change = ms / ref - 1 if ref else 0.0
+        regressed = _regressed(ms, ref, tolerance)
+        status = (
+            "REGRESSION" if regressed else ("faster" if change < -tolerance else "ok")
+        )
+        if regressed:
+            regressions.append(name)
+        print(f"  {name:<40} {ms:>8.1f}ms {ref:>8.1f}ms {change:>+7.0%}  {status}")
+    for name, msg in errors.items():
+        print(f"  {name:<40} {'FAILED':>10}  {msg}")
+    return regressions
+
+
+def _machine():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(terse=True),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark grafana.py against a stored baseline"
+    )
+    parser.add_argument("--tier", choices=sorted(TIERS), default="default")
+    parser.add_argument(
+        "--only", help="run only benchmarks whose name matches this regex"
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--tolerance", type=float, default=0.25, help="allowed slowdown (0.25 = 25%%)"
+    )
+    parser.add_argument("--baseline", type=Path, default=BASELINE)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    opts = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="grafana-bench-")
+    # Isolate every cache and make sure nothing is answered from one.
+    os.environ.update(
+        {
+            "GRAFANA_CACHE_DIR": str(Path(tmp) / "cache"),
+            "GRAFANA_DAEMON": "0",
+            "GRAFANA_QUERY_CACHE": "0",
+            "GRAFANA_METADATA_CACHE": "0",
+            "GRAFANA_MAX_RETRIES": "8",
+        }
+    )
+    for var in (
+        "GRAFANA_TIMINGS",
+        "GRAFANA_VERBOSE",
+        "GRAFANA_HTTP2",
+        "GRAFANA_ORG_ID",
+    ):
+        os.environ.pop(var, None)
+
+    g = _load_grafana()
+    mock = Mock(tmp)
+    os.environ["GRAFANA_URL"] = mock.url
+    os.environ["GRAFANA_TOKEN"] = "bench-token"
+    tier = TIERS[opts.tier]
+    baseline = json.loads(opts.baseline.read_text()) if opts.baseline.exists() else {}
+    comparable = baseline.get("machine") == _machine()
+    if not baseline:
+        print(f"No baseline at {opts.baseline}: this run records it.")
+        opts.update_baseline = True
+    elif not comparable:
+        print(
+            f"NOTE: baseline was recorded on {baseline.get('machine')}, this is "
+            f"{_machine()}; not comparing (re-record with --update-baseline)"
+        )
+        baseline = {}
+    harness = Harness(
+        g, mock, tmp, opts.repeat, opts.only, baseline.get("results"), opts.tolerance
+    )
+    try:
+        harness.warm_up()
+        print(f"== in-process ({opts.tier}) ==")
+        harness.run_frames(tier["points"])
+        harness.run_merge(tier["panels"])
+        print(f"== against mock_server.py ({mock.url}) ==")
+        harness.run_query(tier["points"])
+        harness.run_bulk(tier["panels"])
+    finally:
+        mock.close()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    regressions = _compare(harness.results, harness.errors, baseline, opts.tolerance)
+
+    if opts.update_baseline:
+        merged = dict(baseline.get("results", {}))
+        merged.update({k: round(v, 1) for k, v in harness.results.items()})
+        opts.baseline.parent.mkdir(parents=True, exist_ok=True)
+        opts.baseline.write_text(
+            json.dumps(
+                {
+                    "machine": _machine(),
+                    "recorded": time.strftime("%Y-%m-%d"),
+                    "results": merged,
+                },
+                indent=2,
+                sort_keys=True,
+            )
+            + "\n"
+        )
+        print(f"\nBaseline updated: {opts.baseline}")
+    if opts.json:
+        print(
+            json.dumps(
+                {
+                    "results": harness.results,
+                    "errors": harness.errors,
+                    "regressions": regressions,
+                }
+            )
+        )
+
+    print()
+    print(
+        f"== {len(harness.results)} measured, {len(regressions)} regressed, "
+        f"{len(harness.errors)} failed =="
+    )
+    return 1 if (regressions or harness.errors) and not opts.update_baseline else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,223 @@
+#!/usr/bin/env bash
+# Integration test for the grafana skill: runs the real client (grafana.py → grafana_cli.py)
+# against the local stdlib mock (no real Grafana) and checks behavior that is easy to get
+# subtly wrong: per-token caches, --stream output, the format of a sync tree, and query
+# helpers (SQL pushdown, variable formats and regexes, chunk stitching). Pure helpers are
+# exercised in-process through short Python snippets that import grafana_cli.
+#
+# Requires: python3 with httpx. Run from anywhere.
+# Usage: tests/integration_test.sh   (PYTHON=python3)
+set -uo pipefail
+
+HERE="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+SCRIPTS="$(cd "$HERE/.." && pwd)/scripts"
+PYTHON="${PYTHON:-python3}"
+
+TMP="$(mktemp -d)"
+export GRAFANA_CACHE_DIR="$TMP/cache"   # isolate the user cache
+PORTFILE="$TMP/port"; REQLOG="$TMP/reqlog"
+: >"$REQLOG"
+
+pass=0; fail=0
+ok(){ echo "  PASS: $1"; pass=$((pass+1)); }
+no(){ echo "  FAIL: $1"; fail=$((fail+1)); }
+
+cleanup(){ [[ -n "${MOCK_PID:-}" ]] && kill "$MOCK_PID" 2>/dev/null; rm -rf "$TMP"; }
+trap cleanup EXIT
+
+echo "== starting mock =="
+"$PYTHON" "$HERE/mock_server.py" "$PORTFILE" "$REQLOG" & MOCK_PID=$!
+for _ in $(seq 1 50); do [[ -s "$PORTFILE" ]] && break; sleep 0.1; done
+PORT="$(cat "$PORTFILE" 2>/dev/null || true)"
+[[ -n "$PORT" ]] || { echo "mock failed to start"; exit 1; }
+BASE="http://127.0.0.1:$PORT"
+echo "mock on $BASE"
+
+export GRAFANA_URL="$BASE"
+export GRAFANA_TOKEN="test-token"
+export GRAFANA_DAEMON=0
+
+run(){ (cd "$TMP" && "$PYTHON" "$SCRIPTS/grafana.py" "$@"); }
+count(){ grep -c "$1" "$REQLOG" 2>/dev/null || true; }
+
+# unit NAME <<'PY' ... PY -- runs a Python snippet with grafana_cli importable as `g`;
+# it passes when the snippet exits 0 (use assert).
+unit(){
+  local name="$1" out
+  out="$(cd "$TMP" && PYTHONPATH="$SCRIPTS" "$PYTHON" -c 'import sys, grafana_cli as g
+exec(compile(sys.stdin.read(), "<snippet>", "exec"), {"g": g})' 2>&1)" \
+    && ok "$name" || { no "$name"; sed 's/^/        /' <<<"$out"; }
+}
+
+echo "== test 1: SQL aggregation pushdown =="
+unit "time/value/metric select lists are pushed down" <<'PY'
+sql = g._pushdown_sql("SELECT ts AS time, v AS value, name AS metric FROM t", "avg", None, "1m", "postgres")
+assert sql and "GROUP BY $__timeGroup(time, '1m'), metric" in sql, sql
+assert g._pushdown_sql("SELECT $__time(ts), v AS value FROM t", "max", None, "1m", "mysql")
+PY
+unit "extra label columns aggregate locally" <<'PY'
+for sql in (
+    "SELECT ts AS time, v AS value, host FROM t",
+    "SELECT ts AS time, v AS value, name AS metric, region FROM t",
+    "SELECT $__timeGroupAlias(ts, '1m'), avg(v) AS value, host AS h FROM t GROUP BY 1, 3",
+):
+    assert g._pushdown_sql(sql, "avg", None, "5m", "postgres") is None, sql
+PY
+
+echo "== test 2: query cache is per token =="
+n0="$(count 'POST /api/ds/query')"
+run query prom --expr up --from now-1h --preview 1 >/dev/null 2>&1
+run query prom --expr up --from now-1h --preview 1 >/dev/null 2>&1
+n1="$(count 'POST /api/ds/query')"
+[[ $((n1 - n0)) -eq 1 ]] && ok "repeated query served from the cache" || no "expected 1 ds/query, got $((n1 - n0))"
+GRAFANA_TOKEN="other-token" run query prom --expr up --from now-1h --preview 1 >/dev/null 2>&1
+n2="$(count 'POST /api/ds/query')"
+[[ $((n2 - n1)) -eq 1 ]] && ok "another token does not share cached results" || no "other token hit the cache"
+
+echo "== test 3: dashboard index is per token =="
+run index >/dev/null 2>&1 && ok "index built" || no "index failed"
+run find dash >/dev/null 2>&1 && ok "find uses the token's index" || no "find missed the index"
+GRAFANA_TOKEN="other-token" run find dash >/dev/null 2>&1 \
+  && no "another token found the first token's index" || ok "another token does not see the index"
+
+echo "== test 4: variable formats =="
+unit "\${var:format} renders like Grafana" <<'PY'
+cases = [
+    ("prod", "csv", "prod"), (["a", "b"], "csv", "a,b"), (["a", "b"], "pipe", "a|b"),
+    (["a.b", "c"], "regex", r"(a\.b|c)"), ("a.b", "regex", r"a\.b"),
+    (["a", "b"], None, "{a,b}"), (["a", "b"], "json", '["a", "b"]'),
+    (["it's"], "sqlstring", "'it''s'"), ("a b", "percentencode", "a%20b"),
+    (["a", "b"], "queryparam", "var-v=a&var-v=b"),
+]
+for value, fmt, want in cases:
+    got = g._format_variable("v", value, fmt)
+    assert got == want, (value, fmt, got, want)
+PY
+unit "lucene escapes single values and ORs multi-values" <<'PY'
+cases = [
+    ("api", "api"), ("my-app:v1", r"my\-app\:v1"), ("a b", r"a\ b"),
+    (["a", "b c"], r'("a" OR "b\ c")'), (["a"], '("a")'), ([], "__empty__"),
+]
+for value, want in cases:
+    got = g._format_variable("v", value, "lucene")
+    assert got == want, (value, got, want)
+assert g._resolve_variables("app:${app:lucene}", {"app": "web-1"}) == r"app:web\-1"
+PY
+
+echo "== test 5: variable regex filters =="
+unit "JavaScript regexes filter and extract values" <<'PY'
+def options(regex, values=("api-prod", "API-dev", "web-prod", "$__all")):
+    dashboard = {"templating": {"list": [{
+        "name": "app", "type": "custom", "query": ",".join(values), "regex": regex,
+    }]}}
+    return g._variable_options(None, dashboard, "app", {})
+
+assert options("") == ["api-prod", "API-dev", "web-prod"]
+assert options("/^api/") == ["api-prod"]
+assert options("/^api/i") == ["api-prod", "API-dev"]
+assert options("/^api/gi") == ["api-prod", "API-dev"]
+assert options("/(.*)-prod/") == ["api", "web"]
+assert options("/(?<text>\\w+)-(?<value>\\w+)/") == ["prod", "dev"]
+assert options("-prod$") == ["api-prod", "web-prod"]
+PY
+unit "an invalid regex warns and keeps every value" <<'PY'
+import contextlib, io
+dashboard = {"templating": {"list": [
+    {"name": "a", "type": "custom", "query": "x,y", "regex": "/(x/"},
+    {"name": "b", "type": "custom", "query": "x,y", "regex": "/x/q"},
+]}}
+for name in ("a", "b"):
+    err = io.StringIO()
+    with contextlib.redirect_stderr(err):
+        assert g._variable_options(None, dashboard, name, {}) == ["x", "y"]
+    assert err.getvalue().startswith("WARNING:"), err.getvalue()
+PY
+
+echo "== test 6: stitching --chunk responses =="
+unit "boundary points are not duplicated" <<'PY'
+def chunk(times, values):
+    schema = {"name": "up", "fields": [{"name": "Time", "type": "time"}, {"name": "Value", "type": "number"}]}
+    return {"results": {"A": {"frames": [{"schema": schema, "data": {"values": [times, values]}}]}}}
+
+out = g._stitch_results([chunk([0, 60, 120], [1, 2, 3]), chunk([120, 180], [3, 4])])
+assert out["results"]["A"]["frames"][0]["data"]["values"] == [[0, 60, 120, 180], [1, 2, 3, 4]], out
+PY
+unit "log lines sharing a timestamp at a chunk edge are kept" <<'PY'
+def chunk(rows):
+    schema = {
+        "name": "logs", "meta": {"type": "log-lines", "preferredVisualisationType": "logs"},
+        "fields": [{"name": "labels", "type": "other"}, {"name": "Time", "type": "time"},
+                   {"name": "Line", "type": "string"}],
+    }
+    labels = {"app": "api"}
+    values = [[labels] * len(rows), [t for t, _ in rows], [l for _, l in rows]]
+    return {"results": {"A": {"frames": [{"schema": schema, "data": {"values": values}}]}}}
+
+out = g._stitch_results([
+    chunk([(90, "a"), (100, "b"), (100, "c")]),
+    chunk([(100, "b"), (100, "c"), (100, "d"), (100, "b"), (110, "e")]),
+])
+_, times, lines = out["results"]["A"]["frames"][0]["data"]["values"]
+assert lines == ["a", "b", "c", "d", "b", "e"], lines
+assert times == [90, 100, 100, 100, 100, 110], times
+PY
+
+echo "== test 7: --stream writes what the buffered export writes =="
+for mixed in false true; do
+  q="{\"expr\": \"up\", \"series\": 4, \"points\": 5, \"mixedLabels\": $mixed}"
+  for ext in jsonl tsv; do
+    rm -f "$TMP"/plain.* "$TMP"/streamed.*
+    run query prom --query "$q" --no-cache --output "plain.$ext" >/dev/null 2>&1
+    run query prom --query "$q" --stream --output "streamed.$ext" >/dev/null 2>&1
+    { [[ -s "$TMP/plain.$ext" ]] && cmp -s "$TMP/plain.$ext" "$TMP/streamed.$ext"; } \
+      && ok "$ext output identical (mixedLabels=$mixed)" || no "$ext output differs (mixedLabels=$mixed)"
+  done
+done
+mkdir -p "$TMP/out"
+err="$(run query prom --query '{"expr": "up", "mockError": "parse error"}' --stream --output-dir out --format jsonl 2>&1)"; rc=$?
+{ [[ $rc -eq 1 ]] && grep -q "parse error" <<<"$err" && [[ -z "$(ls -A "$TMP/out")" ]]; } \
+  && ok "a failed streamed query creates no file" || no "failed stream rc=$rc files=$(ls "$TMP/out") err=$err"
+unit "an error after the frames removes the partial file" <<'PY'
+import contextlib, io, json, os
+
+frame = {"schema": {"fields": [{"name": "Time", "type": "time"}, {"name": "Value", "type": "number"}]},
+         "data": {"values": [[1, 2], [3.0, 4.0]]}}
+body = json.dumps({"results": {"A": {"frames": [frame], "error": "timeout", "status": 500}}}).encode()
+
+class Client:
+    def query_datasource_stream(self, queries, time_from, time_to):
+        yield body[:40]
+        yield body[40:]
+
+for fmt in ("jsonl", "tsv"):
+    path = f"partial.{fmt}"
+    err = io.StringIO()
+    with contextlib.redirect_stderr(err):
+        try:
+            g._stream_query_output(Client(), [{"refId": "A"}], "now-1h", "now",
+                                   output=path, output_dir=None, fmt=None)
+        except SystemExit as exc:
+            assert exc.code == 1, exc.code
+        else:
+            raise AssertionError("no exit")
+    assert "timeout" in err.getvalue(), err.getvalue()
+    assert not os.path.exists(path), fmt
+PY
+
+echo "== test 8: sync keeps the export format of its tree =="
+run sync --dir tree --format k8s >/dev/null 2>&1 && ok "first sync pulls as k8s" || no "first sync failed"
+file="$(find "$TMP/tree" -name 'dash-0000.json' | head -1)"
+grep -q '"apiVersion"' "$file" 2>/dev/null \
+  && ok "files are written in k8s format" || no "no k8s file: $file"
+run sync --dir tree >/dev/null 2>&1 && ok "sync without --format reuses the recorded format" || no "second sync failed"
+grep -q '"apiVersion"' "$file" 2>/dev/null \
+  && ok "files stay in k8s format" || no "format changed to legacy"
+err="$(run sync --dir tree --format legacy 2>&1)"; rc=$?
+{ [[ $rc -eq 1 ]] && grep -q "ERROR: .*k8s" <<<"$err"; } \
+  && ok "a mismatched --format is refused" || no "mismatch rc=$rc err=$err"
+err="$(run export-all --output-dir tree --format legacy 2>&1)"; rc=$?
+[[ $rc -eq 1 ]] && ok "export-all refuses it too" || no "export-all mismatch rc=$rc err=$err"
+
+echo
+echo "== $pass passed, $fail failed =="
+[[ $fail -eq 0 ]]
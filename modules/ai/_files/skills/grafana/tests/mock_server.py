@@ -0,0 +1,626 @@
+#!/usr/bin/env python3
+"""Minimal stdlib Grafana mock for the grafana skill's benchmark and offline tests.
+
+No real Grafana. Serves just enough of the HTTP API to drive the client end to end:
+health, datasources, folders and search, dashboards through the legacy API
+(/api/dashboards, OCC via `version` -> HTTP 412) or the K8s-style API
+(/apis/dashboard.grafana.app/v1beta1, OCC via `resourceVersion` -> HTTP 409, paged
+with `continue`, metadata-only lists), and POST /api/ds/query returning synthetic
+time series frames of a configurable size.
+
+Usage: mock_server.py <PORTFILE> [<REQLOG>] [--dashboards N] [--panels N] [--folders N]
+                      [--points N] [--series N] [--api legacy|k8s] [--throttle-every N]
+                      [--latency-ms N]
+  PORTFILE  the chosen port is written here once bound
+  REQLOG    one "<METHOD> <path?query> <status>" line per request (grep-friendly)
+
+Dataset (all settable again at runtime, which also resets the dashboards):
+  --dashboards / --panels   N dashboards `dash-0000`... with M timeseries panels each
+  --points / --series       per ds/query target: `series` frames of `points` rows each.
+                            0 points = the query's maxDataPoints. A target may carry its
+                            own "points"/"series" fields, which win. A target with
+                            "mixedLabels": true gives every other series an extra `zone`
+                            label; one with "mockError": "<message>" fails with that error
+                            (status 400, no frames), as a datasource error does.
+  --throttle-every N        every Nth read (GET, ds/query) is answered 429 Retry-After: 0,
+                            to exercise the client's retry path. Writes are never
+                            throttled, because the client (rightly) never retries them.
+  --latency-ms N            added to every response (simulated server work)
+
+Control endpoints (not part of Grafana):
+  POST /_mock/config  {"dashboards": 100, ...}   replace the config and reset all state
+  POST /_mock/touch   {"uids": [...]}            simulate a concurrent edit: bump the
+                                                 version and change each dashboard's
+                                                 last panel title, so a stale save of
+                                                 any of them hits the OCC path
+  GET  /_mock/stats                              request counts, 429s, conflicts, bytes
+"""
+
+import argparse
+import json
+import math
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+K8S_BASE = "/apis/dashboard.grafana.app/v1beta1"
+EPOCH_MS = 1_700_000_000_000  # first sample of every synthetic series
+
+DATASOURCES = [
+    {
+        "id": 1,
+        "uid": "prom",
+        "name": "Prometheus",
+        "type": "prometheus",
+        "isDefault": True,
+    },
+    {"id": 2, "uid": "loki", "name": "Loki", "type": "loki", "isDefault": False},
+]
+
+LOCK = threading.RLock()
+CONFIG = {
+    "dashboards": 10,
+    "panels": 10,
+    "folders": 3,
+    "points": 0,
+    "series": 1,
+    "api": "legacy",
+    "throttle_every": 0,
+    "latency_ms": 0,
+}
+STATE = {}
+# (points, series, step_ms) -> encoded `frames` list; bodies of big frames are built once.
+FRAME_CACHE = {}
+FRAME_CACHE_MAX = 8
+
+
+def _panel(pid, dash_index):
+    return {
+        "id": pid,
+        "type": "timeseries",
+        "title": f"Panel {pid}",
+        "gridPos": {"h": 8, "w": 12, "x": (pid - 1) % 2 * 12, "y": (pid - 1) // 2 * 8},
+        "datasource": {"type": "prometheus", "uid": "prom"},
+        "targets": [
+            {
+                "refId": "A",
+                "datasource": {"type": "prometheus", "uid": "prom"},
+                "expr": (
+                    f'sum by (instance) (rate(http_requests_total{{env="$env",'
+                    f'job="svc-{dash_index}-{pid}"}}[5m]))'
+                ),
+            }
+        ],
+    }
+
+
+def _dashboard(index, panels):
+    uid = f"dash-{index:04d}"
+    return {
+        "uid": uid,
+        "title": f"Service {index:04d}",
+        "tags": ["bench", f"team-{index % 5}"],
+        "schemaVersion": 39,
+        "time": {"from": "now-6h", "to": "now"},
+        "templating": {
+            "list": [
+                {
+                    "name": "env",
+                    "type": "custom",
+                    "query": "prod,staging",
+                    "current": {"text": "prod", "value": "prod"},
+                }
+            ]
+        },
+        "panels": [_panel(pid, index) for pid in range(1, panels + 1)],
+    }
+
+
+def _reset(**overrides):
+    """Replace the config and rebuild the dashboards. Callers hold LOCK."""
+    CONFIG.update({k: v for k, v in overrides.items() if k in CONFIG})
+    folders = {
+        f"folder-{n}": {"uid": f"folder-{n}", "title": f"Team {n}", "parentUid": None}
+        for n in range(CONFIG["folders"])
+    }
+    if len(folders) > 1:
+        folders["folder-1"]["parentUid"] = "folder-0"  # one nested level
+    dashboards = {}
+    for n in range(CONFIG["dashboards"]):
+        body = _dashboard(n, CONFIG["panels"])
+        folder = f"folder-{n % len(folders)}" if folders else None
+        dashboards[body["uid"]] = {
+            "dashboard": body,
+            "folder": folder,
+            "version": 1,
+            "rv": str(1000 + n),
+            "updated": "2026-10-01T12:00:00Z",
+        }
+    STATE.clear()
+    STATE.update(
+        {
+            "folders": folders,
+            "dashboards": dashboards,
+            "next_rv": 1000 + CONFIG["dashboards"],
+            "next_uid": 0,
+            "stats": {
+                "requests": 0,
+                "reads": 0,
+                "throttled": 0,
+                "conflicts": 0,
+                "saves": 0,
+                "queries": 0,
+                "bytes": 0,
+            },
+        }
+    )
+
+
+def _bump(entry, dashboard=None):
+    """Store a new revision of a dashboard entry. Callers hold LOCK."""
+    STATE["next_rv"] += 1
+    entry["version"] += 1
+    entry["rv"] = str(STATE["next_rv"])
+    entry["updated"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    if dashboard is not None:
+        entry["dashboard"] = dashboard
+    entry["dashboard"]["version"] = entry["version"]
+
+
+def _frames(points, series, step_ms, mixed=False):
+    """Encoded frames list for one query: `series` frames of `points` rows each."""
+    key = (points, series, step_ms, mixed)
+    cached = FRAME_CACHE.get(key)
+    if cached is not None:
+        return cached
+    times = list(range(EPOCH_MS, EPOCH_MS + points * step_ms, step_ms))
+    frames = []
+    for s in range(series):
+        values = [
+            round(100 + 50 * math.sin((i + 7 * s) / 60), 3) for i in range(points)
+        ]
+        labels = {"instance": f"host-{s:03d}", "job": "mock"}
+        if mixed and s % 2:
+            labels["zone"] = f"zone-{s % 3}"
+        frames.append(
+            {
+                "schema": {
+                    "name": f"series-{s}",
+                    "meta": {"type": "timeseries-multi", "typeVersion": [0, 1]},
+                    "fields": [
+                        {
+                            "name": "Time",
+                            "type": "time",
+                            "typeInfo": {"frame": "time.Time"},
+                        },
+                        {
+                            "name": "Value",
+                            "type": "number",
+                            "typeInfo": {"frame": "float64"},
+                            "labels": labels,
+                        },
+                    ],
+                },
+                "data": {"values": [times, values]},
+            }
+        )
+    encoded = json.dumps(frames, separators=(",", ":"))
+    with LOCK:
+        if len(FRAME_CACHE) >= FRAME_CACHE_MAX:
+            FRAME_CACHE.pop(next(iter(FRAME_CACHE)))
+        FRAME_CACHE[key] = encoded
+    return encoded
+
+
+def _k8s_resource(uid, entry, metadata_only=False):
+    annotations = {
+        "grafana.app/updatedTimestamp": entry["updated"],
+        "grafana.app/schemaVersion": str(entry["dashboard"].get("schemaVersion", 39)),
+    }
+    if entry["folder"]:
+        annotations["grafana.app/folder"] = entry["folder"]
+    res = {
+        "kind": "Dashboard",
+        "apiVersion": "dashboard.grafana.app/v1beta1",
+        "metadata": {
+            "name": uid,
+            "namespace": "default",
+            "resourceVersion": entry["rv"],
+            "generation": entry["version"],
+            "creationTimestamp": "2026-10-01T12:00:00Z",
+            "annotations": annotations,
+        },
+    }
+    if not metadata_only:
+        spec = {k: v for k, v in entry["dashboard"].items() if k not in ("uid", "id")}
+        res["spec"] = spec
+    return res
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like a real Grafana behind a proxy
+    reqlog = None
+
+    def log_message(self, format, *args):  # silence default stderr logging
+        pass
+
+    # -- helpers ----------------------------------------------------------
+    def _read_body(self):
+        n = int(self.headers.get("Content-Length", 0) or 0)
+        raw = self.rfile.read(n) if n else b""
+        if not raw:
+            return None
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return None
+
+    def _send(self, code, obj=None, headers=None, raw=None):
+        data = (
+            raw
+            if raw is not None
+            else json.dumps(obj if obj is not None else {}).encode()
+        )
+        if CONFIG["latency_ms"]:
+            time.sleep(CONFIG["latency_ms"] / 1000)
+        self.send_response(code)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        with LOCK:
+            STATE["stats"]["bytes"] += len(data)
+        if self.reqlog:
+            with LOCK, open(self.reqlog, "a") as f:
+                f.write(f"{self.command} {self.path} {code}\n")
+
+    def _throttled(self, read):
+        """True (and counted) when this read is the Nth one and must get a 429."""
+        with LOCK:
+            STATE["stats"]["requests"] += 1
+            if not read:
+                return False
+            STATE["stats"]["reads"] += 1
+            every = CONFIG["throttle_every"]
+            if every and STATE["stats"]["reads"] % every == 0:
+                STATE["stats"]["throttled"] += 1
+                return True
+        return False
+
+    # -- dispatch ---------------------------------------------------------
+    def do_GET(self):
+        self._route("GET", None)
+
+    def do_POST(self):
+        self._route("POST", self._read_body())
+
+    def do_PUT(self):
+        self._route("PUT", self._read_body())
+
+    def do_DELETE(self):
+        self._route("DELETE", None)
+
+    def _route(self, method, body):
+        u = urlparse(self.path)
+        path, q = u.path, parse_qs(u.query)
+
+        if path.startswith("/_mock/"):
+            return self._control(method, path, body or {})
+
+        read = method == "GET" or path == "/api/ds/query"
+        if self._throttled(read):
+            return self._send(
+                429, {"message": "Too many requests"}, {"Retry-After": "0"}
+            )
+
+        if path == "/api/health":
+            return self._send(200, {"database": "ok", "version": "12.0.0-mock"})
+        if path == "/api/datasources":
+            return self._send(200, DATASOURCES)
+        m = re.match(r"^/api/datasources/uid/([^/]+)$", path)
+        if m:
+            ds = next((d for d in DATASOURCES if d["uid"] == m.group(1)), None)
+            return (
+                self._send(200, ds)
+                if ds
+                else self._send(404, {"message": "Data source not found"})
+            )
+        if path == "/api/folders":
+            return self._send(200, list(STATE["folders"].values()))
+        if path == "/api/search":
+            return self._search(q)
+        if path == "/api/ds/query" and method == "POST":
+            return self._query(body or {})
+        if path == "/api/dashboards/db" and method == "POST":
+            return self._save_legacy(body or {})
+        m = re.match(r"^/api/dashboards/uid/([^/]+)(/versions)?$", path)
+        if m:
+            return self._dashboard_legacy(method, m.group(1), bool(m.group(2)))
+        if path.startswith(K8S_BASE):
+            if CONFIG["api"] != "k8s":
+                return self._send(404, {"message": "Not found"})
+            return self._k8s(method, path[len(K8S_BASE) :], q, body)
+        return self._send(404, {"message": f"unmapped {method} {path}"})
+
+    def _control(self, method, path, body):
+        with LOCK:
+            if path == "/_mock/config" and method == "POST":
+                _reset(**body)
+                return self._send(200, dict(CONFIG))
+            if path == "/_mock/touch" and method == "POST":
+                touched = []
+                for uid in body.get("uids", []):
+                    entry = STATE["dashboards"].get(uid)
+                    if entry is None:
+                        continue
+                    dashboard = json.loads(json.dumps(entry["dashboard"]))
+                    if dashboard.get("panels"):
+                        dashboard["panels"][-1]["title"] += " (edited elsewhere)"
+                    _bump(entry, dashboard)
+                    touched.append(uid)
+                return self._send(200, {"touched": touched})
+            if path == "/_mock/stats":
+                return self._send(200, dict(STATE["stats"]))
+        return self._send(404, {"message": f"unmapped {method} {path}"})
+
+    # -- search / legacy dashboards ----------------------------------------
+    def _search(self, q):
+        kind = q.get("type", ["dash-db"])[0]
+        limit = int(q.get("limit", ["1000"])[0])
+        page = int(q.get("page", ["1"])[0])
+        needle = q.get("query", [""])[0].lower()
+        tag = q.get("tag", [None])[0]
+        if kind == "dash-folder":
+            hits = [
+                {
+                    "uid": f["uid"],
+                    "title": f["title"],
+                    "type": "dash-folder",
+                    "folderUid": f["parentUid"],
+                }
+                for f in STATE["folders"].values()
+            ]
+        else:
+            hits = [
+                {
+                    "uid": uid,
+                    "title": e["dashboard"]["title"],
+                    "type": "dash-db",
+                    "tags": e["dashboard"].get("tags", []),
+                    "folderUid": e["folder"],
+                }
+                for uid, e in sorted(STATE["dashboards"].items())
+            ]
+        hits = [
+            h
+            for h in hits
+            if needle in h["title"].lower()
+            and (tag is None or tag in h.get("tags", []))
+        ]
+        return self._send(200, hits[(page - 1) * limit : page * limit])
+
+    def _dashboard_legacy(self, method, uid, versions):
+        entry = STATE["dashboards"].get(uid)
+        if entry is None:
+            return self._send(404, {"message": "Dashboard not found"})
+        if versions:
+            return self._send(
+                200,
+                {
+                    "versions": [
+                        {"version": entry["version"], "created": entry["updated"]}
+                    ]
+                },
+            )
+        if method == "DELETE":
+            with LOCK:
+                STATE["dashboards"].pop(uid, None)
+            return self._send(
+                200,
+                {"title": entry["dashboard"]["title"], "message": "Dashboard deleted"},
+            )
+        dashboard = dict(entry["dashboard"], uid=uid, version=entry["version"])
+        meta = {
+            "version": entry["version"],
+            "updated": entry["updated"],
+            "folderUid": entry["folder"],
+            "slug": uid,
+        }
+        return self._send(200, {"dashboard": dashboard, "meta": meta})
+
+    def _save_legacy(self, body):
+        dashboard = dict(body.get("dashboard") or {})
+        with LOCK:
+            uid = dashboard.get("uid")
+            entry = STATE["dashboards"].get(uid) if uid else None
+            if entry is not None and not body.get("overwrite"):
+                if dashboard.get("version") != entry["version"]:
+                    STATE["stats"]["conflicts"] += 1
+                    return self._send(
+                        412,
+                        {
+                            "status": "version-mismatch",
+                            "message": "The dashboard has been changed by someone else",
+                        },
+                    )
+            if entry is None:
+                if not uid:
+                    STATE["next_uid"] += 1
+                    uid = f"new-{STATE['next_uid']:04d}"
+                entry = {
+                    "dashboard": {},
+                    "folder": None,
+                    "version": 0,
+                    "rv": "0",
+                    "updated": "",
+                }
+                STATE["dashboards"][uid] = entry
+            dashboard["uid"] = uid
+            entry["folder"] = body.get("folderUid", entry["folder"])
+            _bump(entry, dashboard)
+            STATE["stats"]["saves"] += 1
+            version = entry["version"]
+        return self._send(
+            200,
+            {
+                "id": 1,
+                "uid": uid,
+                "url": f"/d/{uid}",
+                "status": "success",
+                "version": version,
+                "slug": uid,
+            },
+        )
+
+    # -- K8s-style dashboards ----------------------------------------------
+    def _k8s(self, method, sub, q, body):
+        if sub in ("", "/"):
+            return self._send(
+                200,
+                {
+                    "kind": "APIResourceList",
+                    "groupVersion": "dashboard.grafana.app/v1beta1",
+                },
+            )
+        m = re.match(r"^/namespaces/([^/]+)/dashboards(?:/([^/]+))?$", sub)
+        if not m:
+            return self._send(404, {"message": "Not found"})
+        name = m.group(2)
+        if name is None and method == "GET":
+            limit = int(q.get("limit", ["500"])[0])
+            start = int(q.get("continue", ["0"])[0])
+            metadata_only = "PartialObjectMetadataList" in self.headers.get(
+                "Accept", ""
+            )
+            uids = sorted(STATE["dashboards"])
+            page = uids[start : start + limit]
+            items = [
+                _k8s_resource(u, STATE["dashboards"][u], metadata_only) for u in page
+            ]
+            meta = {"continue": str(start + limit)} if start + limit < len(uids) else {}
+            return self._send(
+                200, {"kind": "DashboardList", "metadata": meta, "items": items}
+            )
+        if name is None and method == "POST":
+            name = (body or {}).get("metadata", {}).get("name")
+            with LOCK:
+                if not name:
+                    STATE["next_uid"] += 1
+                    name = f"new-{STATE['next_uid']:04d}"
+                entry = {
+                    "dashboard": {},
+                    "folder": None,
+                    "version": 0,
+                    "rv": "0",
+                    "updated": "",
+                }
+                STATE["dashboards"][name] = entry
+            return self._put_k8s(name, body or {}, create=True)
+        entry = STATE["dashboards"].get(name)
+        if entry is None:
+            return self._send(
+                404,
+                {
+                    "kind": "Status",
+                    "reason": "NotFound",
+                    "code": 404,
+                    "message": f'dashboards "{name}" not found',
+                },
+            )
+        if method == "GET":
+            return self._send(200, _k8s_resource(name, entry))
+        if method == "DELETE":
+            with LOCK:
+                STATE["dashboards"].pop(name, None)
+            return self._send(200, {"kind": "Status", "status": "Success"})
+        if method == "PUT":
+            return self._put_k8s(name, body or {})
+        return self._send(405, {"message": "Method not allowed"})
+
+    def _put_k8s(self, name, body, create=False):
+        metadata = body.get("metadata") or {}
+        with LOCK:
+            entry = STATE["dashboards"][name]
+            rv = metadata.get("resourceVersion")
+            if not create and rv is not None and rv != entry["rv"]:
+                STATE["stats"]["conflicts"] += 1
+                return self._send(
+                    409,
+                    {
+                        "kind": "Status",
+                        "status": "Failure",
+                        "reason": "Conflict",
+                        "code": 409,
+                        "message": (
+                            f'Operation cannot be fulfilled on dashboards.dashboard.grafana.app "{name}": '
+                            "the object has been modified; please apply your changes to the latest version and try again"
+                        ),
+                    },
+                )
+            folder = (metadata.get("annotations") or {}).get("grafana.app/folder")
+            entry["folder"] = folder or entry["folder"]
+            _bump(entry, dict(body.get("spec") or {}, uid=name))
+            STATE["stats"]["saves"] += 1
+            resource = _k8s_resource(name, entry)
+        return self._send(201 if create else 200, resource)
+
+    # -- data queries -------------------------------------------------------
+    def _query(self, body):
+        parts = []
+        for query in body.get("queries", []):
+            ref_id = query.get("refId", "A")
+            if query.get("mockError"):
+                error = json.dumps(str(query["mockError"]))
+                parts.append(f'{json.dumps(ref_id)}:{{"error":{error},"status":400}}')
+                continue
+            points = int(
+                query.get("points")
+                or CONFIG["points"]
+                or query.get("maxDataPoints")
+                or 1000
+            )
+            series = int(query.get("series") or CONFIG["series"])
+            step_ms = int(query.get("intervalMs") or 1000)
+            frames = _frames(points, series, step_ms, bool(query.get("mixedLabels")))
+            parts.append(f'{json.dumps(ref_id)}:{{"status":200,"frames":{frames}}}')
+        with LOCK:
+            STATE["stats"]["queries"] += len(parts)
+        return self._send(200, raw=('{"results":{' + ",".join(parts) + "}}").encode())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Grafana HTTP API")
+    parser.add_argument("portfile")
+    parser.add_argument("reqlog", nargs="?")
+    parser.add_argument("--dashboards", type=int, default=CONFIG["dashboards"])
+    parser.add_argument("--panels", type=int, default=CONFIG["panels"])
+    parser.add_argument("--folders", type=int, default=CONFIG["folders"])
+    parser.add_argument("--points", type=int, default=CONFIG["points"])
+    parser.add_argument("--series", type=int, default=CONFIG["series"])
+    parser.add_argument("--api", choices=("legacy", "k8s"), default=CONFIG["api"])
+    parser.add_argument("--throttle-every", type=int, default=CONFIG["throttle_every"])
+    parser.add_argument("--latency-ms", type=int, default=CONFIG["latency_ms"])
+    opts = parser.parse_args()
+    with LOCK:
+        _reset(**{k: v for k, v in vars(opts).items() if k in CONFIG})
+    Handler.reqlog = opts.reqlog
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.daemon_threads = True
+    port = httpd.server_address[1]
+    with open(opts.portfile, "w") as f:
+        f.write(str(port))
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+#!/usr/bin/env bash
+# Startup test for the grafana skill: runs grafana.py under `python -X importtime` for the
+# commands an agent calls most and asserts that (a) heavy modules are only imported by the
+# commands that need them, (b) the script's own imports stay within a time budget and
+# (c) the implementation (grafana_cli.py) is loaded from cached bytecode, so a `--help`
+# costs little more wall time than starting the interpreter.
+# No Grafana and no network needed; offline commands run without httpx installed.
+#
+# Usage: tests/startup_test.sh   (GRAFANA_STARTUP_BUDGET_MS=50, GRAFANA_STARTUP_WALL_MS=100,
+#                                 PYTHON=python3)
+set -uo pipefail
+
+HERE="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+SCRIPT="$(cd "$HERE/.." && pwd)/scripts/grafana.py"
+PYTHON="${PYTHON:-python3}"
+BUDGET_MS="${GRAFANA_STARTUP_BUDGET_MS:-50}"
+WALL_MS="${GRAFANA_STARTUP_WALL_MS:-100}"
+
+TMP="$(mktemp -d)"
+export GRAFANA_CACHE_DIR="$TMP/cache"
+unset GRAFANA_URL GRAFANA_TOKEN
+# Measure what users get: bytecode compiled on the first call, then reused.
+unset PYTHONDONTWRITEBYTECODE
+export PYTHONPYCACHEPREFIX="$TMP/pycache"
+
+pass=0; fail=0
+ok(){ echo "  PASS: $1"; pass=$((pass+1)); }
+no(){ echo "  FAIL: $1"; fail=$((fail+1)); }
+
+cleanup(){ rm -rf "$TMP"; }
+trap cleanup EXIT
+
+echo '{"title": "Startup", "uid": "startup", "panels": []}' >"$TMP/dash.json"
+
+# importtime CLI... -> writes the import log of the script's own imports (everything after
+# the interpreter's `site` import) to $TMP/imports and prints their total time in µs.
+importtime(){
+  "$PYTHON" -X importtime "$SCRIPT" "$@" >/dev/null 2>"$TMP/raw" || true
+  awk -F'|' '
+    /^import time: +[0-9]/ { if (seen) print; if ($3 ~ /^ site$/) seen = 1 }
+  ' "$TMP/raw" >"$TMP/imports"
+  # Top-level entries only (no indentation before the name): their cumulative times add up.
+  awk -F'|' '$3 ~ /^ [^ ]/ { s += $2 } END { print s + 0 }' "$TMP/imports"
+}
+
+imported(){ grep -Eq "\| +$1\$" "$TMP/imports"; }
+
+# check NAME BUDGET_US CLI... -- forbidden modules are passed via $FORBIDDEN
+check(){
+  local name="$1"; shift
+  local us; us="$(importtime "$@")"
+  if (( us <= BUDGET_MS * 1000 )); then
+    ok "$name: imports took $((us / 1000)) ms (budget ${BUDGET_MS} ms)"
+  else
+    no "$name: imports took $((us / 1000)) ms (budget ${BUDGET_MS} ms)"
+    sort -t'|' -k2 -n "$TMP/imports" | tail -5 | sed 's/^/        /'
+  fi
+  local mod bad=()
+  for mod in $FORBIDDEN; do imported "$mod" && bad+=("$mod"); done
+  [[ ${#bad[@]} -eq 0 ]] && ok "$name: no heavy imports" || no "$name: imported ${bad[*]}"
+}
+
+# best_ms CMD... -> fastest of 5 runs of CMD in ms, wall clock
+best_ms(){
+  "$PYTHON" - "$@" <<'PY'
+import subprocess, sys, time
+runs = []
+for _ in range(5):
+    start = time.perf_counter()
+    subprocess.run(sys.argv[1:], stdout=subprocess.DEVNULL, check=False)
+    runs.append(time.perf_counter() - start)
+print(round(min(runs) * 1000))
+PY
+}
+
+echo "== bytecode cache =="
+"$PYTHON" "$SCRIPT" --help >/dev/null
+if [[ -n "$(find "$TMP/pycache" -name 'grafana_cli.*.pyc' 2>/dev/null)" ]]; then
+  ok "grafana_cli.py bytecode is cached after the first call"
+else
+  no "grafana_cli.py bytecode is not cached (is the code back in the __main__ script?)"
+fi
+
+echo "== offline and trivial commands =="
+FORBIDDEN="httpx ssl yaml pyarrow sqlite3 concurrent.futures"
+check "--help" --help
+check "validate --file" validate --file "$TMP/dash.json"
+check "convert" convert --file "$TMP/dash.json" --to k8s --output "$TMP/k8s.json"
+check "cache info" cache info
+check "health without credentials" health
+
+echo "== wall clock =="
+bare="$(best_ms "$PYTHON" -c pass)"
+help="$(best_ms "$PYTHON" "$SCRIPT" --help)"
+msg="--help: ${help} ms, $((help - bare)) ms over a bare interpreter (budget ${WALL_MS} ms)"
+(( help - bare <= WALL_MS )) && ok "$msg" || no "$msg"
+
+echo
+echo "== $pass passed, $fail failed =="
+[[ $fail -eq 0 ]]